@@ -1,135 +1,291 @@
 from csv import reader
-import re
+from collections import deque
+from itertools import islice
+from multiprocessing import Pool
+import argparse
 import os
-import sys
+import shutil
+
+import bptree
+import codec
+import pageformat
+import querycache
+import zonemap
+from bufferpool import POLICIES
+from dbfile import DBFile
+from fsm import FreeSpaceMap, fraction_needed, write_free_space_map
+from page import Page
+
+BATCH_SIZE = 1024  # the number of rows encoded at once
 
 
 def record_structure(ls):
     """
-    This function is for converting a list of field values into record structure in characters
+    This function is for converting a list of field values into record structure in characters. The record structure
+    is described in codec.py.
     :param ls: the list of field values [name, type, date, quantity]
     :return: record structure in characters
     """
+    return codec.encode_record(ls)
 
-    # extract values from the list
-    name = ls[0]
-    chip_type = ls[1]
-    date = ls[2]
-    quantity = ls[3]
-
-    # create strings respectively for pairs, bitmap, and data
-    # pairs + bitmap = metadata
-    data = ""
-    pairs = ""
-    bitmap = ""
-
-    """
-    The record structure is in the form of:
-        aabbccddeeeefffgggggggggghhhhhhiiiii
-            where:
-                aa: offset for name (2-digit characters); if name not available, replace by ".."
-                bb: length for name (2-digit characters); if name not available, replace by ".."
-                cc: offset for quantity of transistors (2-digit characters); if quantity not available, replace by ".."
-                dd: length for quantity of transistors (2-digit characters); if quantity not available, replace by ".."
-                eeee: bitmap respectively for type, date, name, quantity (4-byte characters)
-                fff: chip type (3-byte characters); if not available, replace by "..."
-                gggggggggg: date (10-byte characters); if not available, replace by ".........."
-                hhhhhh: name (variable-length); if not available, discard this part
-                iiiii: quantity (variable-length); if not available, discard this part
-    """
-
-    # chip_type
-    if chip_type == "CPU" or chip_type == "GPU":
-        data += chip_type
-        bitmap += "0"
-    else:
-        data += "..."
-        bitmap += "1"
-
-    # date
-    date_pattern = re.compile(r'\d{4}-\d{2}-\d{2}')  # valid value of date must match the date pattern
-    if date_pattern.match(date):
-        data += date
-        bitmap += "0"
-    else:
-        data += ".........."
-        bitmap += "1"
-
-    # name
-    name_offset = 8 + 4 + 3 + 10  # (offset, length) pairs + bitmap + "type" + "date" = 4 * 2 + 4 + 3 + 10
-    name_length = len(name)
-    if name_length == 0:
-        pairs += "...."
-        bitmap += "1"
-    else:
-        pairs += "%02d" % name_offset  # add leading 0's to offset
-        pairs += "%02d" % name_length  # add leading 0's to length
-        data += name
-        bitmap += "0"
-
-    # quantity
-    quantity_pattern = re.compile(r'[0-9]+')  # valid value of quantity must be an integer
-    if quantity_pattern.match(quantity):
-        bitmap += "0"
-        quantity_offset = name_offset + name_length
-        quantity_length = len(quantity)
-        data += quantity
-        pairs += "%02d" % quantity_offset  # add leading 0's to offset
-        pairs += "%02d" % quantity_length  # add leading 0's to length
-    else:
-        bitmap += "1"
-        pairs += "...."
 
-    return pairs + bitmap + data
+def load_rows(rows, fp, window=None, cutoff=0):
+    """
+    This function is to pack rows into pages and append the pages to an opened DB file. Pages are kept in an in-memory
+    window and appended to the file as soon as they leave it, together with their zone maps, which go to a ZoneSpill;
+    the index entries are spilled to sorted runs (see bptree.EntrySpill), so memory is bounded by the window rather
+    than the file size. A page leaves the window once it is the oldest page and either its free-space fraction has
+    dropped to the cutoff or the window holds more than the allowed number of pages. Records are placed first-fit
+    among the pages in the window; with no window limit and a cutoff of 0 this is the same placement as first-fit over
+    the whole file.
+    :param rows: an iterable of lists of field values [name, type, date, quantity]
+    :param fp: the DB file opened for binary writing
+    :param window: the maximum number of pages held in memory (None for no limit)
+    :param cutoff: pages whose free-space fraction is at most this value are written out
+    :return: a tuple (free-space map, EntrySpill of the index entries (quantity, block#, slot#), ZoneSpill of the zone
+             maps, number of records)
+    """
+    # Initialize variables
+    blocks = deque([Page()])  # blocks: the pages in the window, i.e. block# flushed to len(free_space_map) - 1
+    window_zones = deque([zonemap.new_zone()])  # window_zones: the zone maps of the pages in the window
+    flushed = 0  # flushed: the number of pages already appended to the DB file
+    free_space_map = FreeSpaceMap([15])
+    index_entries = bptree.EntrySpill()  # index_entries: (quantity, block#, slot#) for the B+-tree index on quantity
+    zones = zonemap.ZoneSpill()  # zones: the zone maps of the pages written out
 
+    total_record = 0
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, BATCH_SIZE))
+        if not batch:
+            break
+        # transfer the batch of field values to record structures, stored back to back in one buffer
+        buffer, lengths = codec.encode_rows(batch)
+        buffer = memoryview(buffer)
+        position = 0
+        for row, length in zip(batch, lengths):
+            total_record += 1
+            record = buffer[position: position + length]
+            position += length
+            needed = fraction_needed(length)
+            if needed >= 16:
+                raise ValueError("Record of row %d does not fit into a block: %s" % (total_record, bytes(record)))
+            # find the first block in the window that can take the record, or start a new block; the fraction is
+            # rounded down, but the slot entry may still tip the record over
+            i = free_space_map.first_fit(needed, flushed)
+            while i != -1 and not blocks[i - flushed].has_room(length):
+                i = free_space_map.first_fit(needed, i + 1)
+            if i == -1:
+                blocks.append(Page())
+                window_zones.append(zonemap.new_zone())
+                i = free_space_map.append(15)
+            block = blocks[i - flushed]
+            slot = block.insert(record)  # insert record structure and its slot
+            if codec.QUANTITY_PATTERN.fullmatch(row[3]):
+                index_entries.append((int(row[3]), i, slot))
+            zonemap.add_record(window_zones[i - flushed], record, row[3])
+            free_space_map[i] = block.fraction()  # update the value for free-space map
+            # Append the oldest pages to the DB file once they are full enough or fall out of the window
+            while blocks and (free_space_map[flushed] <= cutoff or (window is not None and len(blocks) > window)):
+                fp.write(blocks.popleft().to_bytes() + b"\n")
+                zones.append(window_zones.popleft())
+                flushed += 1
 
-def main(filepath):
-    # Initialize variables
-    blocks = [["0", "0", "0", "9", "9", "9"] + ["." for _ in range(1000 - 6)]]
-    free_space_map = [15]
+    # Write the remaining blocks into the file
+    for block, zone in zip(blocks, window_zones):
+        fp.write(block.to_bytes() + b"\n")
+        zones.append(zone)
+    zones.close()
 
-    with open(filepath, 'r') as read_obj:
-        csv_reader = reader(read_obj)
-        total_record = 0
-        next(csv_reader)  # skip column name row
-        for row in csv_reader:
+    return free_space_map, index_entries, zones, total_record
+
+
+def load_rows_pooled(rows, db):
+    """
+    This function is to insert rows into a DB file through its buffer pool. Records are placed first-fit over the
+    whole file, as load_rows() does without a window, but only the frames of the pool are held in memory: a block that
+    is needed again after it was evicted is read back from the file. The zone maps of all blocks are the ones the
+    DBFile keeps in memory, since a record may go to any block.
+    :param rows: an iterable of lists of field values [name, type, date, quantity]
+    :param db: the DBFile to insert into
+    :return: a tuple (free-space map, EntrySpill of the index entries (quantity, block#, slot#), zone maps, number of
+             records)
+    """
+    index_entries = bptree.EntrySpill()  # index_entries: (quantity, block#, slot#) for the B+-tree index on quantity
+
+    total_record = 0
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, BATCH_SIZE))
+        if not batch:
+            break
+        buffer, lengths = codec.encode_rows(batch)
+        buffer = memoryview(buffer)
+        position = 0
+        for row, length in zip(batch, lengths):
             total_record += 1
-            record = record_structure(row)  # transfer the list of field values to the record structure in characters
-            insert = False
-            while not insert:
-                for i in range(len(blocks)):
-                    if len(record) > free_space_map[i] / 16 * 1000:
-                        continue
-                    block = blocks[i]
-                    num_record = int(''.join(block[:3]))
-                    free_space_end = int(''.join(block[3:6]))
-                    block[(free_space_end + 1 - len(record)): (free_space_end + 1)] = [*record]  # insert record structure
-                    block[3: 6] = [*str(free_space_end - len(record))]  # adjust free space end
-                    block[(6 + num_record * 6): (9 + num_record * 6)] = [*"%03d" % (free_space_end + 1 - len(record))]  # add record offset
-                    block[(9 + num_record * 6): (12 + num_record * 6)] = [*"%03d" % len(record)]  # add record length
-                    num_record += 1
-                    block[0: 3] = [*"%03d" % num_record]  # update the number of records in the block
-                    free_space = free_space_end - len(record) - (num_record * 6 + 6 - 1)
-                    free_space_map[i] = int(free_space / 1000 * 16)  # update the value for free-space map
-                    insert = True
-                    break
-                if insert:
-                    break
-                else:
-                    blocks += [["0", "0", "0", "9", "9", "9"] + ["." for _ in range(1000 - 6)]]
-                    free_space_map += [15]
-
-    # Write blocks into a file
-    for i in range(len(blocks)):
-        blocks[i] = ''.join(blocks[i])
-
-    with open(r'dbfile.txt', 'w') as fp:
-        for block in blocks:
-            fp.write("%s\n" % block)
+            record = buffer[position: position + length]
+            position += length
+            i, slot = db.insert_record(record)
+            if codec.QUANTITY_PATTERN.fullmatch(row[3]):
+                index_entries.append((int(row[3]), i, slot))
+
+    return db.free_space_map, index_entries, db.zones, total_record
+
+
+def split_csv(filepath, workers):
+    """
+    This function is to split the data lines of a CSV file into byte ranges of about the same size. Every range starts
+    at the beginning of a line, so fields must not contain line breaks.
+    :param filepath: the path to the CSV file
+    :param workers: the number of ranges wanted
+    :return: a list of (start, end) byte offsets, without empty ranges
+    """
+    with open(filepath, 'rb') as fp:
+        fp.readline()  # skip column name row
+        start = fp.tell()
+        size = os.fstat(fp.fileno()).st_size
+        boundaries = [start]
+        for k in range(1, workers):
+            fp.seek(max(start, start + (size - start) * k // workers - 1))
+            fp.readline()  # move to the beginning of the next line
+            boundaries += [max(fp.tell(), boundaries[-1])]
+        boundaries += [size]
+    return [(boundaries[k], boundaries[k + 1]) for k in range(workers) if boundaries[k] < boundaries[k + 1]]
+
+
+def read_lines(read_obj, size):
+    """
+    This function is to read the lines of a byte range of a file one at a time, so a worker holds one line of its range
+    in memory rather than the whole range
+    :param read_obj: the file opened in binary mode, positioned at the beginning of the range
+    :param size: the number of bytes in the range, which ends at the end of a line
+    :return: a generator of the lines as strings, with their line breaks
+    """
+    while size > 0:
+        line = read_obj.readline()
+        if not line:
+            break
+        size -= len(line)
+        yield line.decode()
+
+
+def load_partition(filepath, start, end, part_path, window=None, cutoff=0):
+    """
+    This function is run by every worker of a parallel load. It packs the rows in a byte range of the CSV file into
+    its own page file, numbering its blocks from 0.
+    :param filepath: the path to the CSV file
+    :param start: the byte offset of the first line of the range
+    :param end: the byte offset just after the last line of the range
+    :param part_path: the path to the page file of the worker
+    :param window: see load_rows()
+    :param cutoff: see load_rows()
+    :return: a tuple (free-space fractions, EntrySpill of the index entries (quantity, block#, slot#) with every
+             entry in run files, ZoneSpill of the zone maps, number of records)
+    """
+    with open(filepath, 'rb') as read_obj, open(part_path, 'wb') as fp:
+        read_obj.seek(start)
+        free_space_map, index_entries, zones, total_record = load_rows(reader(read_lines(read_obj, end - start)), fp,
+                                                                       window, cutoff)
+    index_entries.spill()  # the run files are handed over to the main process
+    return list(free_space_map), index_entries, zones, total_record
+
+
+def write_sidecars(db_path, free_space_map, index_entries, zones):
+    """
+    This function is to write the files kept alongside a DB file that was just written: its version, the B+-tree
+    index on quantity, the free-space map and the per-block zone maps. The temporary files of the spills are removed.
+    :param db_path: the path to the DB file
+    :param free_space_map: the free-space fractions of the blocks
+    :param index_entries: the EntrySpill of the index entries (quantity, block#, slot#)
+    :param zones: the zone maps of the blocks, in a list or a ZoneSpill
+    :return: None
+    """
+    # Record the version of the DB file, then build the B+-tree index on quantity alongside it
+    querycache.write_version(db_path)
+    if not bptree.build_index(index_entries, db_path):
+        print("Quantity too large for the index, %s is not built." % bptree.index_path_for(db_path))
+    # Persist the free-space map and the per-block zone maps alongside the DB file
+    write_free_space_map(free_space_map, db_path)
+    if not zonemap.write_zone_maps(zones, db_path):
+        print("Quantity too large for the zone maps, %s is not built." % zonemap.zone_path_for(db_path))
+    index_entries.close()
+    if isinstance(zones, zonemap.ZoneSpill):
+        zones.remove()
+
+
+def main(filepath, window=None, cutoff=0, workers=1, pool_frames=None, pool_policy='lru', page_format='text'):
+    """
+    The main function loads the CSV file into the DB file "dbfile.txt", builds the B+-tree index on quantity and the
+    per-block zone maps, and prints the free-space map. With more than one worker, the CSV file is split into byte
+    ranges that are packed into page files by a process pool; the page files are then concatenated in order, so the
+    blocks of worker k follow those of worker k - 1, and the block numbers in the index are shifted accordingly. With a
+    buffer pool, the rows are inserted into the file through the pool instead (see load_rows_pooled()). In the binary
+    page format (see pageformat.py) the rows are packed in memory and written in one go, serially; window, cutoff,
+    workers and pool_frames do not apply to it.
+    :param filepath: the path to the CSV file
+    :param window: the maximum number of pages held in memory (None for no limit), per worker
+    :param cutoff: pages whose free-space fraction is at most this value are written out
+    :param workers: the number of worker processes
+    :param pool_frames: the number of frames of the buffer pool, or None to load through the window
+    :param pool_policy: the replacement policy of the buffer pool, "lru" or "clock"
+    :param page_format: "text" for the 1000-character blocks, or "binary" for the 4 KB binary pages
+    :return: None
+    """
+    if pool_frames is not None and pool_frames < 1:
+        # checked before dbfile.txt is truncated
+        raise ValueError("pool_frames must be 1 or more, got %d" % pool_frames)
+    ranges = split_csv(filepath, workers) if workers > 1 and pool_frames is None and page_format == 'text' else []
+    pool_report = None
+    if page_format == 'binary':
+        with open(filepath, 'r') as read_obj, open(r'dbfile.txt', 'wb') as fp:
+            csv_reader = reader(read_obj)
+            next(csv_reader)  # skip column name row
+            free_space_map, index_entries, zones, total_record = pageformat.write_pages(csv_reader, fp)
+    elif pool_frames is not None:
+        # start from a file holding one empty block, as load_rows() does
+        with open(r'dbfile.txt', 'wb') as fp:
+            fp.write(Page().to_bytes() + b"\n")
+        db = DBFile(r'dbfile.txt', pool_frames, pool_policy, sidecars=False)  # the sidecars are written below
+        with open(filepath, 'r') as read_obj, db:
+            csv_reader = reader(read_obj)
+            next(csv_reader)  # skip column name row
+            free_space_map, index_entries, zones, total_record = load_rows_pooled(csv_reader, db)
+        pool_report = db.pool.report()
+    elif len(ranges) > 1:
+        part_paths = [r'dbfile.txt.part%d' % k for k in range(len(ranges))]
+        with Pool(min(workers, len(ranges))) as pool:
+            results = pool.starmap(load_partition, [(filepath, start, end, part_path, window, cutoff)
+                                                    for (start, end), part_path in zip(ranges, part_paths)])
+        # Concatenate the page files and renumber their blocks
+        free_space_map = []
+        index_entries = bptree.EntrySpill()
+        zones = zonemap.ZoneSpill()
+        total_record = 0
+        with open(r'dbfile.txt', 'wb') as fp:
+            for part_path, (fractions, entries, part_zones, count) in zip(part_paths, results):
+                index_entries.take(entries, len(free_space_map))
+                free_space_map += fractions
+                for zone in part_zones:
+                    zones.append(zone)
+                part_zones.remove()
+                total_record += count
+                with open(part_path, 'rb') as part:
+                    shutil.copyfileobj(part, fp)
+                os.remove(part_path)
+    else:
+        with open(filepath, 'r') as read_obj, open(r'dbfile.txt', 'wb') as fp:
+            csv_reader = reader(read_obj)
+            next(csv_reader)  # skip column name row
+            free_space_map, index_entries, zones, total_record = load_rows(csv_reader, fp, window, cutoff)
+
+    write_sidecars(r'dbfile.txt', free_space_map, index_entries, zones)
 
     # Print related information
     print("Total number of record: %d" % total_record)
     print("Total number of blocks: %d" % len(free_space_map))
+    if pool_report is not None:
+        print(pool_report)
     print("")
     print("Free-space Map: ")
     print("{:<8} {:<5}".format('Block#', 'Fraction'))
@@ -138,9 +294,36 @@ def main(filepath):
 
 
 if __name__ == '__main__':
-    fn = sys.argv[1]
+    parser = argparse.ArgumentParser(description="Load a CSV file of chips into the slotted-page file dbfile.txt.")
+    parser.add_argument('filepath', help="the CSV file to load")
+    parser.add_argument('--window', type=int, default=None,
+                        help="the maximum number of pages kept in memory while loading (default: no limit)")
+    parser.add_argument('--cutoff', type=int, default=0, choices=range(16), metavar='{0..15}',
+                        help="write out a page once its free-space fraction is at most this value (default: 0)")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="the number of processes packing pages in parallel (default: 1)")
+    parser.add_argument('--pool-frames', type=int, default=None,
+                        help="insert through a buffer pool of this many blocks instead of the window; "
+                             "the load is then serial")
+    parser.add_argument('--pool-policy', choices=sorted(POLICIES), default='lru',
+                        help="the replacement policy of the buffer pool (default: lru)")
+    parser.add_argument('--format', dest='page_format', choices=['text', 'binary'], default='text',
+                        help="the page format of dbfile.txt (default: text); the binary format is loaded serially in "
+                             "memory and does not take --window, --cutoff, --workers or --pool-frames")
+    args = parser.parse_args()
+    if args.window is not None and args.window < 1:
+        parser.error("--window must be 1 or more")
+    if args.workers < 1:
+        parser.error("--workers must be 1 or more")
+    if args.pool_frames is not None and args.pool_frames < 1:
+        parser.error("--pool-frames must be 1 or more")
+    if args.page_format == 'binary' and (args.window is not None or args.cutoff or args.workers > 1
+                                         or args.pool_frames is not None):
+        parser.error("--format binary cannot be combined with --window, --cutoff, --workers or --pool-frames")
+    fn = args.filepath
     if os.path.exists(fn):
         print("Processing file: " + fn)
-        main(fn)
+        main(fn, window=args.window, cutoff=args.cutoff, workers=args.workers, pool_frames=args.pool_frames,
+             pool_policy=args.pool_policy, page_format=args.page_format)
     else:
         print("File does not exist!")
@@ -1,72 +1,189 @@
-import sys
+import argparse
 import os
 
+import bptree
+import codec
+import engine
+import pageformat
+import zonemap
+from querycache import QueryCache
+from blockfile import BlockFile
+from bufferpool import POLICIES, PooledBlocks
+
 
 def tuple_in_record(record):
     """
-    This function is for converting record structure into a tuple of field values
+    This function is for converting record structure into a tuple of field values. The record structure is described
+    in codec.py.
     :param record: the record structure in characters
     :return: the tuple of field values (name, type, date, quantity)
     """
+    return codec.decode_record(record)
 
-    # extract bitmap
-    bitmap = record[8:12]
 
-    # For each field, first check the corresponding value in bitmap
-    # type
-    if bitmap[0] == "0":
-        chip_type = record[12:15]
-    else:
-        chip_type = ""
+def block_header(block):
+    """
+    This function is to read the header of a block, in the text or the binary page format
+    :param block: the block bytes (a memoryview slice of the DB file)
+    :return: a tuple (number of records, free space end)
+    """
+    if pageformat.is_binary(block):
+        return pageformat.page_header(block)
+    return int(bytes(block[:3])), int(bytes(block[3:6]))
 
-    # date
-    if bitmap[1] == "0":
-        date = record[15:25]
-    else:
-        date = ""
 
-    # name
-    if bitmap[2] == "0":
-        name_offset = int(record[:2])
-        name_length = int(record[2:4])
-        name = record[name_offset: (name_offset + name_length)]
-    else:
-        name = ""
+def block_summary(block):
+    """
+    This function is to read the header of a block and count its records that are not deleted
+    :param block: the block bytes (a memoryview slice of the DB file)
+    :return: a tuple (number of slots, number of free space bytes, number of records that are not deleted)
+    """
+    count, free_space_end = block_header(block)
+    if pageformat.is_binary(block):
+        deleted = sum(1 for _, length in pageformat.decode_slots(block) if length == 0)
+        return count, pageformat.free_bytes(count, free_space_end), count - deleted
+    directory = bytes(block[6: 6 + 6 * count])
+    deleted = sum(1 for k in range(3, len(directory), 6) if directory[k: k + 3] == b"000")
+    return count, free_space_end - (count * 6 + 6 - 1), count - deleted
 
-    # quantity
-    if bitmap[3] == "0":
-        quantity_offset = int(record[4:6])
-        quantity_length = int(record[6:8])
-        quantity = record[quantity_offset: (quantity_offset + quantity_length)]
-    else:
-        quantity = ""
 
-    return name, chip_type, date, quantity
+def record_at(block, slot):
+    """
+    This function is to extract the field values of the record stored in a slot of a block
+    :param block: the block bytes (a memoryview slice of the DB file)
+    :param slot: the slot# of the record in the block
+    :return: the tuple of field values (name, type, date, quantity)
+    """
+    if pageformat.is_binary(block):
+        offset, length = pageformat.decode_slots(block)[slot]
+        return pageformat.decode_record(block[offset: (offset + length)])
+    offset = int(bytes(block[(6 + 6 * slot): (6 + 6 * slot + 3)]))
+    length = int(bytes(block[(9 + 6 * slot): (9 + 6 * slot + 3)]))
+    return tuple_in_record(str(block[offset: (offset + length)], codec.ENCODING))
 
 
 def records_in_block(block):
     """
     This function is to print filed values for records in a block
-    :param block: the block structure in characters
+    :param block: the block bytes (a memoryview slice of the DB file)
     :return: null
     """
-    records = []
-    num_records = int(block[:3])
-    for i in range(num_records):
-        offset = int(block[(6 + 6 * i): (6 + 6 * i + 3)])
-        length = int(block[(9 + 6 * i): (9 + 6 * i + 3)])
-        record = tuple_in_record(block[offset: (offset + length)])  # extract the field values for each record
-        records += [record]
+    if pageformat.is_binary(block):
+        slots, columns = pageformat.decode_slots(block), pageformat.decode_block(block)
+    else:
+        text = str(block, codec.ENCODING)
+        slots, columns = codec.decode_slots(text), codec.decode_block(text)
+    live = [length != 0 for _, length in slots]  # deleted records are not displayed
+    records = [record for record, alive in zip(zip(*columns), live) if alive]
 
     print("{:<10} {:<40} {:<5} {:<15} {:<5}".format('#', 'Product', 'Type', "Release Date", "Transistors (million)"))
     for num, record in enumerate(records):
         print("{:<10} {:<40} {:<5} {:<15} {:<5}".format(num + 1, record[0], record[1], record[2], record[3]))
 
 
-def main(filepath):
+def scan_range(blocks, m, n, zones=None):
+    """
+    This function is to find the records whose quantity is between m and n by decoding the records of every block
+    whose zone map may hold such a quantity
+    :param blocks: the BlockFile of the DB file
+    :param m: the lower bound of quantity (inclusive)
+    :param n: the upper bound of quantity (inclusive)
+    :param zones: the zone maps of the blocks, or None to decode every block
+    :return: a tuple (list of (block#, slot#, record) in file order, number of blocks skipped by the zone maps)
+    """
+    valid_records = []
+    pruned = 0
+    # iterate through blocks
+    for block_num, block in enumerate(blocks):
+        # skip the block without reading its slots if no quantity in it can be in range
+        if zones is not None and not zonemap.may_contain(zones[block_num], m, n):
+            pruned += 1
+            continue
+        columns = pageformat.decode_block(block) if pageformat.is_binary(block) else codec.decode_block(block)
+        # iterate through records, checking the quantity column first
+        for i, quantity in enumerate(columns[3]):
+            # save record if it saves the conditions on quantity
+            if quantity.isdigit() and m <= int(quantity) <= n:
+                valid_records += [(block_num, i, tuple(column[i] for column in columns))]
+    return valid_records, pruned
 
-    file = open(filepath, 'r')
-    blocks = file.readlines()
+
+def index_range(blocks, index, m, n):
+    """
+    This function is to find the records whose quantity is between m and n through the B+-tree index
+    :param blocks: the BlockFile of the DB file
+    :param index: the BPlusTreeIndex of the DB file
+    :param m: the lower bound of quantity (inclusive)
+    :param n: the upper bound of quantity (inclusive)
+    :return: a list of (block#, slot#, record) in file order, same as the one of scan_range()
+    """
+    # walk the leaves in [M, N] and fetch the records in (block#, slot#) order
+    locations = sorted((block_num, slot) for _, block_num, slot in index.range_search(m, n))
+    return [(block_num, slot, record_at(blocks.block(block_num), slot)) for block_num, slot in locations]
+
+
+def open_access_paths(filepath, blocks, use_index, engine_name):
+    """
+    This function is to open what the range queries need besides the blocks: the B+-tree index if it is up to date,
+    otherwise the zone maps and, if asked for, the columnar engine
+    :param filepath: the path to the DB file
+    :param blocks: the BlockFile of the DB file
+    :param use_index: see main()
+    :param engine_name: see main()
+    :return: a tuple (index or None, zone maps or None, ColumnStore or None)
+    """
+    index = bptree.open_index(filepath) if use_index else None
+    zones = None
+    if index is None:
+        zones = zonemap.read_zone_maps(filepath)
+        if zones is not None and len(zones) != len(blocks):
+            zones = None
+        if use_index:
+            print("No up-to-date index for %s, range queries scan the whole file." % filepath)
+        if zones is None:
+            print("No up-to-date zone maps for %s, every block is decoded." % filepath)
+        if use_index or zones is None:
+            print("")
+    columns = None
+    if index is None and engine_name == 'numpy':
+        if blocks.binary:
+            print("The NumPy engine reads the text page format only, range queries use the row scan.")
+            print("")
+        elif engine.AVAILABLE:
+            columns = engine.ColumnStore(blocks, filepath)
+        else:
+            print("NumPy is not installed, range queries use the row scan.")
+            print("")
+    return index, zones, columns
+
+
+def open_blocks(filepath, pool_frames=None, pool_policy='lru'):
+    """
+    This function is to map the blocks of the DB file, reading them through a buffer pool if one is asked for
+    :param filepath: the path to the DB file
+    :param pool_frames: the number of frames of the buffer pool, or None to read the mapped file directly
+    :param pool_policy: the replacement policy of the buffer pool, "lru" or "clock"
+    :return: the BlockFile, or a PooledBlocks over it
+    """
+    blocks = BlockFile(filepath)
+    return blocks if pool_frames is None else PooledBlocks(blocks, pool_frames, pool_policy)
+
+
+def main(filepath, use_index=True, engine_name='row', cache_size=32, pool_frames=None, pool_policy='lru'):
+    """
+    The main function reports the blocks of the DB file and then answers range queries on quantity interactively.
+    :param filepath: the path to the DB file
+    :param use_index: use the B+-tree index if it is up to date; otherwise, or if False, the range queries scan the
+                      blocks, skipping the ones ruled out by the zone maps
+    :param engine_name: "row" to scan one record at a time, or "numpy" to scan with the columnar engine
+    :param cache_size: the number of query results kept in the LRU cache
+    :param pool_frames: read the blocks through a buffer pool of this many frames (None to read the mapped file
+                        directly); the columnar engine always reads the mapped file
+    :param pool_policy: the replacement policy of the buffer pool, "lru" or "clock"
+    :return: None
+    """
+
+    blocks = open_blocks(filepath, pool_frames, pool_policy)
 
     """
     Part 2
@@ -75,14 +192,14 @@ def main(filepath):
     total_num_records = 0
     free_space = []
     num_records = []
-    for block in blocks:
+    for _, num_free, live in map(block_summary, blocks):
         # 1. The total quantities of blocks and records contained within the DB file.
         num_blocks += 1
-        total_num_records += int(block[:3])
-        num_records += [int(block[:3])]
+        total_num_records += live
+        num_records += [live]
 
         # 2. For each block, display its quantity of free space bytes.
-        free_space += [int(block[3: 6]) - (int(block[:3]) * 6 + 6 - 1)]
+        free_space += [num_free]
 
     print("The total number of blocks: %d" % num_blocks)
     print("The total number of records: %d" % total_num_records)
@@ -96,19 +213,21 @@ def main(filepath):
     # 3. The field values of the records held by the first block, displayed in insertion order (that is, the first
     # record displayed is the first record inserted)
     print("Records in the first block: ")
-    block = blocks[0]
-    records_in_block(block)
+    records_in_block(blocks.block(0))
     print("")
 
     # 4. Same as (3), but for the records within the last block.
     print("Records in the last block: ")
-    block = blocks[-1]
-    records_in_block(block)
+    records_in_block(blocks.block(-1))
     print("")
 
     """
     Part 3
     """
+    # Use the B+-tree index on quantity when it is up to date, otherwise scan the blocks
+    index, zones, columns = open_access_paths(filepath, blocks, use_index, engine_name)
+    cache = QueryCache(filepath, cache_size)
+
     while True:
         # ask for user's inputs for M and N
         m = input("Enter M value: ")
@@ -120,33 +239,73 @@ def main(filepath):
             break
         n = int(n)
 
-        valid_records = []
+        # The DB file was rewritten since the last query: map the new file and drop what belongs to the old one
+        if cache.refresh():
+            print("%s changed, reopening it." % filepath)
+            if index is not None:
+                index.close()
+            if columns is not None:
+                columns.close()
+            blocks.close()
+            blocks = open_blocks(filepath, pool_frames, pool_policy)
+            index, zones, columns = open_access_paths(filepath, blocks, use_index, engine_name)
 
-        # iterate through blocks
-        for block in blocks:
-            num_records = int(block[:3])
-            # iterate through records
-            for i in range(num_records):
-                offset = int(block[(6 + 6 * i): (6 + 6 * i + 3)])
-                length = int(block[(9 + 6 * i): (9 + 6 * i + 3)])
-                record = tuple_in_record(block[offset: (offset + length)])
-                # save record if it saves the conditions on quantity
-                if record[3].isdigit() and m <= int(record[3]) <= n:
-                    valid_records += [record]
+        pruned = None
+        locations = cache.get(m, n)
+        if locations is not None:
+            valid_records = [record_at(blocks.block(block_num), slot) for block_num, slot, _ in locations]
+        else:
+            if index is not None:
+                results = index_range(blocks, index, m, n)
+            elif columns is not None:
+                results = columns.select(columns.quantity_between(m, n))
+            else:
+                results, pruned = scan_range(blocks, m, n, zones)
+            cache.put(m, n, [(block_num, slot, int(record[3])) for block_num, slot, record in results])
+            valid_records = [record for _, _, record in results]
 
         # print the records satisfying the filtering criteria
         print("Records with # Transistors between %d and %d" % (m, n))
         print("{:<10} {:<40} {:<5} {:<15} {:<5}".format('#', 'Product', 'Type', "Release Date", "Transistors (million)"))
         for num, record in enumerate(valid_records):
             print("{:<10} {:<40} {:<5} {:<15} {:<5}".format(num + 1, record[0], record[1], record[2], record[3]))
+        if pruned is not None and zones is not None:
+            print("Zone maps pruned %d of %d blocks." % (pruned, len(blocks)))
         print("")
 
+    if index is not None:
+        index.close()
+    if columns is not None:
+        columns.close()
+    blocks.close()
+    print(cache.report())
+    if pool_frames is not None:
+        print(blocks.pool.report())
+
 
 if __name__ == '__main__':
-    fn = sys.argv[1]
+    parser = argparse.ArgumentParser(description="Report the blocks of a DB file and answer range queries on quantity.")
+    parser.add_argument('filepath', help="the DB file written by Prog1A")
+    parser.add_argument('--no-index', dest='use_index', action='store_false',
+                        help="scan the blocks even if the B+-tree index is up to date")
+    parser.add_argument('--engine', choices=['row', 'numpy'], default='row',
+                        help="how range queries scan the blocks when the index is not used (default: row)")
+    parser.add_argument('--cache-size', type=int, default=32,
+                        help="the number of range query results kept in the LRU cache, 0 disables it (default: 32)")
+    parser.add_argument('--pool-frames', type=int, default=None,
+                        help="read the blocks through a buffer pool of this many blocks (default: no pool)")
+    parser.add_argument('--pool-policy', choices=sorted(POLICIES), default='lru',
+                        help="the replacement policy of the buffer pool (default: lru)")
+    args = parser.parse_args()
+    if args.cache_size < 0:
+        parser.error("--cache-size must be 0 or more")
+    if args.pool_frames is not None and args.pool_frames < 1:
+        parser.error("--pool-frames must be 1 or more")
+    fn = args.filepath
     if os.path.exists(fn):
         print("Processing file: " + fn)
-        main(fn)
+        main(fn, use_index=args.use_index, engine_name=args.engine, cache_size=args.cache_size,
+             pool_frames=args.pool_frames, pool_policy=args.pool_policy)
     else:
         print("File does not exist!")
 
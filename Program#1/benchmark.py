@@ -0,0 +1,542 @@
+"""
+Benchmarks for the slotted-page DB file programs.
+
+    python3 benchmark.py fsm [--rows 10000 100000 1000000] [--linear-max 100000] [--linear-sample 1000]
+        Compares first-fit placement with the linear free-space-map scan Prog1A used to do against the segment tree
+        in fsm.py, on synthetic record lengths. Both must choose the same block for every record. The linear scan is
+        quadratic, so above --linear-max rows only the last --linear-sample inserts are timed with it, over the blocks
+        the earlier records filled, and its total time is extrapolated from them (marked "~"). The time of
+        Prog1A.load_rows() writing the same number of synthetic chip rows into a DB file is reported as well.
+
+    python3 benchmark.py codec [--rows 100000] [--repeat 3]
+        Records per second of the record codec: one-record vs batched encoding, and one-record vs whole-block
+        decoding, on synthetic chip rows.
+
+    python3 benchmark.py scan [--rows 200000] [--repeat 3]
+        Full-file range scan of Prog1B's row-at-a-time loop against the columnar engine in engine.py (needs NumPy),
+        on a DB file loaded from synthetic chip rows.
+
+    python3 benchmark.py memory [--rows 10000 100000 1000000] [--window 4]
+        Peak RSS of Prog1A loading synthetic CSVs of every size through a window of pages, each load run as its own
+        process. The pages, the index entries and the zone maps are all streamed to disk, so the peak RSS should
+        stay about the same while the DB file grows with the number of rows.
+
+    python3 benchmark.py generate chips-big.csv [--rows 100000] [--null-name 0 --null-type 0 --null-date 0
+                                                 --null-quantity 0.15] [--seed 0]
+        Writes a synthetic chips CSV (with column name row) with the given fraction of null values per field.
+
+    python3 benchmark.py suite [--rows 10000 100000] [--queries 100] [--format text] [null rates as for generate]
+                               [--profile cprofile|tracemalloc]
+        End-to-end run of Prog1A and Prog1B on synthetic CSVs of every size: load throughput, the time of the
+        first / last block report, range queries per second through the index and through the zone-map scan, the
+        number of blocks written, their average fill factor and the peak RSS. Every size runs in a fresh process so
+        that the peak RSS is its own. With --profile, record_structure, the insert loop (Prog1A.load_rows) and
+        tuple_in_record are also run under cProfile or tracemalloc and their top entries are printed.
+"""
+
+import argparse
+import contextlib
+import cProfile
+import csv
+import io
+import os
+import pstats
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from multiprocessing import Pool
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+import bptree
+import codec
+import engine
+import Prog1A
+import Prog1B
+import zonemap
+from blockfile import BlockFile
+from fsm import FreeSpaceMap, fraction_needed
+from page import Page
+
+
+def synthetic_lengths(rows, seed=0):
+    """
+    This function is to generate record lengths distributed like the ones of chips.csv
+    :param rows: the number of records
+    :param seed: the seed of the random generator
+    :return: a list of record lengths
+    """
+    rng = random.Random(seed)
+    return [33 + rng.randint(8, 40) for _ in range(rows)]  # metadata + type + date + name + quantity
+
+
+def synthetic_rows(rows, seed=0, null_rates=(0, 0, 0, 0.15)):
+    """
+    This function is to generate chip rows looking like the ones of chips.csv
+    :param rows: the number of rows
+    :param seed: the seed of the random generator
+    :param null_rates: the fraction of null values of name, type, date and quantity
+    :return: a list of lists of field values [name, type, date, quantity]
+    """
+    rng = random.Random(seed)
+    data = []
+    for _ in range(rows):
+        name = "%s %s %d" % (rng.choice(["Intel Core", "AMD Ryzen", "NVIDIA GeForce", "AMD Radeon", "Intel Xeon"]),
+                             rng.choice(["i3", "i5", "i7", "RTX", "Pro", "E5", "X"]), rng.randint(100, 99999))
+        chip_type = rng.choice(["CPU", "GPU"])
+        date = "%04d-%02d-%02d" % (rng.randint(2000, 2022), rng.randint(1, 12), rng.randint(1, 28))
+        quantity = str(rng.randint(10, 60000)) if rng.random() > null_rates[3] else ""
+        # the other fields only draw from the generator when asked for, so that the default rows stay the same
+        if null_rates[0] and rng.random() < null_rates[0]:
+            name = ""
+        if null_rates[1] and rng.random() < null_rates[1]:
+            chip_type = ""
+        if null_rates[2] and rng.random() < null_rates[2]:
+            date = ""
+        data += [[name, chip_type, date, quantity]]
+    return data
+
+
+def write_csv(path, rows):
+    """
+    This function is to write rows into a CSV file laid out like chips.csv
+    :param path: the path to the CSV file
+    :param rows: a list of lists of field values [name, type, date, quantity]
+    :return: the size of the file in bytes
+    """
+    with open(path, 'w', newline='') as fp:
+        writer = csv.writer(fp)
+        writer.writerow(['Product', 'Type', 'Release Date', 'Transistors (million)'])
+        writer.writerows(rows)
+    return os.path.getsize(path)
+
+
+def pack_blocks(records):
+    """
+    This function is to pack encoded records into blocks one after another
+    :param records: a list of record structures in bytes
+    :return: a list of blocks in bytes
+    """
+    blocks = []
+    page = Page()
+    for record in records:
+        if not page.has_room(len(record)):
+            blocks += [page.to_bytes()]
+            page = Page()
+        page.insert(record)
+    return blocks + [page.to_bytes()]
+
+
+def load_pages(rows, fp):
+    """
+    This function is to write the pages of rows into a DB file with Prog1A.load_rows(), without its sidecar files: the
+    spilled index entries and zone maps are removed
+    :param rows: a list of lists of field values [name, type, date, quantity]
+    :param fp: the DB file opened for binary writing
+    :return: the free-space map
+    """
+    free_space_map, index_entries, zones, _ = Prog1A.load_rows(rows, fp)
+    index_entries.close()
+    zones.remove()
+    return free_space_map
+
+
+def best_time(function, repeat):
+    """
+    This function is to time a function several times
+    :param function: the function to time, called without arguments
+    :param repeat: the number of runs
+    :return: the fastest run in seconds
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times += [time.perf_counter() - start]
+    return min(times)
+
+
+def place_linear(lengths, free_space=None, free_space_map=None):
+    """
+    This function is to place records first-fit by scanning the free-space map from block 0, as Prog1A used to
+    :param lengths: the record lengths
+    :param free_space: the free bytes of the blocks already filled (see block_state()), or None to start empty
+    :param free_space_map: the free-space fractions of the blocks already filled, or None to start empty
+    :return: the block# chosen for every record
+    """
+    free_space = [] if free_space is None else free_space
+    free_space_map = [] if free_space_map is None else free_space_map
+    chosen = []
+    for length in lengths:
+        for i in range(len(free_space_map)):
+            if length > free_space_map[i] / 16 * 1000:
+                continue
+            break
+        else:
+            free_space += [994]
+            free_space_map += [15]
+            i = len(free_space_map) - 1
+        free_space[i] -= length + 6
+        free_space_map[i] = int(free_space[i] / 1000 * 16)
+        chosen += [i]
+    return chosen
+
+
+def place_indexed(lengths):
+    """
+    This function is to place records first-fit through the segment-tree free-space map
+    :param lengths: the record lengths
+    :return: the block# chosen for every record
+    """
+    free_space = []
+    free_space_map = FreeSpaceMap()
+    chosen = []
+    for length in lengths:
+        i = free_space_map.first_fit(fraction_needed(length))
+        if i == -1:
+            free_space += [994]
+            i = free_space_map.append(15)
+        free_space[i] -= length + 6
+        free_space_map[i] = int(free_space[i] / 1000 * 16)
+        chosen += [i]
+    return chosen
+
+
+def block_state(lengths, chosen):
+    """
+    This function is to get the state of the blocks after records were placed, as place_linear() keeps it
+    :param lengths: the record lengths
+    :param chosen: the block# chosen for every record
+    :return: a tuple (list of free bytes, list of free-space fractions), one element per block
+    """
+    free_space = [994] * (max(chosen, default=-1) + 1)
+    for length, i in zip(lengths, chosen):
+        free_space[i] -= length + 6
+    return free_space, [int(value / 1000 * 16) for value in free_space]
+
+
+def bench_fsm(args):
+    print("{:<10} {:<8} {:<12} {:<12} {:<8} {:<12} {:<12}".format(
+        'Rows', 'Blocks', 'Linear (s)', 'Indexed (s)', 'Speedup', 'Load (s)', 'Load (rec/s)'))
+    for rows in args.rows:
+        lengths = synthetic_lengths(rows)
+
+        start = time.perf_counter()
+        indexed = place_indexed(lengths)
+        indexed_time = time.perf_counter() - start
+
+        if rows <= args.linear_max:
+            start = time.perf_counter()
+            linear = place_linear(lengths)
+            linear_time = time.perf_counter() - start
+            assert linear == indexed, "indexed free-space map chose a different block"
+            linear_text = "%.3f" % linear_time
+        else:
+            # time the last inserts over the blocks the earlier records filled; the scan grows about linearly with
+            # the number of blocks, so on average an insert costs about half as much as these
+            head = rows - min(args.linear_sample, rows)
+            free_space, free_space_map = block_state(lengths[:head], indexed[:head])
+            start = time.perf_counter()
+            linear = place_linear(lengths[head:], free_space, free_space_map)
+            sample_time = time.perf_counter() - start
+            assert linear == indexed[head:], "indexed free-space map chose a different block"
+            linear_time = sample_time / (rows - head) * rows / 2
+            linear_text = "~%.3f" % linear_time
+
+        # the real loader path: Prog1A.load_rows() writing the pages of as many chip rows into a DB file
+        data = synthetic_rows(rows)
+        with tempfile.TemporaryDirectory() as directory:
+            with open(os.path.join(directory, 'dbfile.txt'), 'wb') as fp:
+                start = time.perf_counter()
+                load_pages(data, fp)
+                load_time = time.perf_counter() - start
+        del data
+
+        print("{:<10} {:<8} {:<12} {:<12.3f} {:<8.1f} {:<12.3f} {:<12.0f}".format(
+            rows, max(indexed) + 1, linear_text, indexed_time, linear_time / indexed_time, load_time,
+            rows / load_time))
+
+
+def bench_codec(args):
+    rows = synthetic_rows(args.rows)
+    records = [codec.encode_record(row).encode(codec.ENCODING) for row in rows]
+    blocks = [memoryview(block) for block in pack_blocks(records)]
+
+    def decode_each(block):
+        # one slot and one record at a time, the way Prog1B used to read a block
+        text = str(block, codec.ENCODING)
+        decoded = []
+        for i in range(int(text[:3])):
+            offset = int(text[(6 + 6 * i): (6 + 6 * i + 3)])
+            length = int(text[(9 + 6 * i): (9 + 6 * i + 3)])
+            decoded += [codec.decode_record(text[offset: (offset + length)])]
+        return decoded
+
+    results = [
+        ('encode_record', best_time(lambda: [codec.encode_record(row) for row in rows], args.repeat)),
+        ('encode_rows', best_time(lambda: codec.encode_rows(rows), args.repeat)),
+        ('decode_record', best_time(lambda: [decode_each(block) for block in blocks], args.repeat)),
+        ('decode_block', best_time(lambda: [codec.decode_block(block) for block in blocks], args.repeat)),
+    ]
+    print("{:<15} {:<12} {:<15}".format('Function', 'Time (s)', 'Records/s'))
+    for name, seconds in results:
+        print("{:<15} {:<12.3f} {:<15,.0f}".format(name, seconds, args.rows / seconds))
+
+
+def bench_scan(args):
+    if not engine.AVAILABLE:
+        print("NumPy is not installed, there is no columnar engine to compare with.")
+        return
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = os.path.join(directory, 'dbfile.txt')
+        with open(db_path, 'wb') as fp:
+            load_pages(synthetic_rows(args.rows), fp)
+        blocks = BlockFile(db_path)
+        m, n = 1000, 5000
+
+        row_time = best_time(lambda: Prog1B.scan_range(blocks, m, n), args.repeat)
+        columns = None
+
+        def build(db_path=None):
+            nonlocal columns
+            columns = engine.ColumnStore(blocks, db_path)
+        build_time = best_time(build, args.repeat)
+        build(db_path)  # write the column cache
+        load_time = best_time(lambda: build(db_path), args.repeat)
+        assert columns.cached
+        query_time = best_time(lambda: columns.select(columns.quantity_between(m, n)), args.repeat)
+        assert columns.select(columns.quantity_between(m, n)) == Prog1B.scan_range(blocks, m, n)[0]
+
+        print("Range [%d, %d] over %d records in %d blocks" % (m, n, args.rows, len(blocks)))
+        print("{:<28} {:<12} {:<8}".format('Path', 'Time (s)', 'Speedup'))
+        print("{:<28} {:<12.3f} {:<8}".format('row scan', row_time, '1.0'))
+        print("{:<28} {:<12.3f} {:<8.1f}".format('columnar (decode + query)', build_time + query_time,
+                                                 row_time / (build_time + query_time)))
+        print("{:<28} {:<12.3f} {:<8.1f}".format('columnar (cache + query)', load_time + query_time,
+                                                 row_time / (load_time + query_time)))
+        print("{:<28} {:<12.3f} {:<8.1f}".format('columnar (query only)', query_time, row_time / query_time))
+        columns.close()
+        blocks.close()
+
+
+def null_rates(args):
+    return args.null_name, args.null_type, args.null_date, args.null_quantity
+
+
+def bench_generate(args):
+    size = write_csv(args.path, synthetic_rows(args.rows, args.seed, null_rates(args)))
+    print("Wrote %d rows (%d bytes) to %s" % (args.rows, size, args.path))
+
+
+def peak_rss():
+    """
+    This function is to get the peak resident set size of the current process
+    :return: the peak RSS in MB, or None if it cannot be measured on this platform
+    """
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KB on Linux
+
+
+def profile_section(name, function, mode):
+    """
+    This function is to run a function under cProfile or tracemalloc and print its top entries
+    :param name: the name of the section
+    :param function: the function to run, called without arguments
+    :param mode: "cprofile" or "tracemalloc"
+    :return: None
+    """
+    print("--- %s (%s) ---" % (name, mode))
+    if mode == 'cprofile':
+        profiler = cProfile.Profile()
+        profiler.runcall(function)
+        pstats.Stats(profiler).sort_stats('cumulative').print_stats(8)
+    else:
+        tracemalloc.start()
+        result = function()  # kept alive, so that the snapshot shows where it was allocated
+        snapshot = tracemalloc.take_snapshot()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print("Peak traced memory: %.1f KB" % (peak / 1024))
+        for stat in snapshot.statistics('lineno')[:5]:
+            print(stat)
+        print("")
+        del result
+
+
+def run_suite(rows, queries, page_format, rates, profile):
+    """
+    This function is to run the end-to-end benchmark for one CSV size, in a scratch directory
+    :param rows: the number of rows of the synthetic CSV
+    :param queries: the number of range queries
+    :param page_format: the page format of the DB file, "text" or "binary"
+    :param rates: the null rates of name, type, date and quantity
+    :param profile: None, "cprofile" or "tracemalloc"
+    :return: a dict of measurements
+    """
+    data = synthetic_rows(rows, null_rates=rates)
+    result = {'rows': rows}
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        csv_size = write_csv('chips.csv', data)
+
+        # load: Prog1A as run from the command line, its report discarded
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            Prog1A.main('chips.csv', page_format=page_format)
+        seconds = time.perf_counter() - start
+        result['load'] = rows / seconds
+        result['load_mb'] = csv_size / seconds / 2 ** 20
+
+        blocks = BlockFile('dbfile.txt')
+        # report: the block summary, then the records of the first and last block
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            summary = list(map(Prog1B.block_summary, blocks))
+            Prog1B.records_in_block(blocks.block(0))
+            Prog1B.records_in_block(blocks.block(-1))
+        result['report'] = (time.perf_counter() - start) * 1000
+        result['blocks'] = len(blocks)
+        result['fill'] = 1 - sum(num_free for _, num_free, _ in summary) / (len(blocks) * blocks.block_size)
+
+        # range queries of random width, through the index and through the zone-map scan
+        rng = random.Random(1)
+        ranges = []
+        for _ in range(queries):
+            m = rng.randint(0, 60000)
+            ranges += [(m, m + rng.randint(0, 2000))]
+        index = bptree.open_index('dbfile.txt')
+        zones = zonemap.read_zone_maps('dbfile.txt')
+        start = time.perf_counter()
+        for m, n in ranges:
+            Prog1B.index_range(blocks, index, m, n)
+        result['index'] = queries / (time.perf_counter() - start)
+        start = time.perf_counter()
+        for m, n in ranges:
+            Prog1B.scan_range(blocks, m, n, zones)
+        result['scan'] = queries / (time.perf_counter() - start)
+        index.close()
+
+        if profile is not None:
+            profile_section("record_structure", lambda: [Prog1A.record_structure(row) for row in data], profile)
+            with open('profile.db', 'wb') as fp:
+                profile_section("insert loop", lambda: load_pages(data, fp), profile)
+            records = [(block_num, slot) for block_num, (count, _, _) in enumerate(summary) for slot in range(count)]
+            profile_section("tuple_in_record", lambda: [Prog1B.record_at(blocks.block(block_num), slot)
+                                                        for block_num, slot in records], profile)
+        blocks.close()
+        os.chdir(cwd)
+    result['rss'] = peak_rss()
+    return result
+
+
+def load_peak_rss(directory, window):
+    """
+    This function is to run Prog1A on the file chips.csv of a directory and measure its peak RSS. The peak RSS that
+    Linux reports for a process is at least the one of the process that started it, so Prog1A is started by a small
+    launcher process, which reports the peak RSS of its only child.
+    :param directory: the directory of the CSV file, where the DB file is written
+    :param window: the maximum number of pages held in memory by Prog1A
+    :return: a tuple (size of the DB file in MB, peak RSS of Prog1A in MB)
+    """
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Prog1A.py')
+    launcher = ("import resource, subprocess, sys; "
+                "subprocess.run(sys.argv[1:], stdout=subprocess.DEVNULL, check=True); "
+                "print(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)")
+    output = subprocess.run([sys.executable, '-c', launcher, sys.executable, script, 'chips.csv', '--window',
+                             str(window)], cwd=directory, stdout=subprocess.PIPE, check=True).stdout
+    db_size = os.path.getsize(os.path.join(directory, 'dbfile.txt')) / 2 ** 20
+    return db_size, int(output) / 1024  # KB on Linux
+
+
+def bench_memory(args):
+    if resource is None:
+        print("The peak RSS cannot be measured on this platform.")
+        return
+    results = []
+    for rows in args.rows:
+        with tempfile.TemporaryDirectory() as directory:
+            write_csv(os.path.join(directory, 'chips.csv'), synthetic_rows(rows))
+            results += [(rows,) + load_peak_rss(directory, args.window)]
+    print("{:<10} {:<12} {:<8}".format('Rows', 'DB file MB', 'RSS MB'))
+    for rows, db_size, rss in results:
+        print("{:<10} {:<12.1f} {:<8.1f}".format(rows, db_size, rss))
+    if len(results) > 1:
+        print("From %d to %d rows the DB file grew by %.1f MB and the peak RSS by %.1f MB"
+              % (results[0][0], results[-1][0], results[-1][1] - results[0][1], results[-1][2] - results[0][2]))
+
+
+def bench_suite(args):
+    results = []
+    for rows in args.rows:
+        # a fresh process per size, so that the peak RSS is the one of this size
+        with Pool(1) as pool:
+            results += [pool.apply(run_suite, (rows, args.queries, args.format, null_rates(args), args.profile))]
+    print("{:<10} {:<12} {:<8} {:<11} {:<11} {:<11} {:<8} {:<7} {:<8}".format(
+        'Rows', 'Load rows/s', 'MB/s', 'Report ms', 'Index q/s', 'Scan q/s', 'Blocks', 'Fill %', 'RSS MB'))
+    for r in results:
+        print("{:<10} {:<12,.0f} {:<8.2f} {:<11.1f} {:<11,.0f} {:<11,.0f} {:<8} {:<7.1f} {:<8}".format(
+            r['rows'], r['load'], r['load_mb'], r['report'], r['index'], r['scan'], r['blocks'], r['fill'] * 100,
+            '-' if r['rss'] is None else "%.1f" % r['rss']))
+
+
+def add_null_rates(command_parser):
+    for field, default in (('name', 0), ('type', 0), ('date', 0), ('quantity', 0.15)):
+        command_parser.add_argument('--null-' + field, type=float, default=default,
+                                    help="fraction of rows whose %s is null (default: %s)" % (field, default))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmarks for Prog1A / Prog1B.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    fsm_parser = commands.add_parser('fsm', help="linear vs indexed free-space map placement")
+    fsm_parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000, 1000000])
+    fsm_parser.add_argument('--linear-max', type=int, default=100000,
+                            help="extrapolate the linear scan above this many rows, it grows quadratically")
+    fsm_parser.add_argument('--linear-sample', type=int, default=1000,
+                            help="the number of last inserts timed to extrapolate the linear scan (default: 1000)")
+    fsm_parser.set_defaults(func=bench_fsm)
+
+    codec_parser = commands.add_parser('codec', help="records per second of the record encoder / decoder")
+    codec_parser.add_argument('--rows', type=int, default=100000)
+    codec_parser.add_argument('--repeat', type=int, default=3)
+    codec_parser.set_defaults(func=bench_codec)
+
+    scan_parser = commands.add_parser('scan', help="row scan vs columnar engine on a full-file range query")
+    scan_parser.add_argument('--rows', type=int, default=200000)
+    scan_parser.add_argument('--repeat', type=int, default=3)
+    scan_parser.set_defaults(func=bench_scan)
+
+    memory_parser = commands.add_parser('memory', help="peak RSS of Prog1A as the number of rows grows")
+    memory_parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000, 1000000])
+    memory_parser.add_argument('--window', type=int, default=4, help="the --window of Prog1A (default: 4)")
+    memory_parser.set_defaults(func=bench_memory)
+
+    generate_parser = commands.add_parser('generate', help="write a synthetic chips CSV")
+    generate_parser.add_argument('path', help="the CSV file to write")
+    generate_parser.add_argument('--rows', type=int, default=100000)
+    generate_parser.add_argument('--seed', type=int, default=0)
+    add_null_rates(generate_parser)
+    generate_parser.set_defaults(func=bench_generate)
+
+    suite_parser = commands.add_parser('suite', help="end-to-end load / report / range query benchmark")
+    suite_parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000])
+    suite_parser.add_argument('--queries', type=int, default=100, help="the number of range queries per path")
+    suite_parser.add_argument('--format', choices=['text', 'binary'], default='text', help="the page format")
+    suite_parser.add_argument('--profile', choices=['cprofile', 'tracemalloc'], default=None,
+                              help="also profile record_structure, the insert loop and tuple_in_record")
+    add_null_rates(suite_parser)
+    suite_parser.set_defaults(func=bench_suite)
+
+    arguments = parser.parse_args()
+    if arguments.command == 'fsm' and arguments.linear_sample < 1:
+        parser.error("--linear-sample must be 1 or more")
+    arguments.func(arguments)
@@ -0,0 +1,82 @@
+"""
+Random-access reader for the slotted-page DB file written by Prog1A.
+
+Every block of the DB file has exactly BLOCK_SIZE characters followed by a line terminator, so block N starts at byte
+N * stride. The file is memory-mapped rather than read, and each block is handed out as a memoryview slice of the
+mapping, so only the pages of the file that are actually touched get loaded, and nothing is copied until a record is
+decoded.
+
+A file in the binary page format (see pageformat.py) is recognized by the magic bytes at its start; its blocks are
+pageformat.PAGE_SIZE bytes with no line terminator.
+"""
+
+import mmap
+import os
+
+import pageformat
+
+BLOCK_SIZE = 1000
+
+
+class BlockFile:
+    def __init__(self, filepath, block_size=BLOCK_SIZE):
+        """
+        Class BlockFile Instructor.
+        :param filepath: the path to the DB file
+        :param block_size: the number of characters in a block of the text format, not counting the line terminator
+        """
+        self.block_size = block_size
+        self.binary = False
+        self.fp = open(filepath, 'rb')
+        size = os.fstat(self.fp.fileno()).st_size
+        if size == 0:
+            # an empty file cannot be memory-mapped
+            self.mm = None
+            self.view = memoryview(b'')
+            self.stride = block_size + 1
+        else:
+            self.mm = mmap.mmap(self.fp.fileno(), 0, access=mmap.ACCESS_READ)
+            self.view = memoryview(self.mm)
+            if pageformat.is_binary(self.mm[:4]):
+                self.binary = True
+                self.block_size = self.stride = pageformat.PAGE_SIZE
+            else:
+                # the line terminator is "\n", or "\r\n" if the file was written on Windows
+                self.stride = block_size + (2 if self.mm[block_size: block_size + 1] == b'\r' else 1)
+        self.num_blocks = (size + self.stride - self.block_size) // self.stride
+
+    def __len__(self):
+        return self.num_blocks
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """
+        This function is to unmap and close the DB file. Slices handed out by block() must not be used afterwards.
+        :return: None
+        """
+        self.view.release()
+        if self.mm is not None:
+            self.mm.close()
+        self.fp.close()
+
+    def block(self, number):
+        """
+        This function is to get a block by its block# without reading any other block
+        :param number: the block#, negative values count from the end as for lists
+        :return: a memoryview of the block's bytes
+        """
+        if number < 0:
+            number += self.num_blocks
+        if not 0 <= number < self.num_blocks:
+            raise IndexError("block# %d out of range" % number)
+        start = number * self.stride
+        return self.view[start: start + self.block_size]
+
+    def __iter__(self):
+        for number in range(self.num_blocks):
+            yield self.block(number)
@@ -0,0 +1,300 @@
+"""
+A persistent B+-tree index on the "Transistors (million)" field of the DB file.
+
+The index file is laid out like the DB file itself: a sequence of fixed-size nodes of NODE_SIZE characters, each
+terminated by "\n", so node N starts at byte N * (NODE_SIZE + 1). Node 0 is the meta node, the other nodes are either
+leaf nodes or internal nodes. Every entry is keyed on the composite key (quantity, block#, slot#), which keeps keys
+unique even though many chips share the same quantity.
+
+    Meta node:      BPT rrrrrr hh eeeeeeeee ssssssssssss mmmmmmmmmmmmmmmmmmmm
+                        rrrrrr: node# of the root; hh: height of the tree; eeeeeeeee: number of entries
+                        ssssssssssss / mmmm...: size and mtime (ns) of the DB file the index was built from
+    Leaf node:      L ccc nnnnnn [kkkkkkkkkkkkbbbbbbsss]*
+                        ccc: number of entries; nnnnnn: node# of the next leaf (999999 if none)
+                        kkkkkkkkkkkk: quantity; bbbbbb: block#; sss: slot#
+    Internal node:  I ccc ...... [kkkkkkkkkkkkbbbbbbssscccccc]*
+                        ccc: number of children; kkkk...sss: the smallest key under the child; cccccc: node# of the child
+
+The index is bulk-loaded from the entries in key order and written one node at a time. A loader collects its entries in
+an EntrySpill, which sorts them in runs of RUN_SIZE entries spilled to temporary files and merges the runs while the
+leaves are written, so loading a file of any size holds at most RUN_SIZE entries in memory.
+"""
+
+import heapq
+import os
+import tempfile
+
+NODE_SIZE = 1000
+NO_NODE = 999999
+
+KEY_WIDTH = 12 + 6 + 3  # quantity + block# + slot#
+LEAF_HEADER = 1 + 3 + 6
+LEAF_CAPACITY = (NODE_SIZE - LEAF_HEADER) // KEY_WIDTH
+INTERNAL_CAPACITY = (NODE_SIZE - LEAF_HEADER) // (KEY_WIDTH + 6)
+MAX_QUANTITY = 10 ** 12 - 1
+RUN_SIZE = 16384  # the number of index entries sorted in memory before they are spilled to a run file
+
+
+def index_path_for(db_path):
+    """
+    This function is to get the path of the index file that belongs to a DB file
+    :param db_path: the path to the DB file, e.g. "dbfile.txt"
+    :return: the path to the index file, e.g. "dbfile.idx"
+    """
+    return os.path.splitext(db_path)[0] + '.idx'
+
+
+def db_stamp(db_path):
+    """
+    This function is to get the stamp used to detect whether a DB file changed since an index was built over it
+    :param db_path: the path to the DB file
+    :return: a tuple (size in bytes, mtime in ns)
+    """
+    stat = os.stat(db_path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def _key(entry):
+    return "%012d%06d%03d" % entry
+
+
+def _pad(node):
+    return node + "." * (NODE_SIZE - len(node))
+
+
+def read_run(path, offset=0):
+    """
+    This function is to read the entries of a run file back in order
+    :param path: the path to the run file
+    :param offset: the number added to the block# of every entry
+    :return: a generator of (quantity, block#, slot#)
+    """
+    with open(path, 'r') as fp:
+        for line in fp:
+            quantity, block, slot = line.split()
+            yield int(quantity), int(block) + offset, int(slot)
+
+
+class EntrySpill:
+    def __init__(self):
+        """
+        Class EntrySpill Instructor. Collects index entries (quantity, block#, slot#) in any order; every RUN_SIZE
+        entries are sorted and written to a temporary run file.
+        """
+        self.buffer = []  # buffer: the entries not spilled yet
+        self.runs = []  # runs: (path to a run file, offset added to the block# of its entries)
+
+    def append(self, entry):
+        """
+        This function is to add an index entry
+        :param entry: the entry (quantity, block#, slot#)
+        :return: None
+        """
+        self.buffer.append(entry)
+        if len(self.buffer) >= RUN_SIZE:
+            self.spill()
+
+    def spill(self):
+        """
+        This function is to sort the entries held in memory and write them to a new run file
+        :return: None
+        """
+        if not self.buffer:
+            return
+        self.buffer.sort()
+        fd, path = tempfile.mkstemp(suffix='.run')
+        with os.fdopen(fd, 'w') as fp:
+            fp.writelines("%d %d %d\n" % entry for entry in self.buffer)
+        self.runs += [(path, 0)]
+        self.buffer = []
+
+    def take(self, other, offset):
+        """
+        This function is to move the entries of another spill into this one, e.g. the ones of a worker process whose
+        blocks follow those already loaded
+        :param other: the other EntrySpill
+        :param offset: the number added to the block# of every entry of the other spill
+        :return: None
+        """
+        other.spill()
+        self.runs += [(path, shift + offset) for path, shift in other.runs]
+        other.runs = []
+
+    def sorted_entries(self):
+        """
+        This function is to merge the run files and the entries held in memory
+        :return: an iterator of (quantity, block#, slot#) in key order
+        """
+        self.buffer.sort()
+        return heapq.merge(self.buffer, *[read_run(path, offset) for path, offset in self.runs])
+
+    def close(self):
+        """
+        This function is to remove the run files
+        :return: None
+        """
+        for path, _ in self.runs:
+            os.remove(path)
+        self.runs = []
+        self.buffer = []
+
+
+def build_index(entries, db_path, index_path=None):
+    """
+    This function is to bulk-load a B+-tree index over the DB file. The leaves are filled completely from the sorted
+    entries and written one at a time, then every internal level is built bottom-up from the smallest keys of the
+    level below, read back from the index file, so the tree is as shallow as possible.
+    :param entries: an EntrySpill, or an iterable of (quantity, block#, slot#) for every record with a valid quantity
+    :param db_path: the path to the DB file the entries belong to (must already be written)
+    :param index_path: the path to the index file; by default it is derived from db_path
+    :return: True if the index is written, False if some quantity does not fit into the key
+    """
+    if index_path is None:
+        index_path = index_path_for(db_path)
+    entries = entries.sorted_entries() if isinstance(entries, EntrySpill) else iter(sorted(entries))
+
+    with open(index_path, 'wb+') as fp:
+        fp.write(_pad("").encode('ascii') + b"\n")  # node 0, the meta node, is written last
+
+        # Leaf level; a leaf is written once the next one is known to be needed
+        num_entries = 0
+        number = 1  # number: the node# of the next node written
+        chunk = []
+        for entry in entries:
+            if entry[0] > MAX_QUANTITY:
+                # An index that cannot hold every record would silently lose results, so leave no index at all
+                fp.close()
+                os.remove(index_path)
+                return False
+            if len(chunk) == LEAF_CAPACITY:
+                fp.write(_pad("L%03d%06d" % (len(chunk), number + 1) + ''.join(map(_key, chunk))).encode('ascii')
+                         + b"\n")
+                number += 1
+                chunk = []
+            chunk += [entry]
+            num_entries += 1
+        fp.write(_pad("L%03d%06d" % (len(chunk), NO_NODE) + ''.join(map(_key, chunk))).encode('ascii') + b"\n")
+        number += 1
+
+        # Internal levels, from the smallest key of every node of the level below
+        first, end = 1, number  # first, end: the node# range of the level below
+        height = 1
+        while end - first > 1:
+            for i in range(first, end, INTERNAL_CAPACITY):
+                children = range(i, min(i + INTERNAL_CAPACITY, end))
+                keys = []
+                for child in children:
+                    fp.seek(child * (NODE_SIZE + 1) + LEAF_HEADER)
+                    keys += [fp.read(KEY_WIDTH).decode('ascii') + "%06d" % child]
+                fp.seek(0, os.SEEK_END)
+                fp.write(_pad("I%03d......" % len(children) + ''.join(keys)).encode('ascii') + b"\n")
+            first, end = end, end + -(-(end - first) // INTERNAL_CAPACITY)
+            height += 1
+
+        size, mtime = db_stamp(db_path)
+        fp.seek(0)
+        fp.write(_pad("BPT%06d%02d%09d%012d%020d" % (first, height, num_entries, size, mtime)).encode('ascii'))
+    return True
+
+
+class BPlusTreeIndex:
+    def __init__(self, fp, root, height, num_entries):
+        """
+        Class BPlusTreeIndex Instructor. Use open_index() rather than calling this directly.
+        :param fp: the opened index file
+        :param root: the node# of the root
+        :param height: the height of the tree (1 when the root is a leaf)
+        :param num_entries: the number of indexed records
+        """
+        self.fp = fp
+        self.root = root
+        self.height = height
+        self.num_entries = num_entries
+
+    def close(self):
+        self.fp.close()
+
+    def read_node(self, number):
+        """
+        This function is to read a node from the index file by its node#
+        :param number: the node#
+        :return: the node in characters
+        """
+        self.fp.seek(number * (NODE_SIZE + 1))
+        return self.fp.read(NODE_SIZE)
+
+    def find_leaf(self, key):
+        """
+        This function is to descend from the root to the leaf where the first entry >= key would be
+        :param key: the composite key (quantity, block#, slot#)
+        :return: the node# of the leaf
+        """
+        target = _key(key)
+        number = self.root
+        for _ in range(self.height - 1):
+            node = self.read_node(number)
+            count = int(node[1:4])
+            child = int(node[LEAF_HEADER + KEY_WIDTH: LEAF_HEADER + KEY_WIDTH + 6])
+            # take the last child whose smallest key is not larger than the target
+            for i in range(1, count):
+                start = LEAF_HEADER + i * (KEY_WIDTH + 6)
+                if node[start: start + KEY_WIDTH] > target:
+                    break
+                child = int(node[start + KEY_WIDTH: start + KEY_WIDTH + 6])
+            number = child
+        return number
+
+    def range_search(self, m, n):
+        """
+        This function is to walk the leaf range for quantities in [m, n]
+        :param m: the lower bound of quantity (inclusive)
+        :param n: the upper bound of quantity (inclusive)
+        :return: a generator of (quantity, block#, slot#) in key order
+        """
+        if m > n or m > MAX_QUANTITY:
+            return
+        low = _key((max(m, 0), 0, 0))
+        number = self.find_leaf((max(m, 0), 0, 0))
+        while number != NO_NODE:
+            node = self.read_node(number)
+            count = int(node[1:4])
+            for i in range(count):
+                start = LEAF_HEADER + i * KEY_WIDTH
+                key = node[start: start + KEY_WIDTH]
+                if key < low:
+                    continue
+                quantity = int(key[:12])
+                if quantity > n:
+                    return
+                yield quantity, int(key[12:18]), int(key[18:21])
+            number = int(node[4:10])
+
+
+def open_index(db_path, index_path=None):
+    """
+    This function is to open the index of a DB file if it exists and is up to date
+    :param db_path: the path to the DB file
+    :param index_path: the path to the index file; by default it is derived from db_path
+    :return: a BPlusTreeIndex, or None if the index is missing, unreadable or stale
+    """
+    if index_path is None:
+        index_path = index_path_for(db_path)
+    if not os.path.exists(index_path):
+        return None
+    fp = open(index_path, 'r')
+    meta = fp.read(NODE_SIZE)
+    try:
+        if not meta.startswith("BPT"):
+            raise ValueError
+        root = int(meta[3:9])
+        height = int(meta[9:11])
+        num_entries = int(meta[11:20])
+        stamp = (int(meta[20:32]), int(meta[32:52]))
+    except ValueError:
+        fp.close()
+        return None
+    # An index built from a different version of the DB file points to the wrong (block#, slot#)
+    if stamp != db_stamp(db_path):
+        fp.close()
+        return None
+    return BPlusTreeIndex(fp, root, height, num_entries)
@@ -0,0 +1,219 @@
+"""
+Buffer pool of DB file pages with a fixed number of frames and a pluggable replacement policy.
+
+A caller fetches a page by its block#, which pins it in a frame, and unpins it when done, telling the pool whether it
+changed the page. When a page that is not in the pool is fetched and every frame is taken, the replacement policy
+picks an unpinned frame to evict; a dirty page is written back before its frame is reused. The pool does not know the
+page format: it reads and writes pages through the two functions it is given.
+
+    LRUPolicy       evicts the unpinned page that was used least recently
+    ClockPolicy     second-chance approximation of LRU: a hand sweeps the frames, clearing reference bits, and
+                    evicts the first unpinned frame whose bit is already clear
+
+Counters (hits, misses, evictions, write_backs) are kept so that the pool can be sized for a working set.
+"""
+
+from collections import OrderedDict
+
+
+class Frame:
+    __slots__ = ('number', 'page', 'pin_count', 'dirty')
+
+    def __init__(self, number, page):
+        self.number = number  # number: the block# of the page held by the frame
+        self.page = page
+        self.pin_count = 0
+        self.dirty = False
+
+
+class LRUPolicy:
+    def __init__(self, num_frames):
+        self.order = OrderedDict()  # order: frame# in order of last use, least recent first
+
+    def accessed(self, frame_index):
+        self.order[frame_index] = None
+        self.order.move_to_end(frame_index)
+
+    def victim(self, frames):
+        for frame_index in self.order:
+            if frames[frame_index].pin_count == 0:
+                del self.order[frame_index]
+                return frame_index
+        return -1
+
+
+class ClockPolicy:
+    def __init__(self, num_frames):
+        self.referenced = [False] * num_frames
+        self.hand = 0
+
+    def accessed(self, frame_index):
+        self.referenced[frame_index] = True
+
+    def victim(self, frames):
+        # two sweeps: the first may only clear reference bits
+        for _ in range(2 * len(frames)):
+            frame_index = self.hand
+            self.hand = (self.hand + 1) % len(frames)
+            if frames[frame_index].pin_count:
+                continue
+            if self.referenced[frame_index]:
+                self.referenced[frame_index] = False
+                continue
+            return frame_index
+        return -1
+
+
+POLICIES = {'lru': LRUPolicy, 'clock': ClockPolicy}
+
+
+class BufferPool:
+    def __init__(self, num_frames, read_page, write_page, policy='lru'):
+        """
+        Class BufferPool Instructor.
+        :param num_frames: the number of frames, i.e. the maximum number of pages held in memory
+        :param read_page: a function block# -> page, reading a page from the file
+        :param write_page: a function (block#, page) -> None, writing a page back to the file
+        :param policy: the name of the replacement policy, "lru" or "clock"
+        """
+        if num_frames < 1:
+            raise ValueError("A buffer pool needs at least one frame.")
+        self.num_frames = num_frames
+        self.read_page = read_page
+        self.write_page = write_page
+        self.policy = POLICIES[policy](num_frames)
+        self.frames = []  # frames: the Frame objects in use, at most num_frames
+        self.table = {}  # table: block# -> frame#
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.write_backs = 0
+
+    def _frame_for(self, number, page):
+        # put a page into a free frame, evicting a page if there is none
+        if len(self.frames) < self.num_frames:
+            self.frames.append(Frame(number, page))
+            frame_index = len(self.frames) - 1
+        else:
+            frame_index = self.policy.victim(self.frames)
+            if frame_index == -1:
+                raise RuntimeError("Every frame of the buffer pool is pinned.")
+            frame = self.frames[frame_index]
+            if frame.dirty:
+                self.write_page(frame.number, frame.page)
+                self.write_backs += 1
+            del self.table[frame.number]
+            self.evictions += 1
+            self.frames[frame_index] = Frame(number, page)
+        self.table[number] = frame_index
+        return frame_index
+
+    def fetch(self, number):
+        """
+        This function is to get a page and pin it
+        :param number: the block#
+        :return: the page
+        """
+        frame_index = self.table.get(number)
+        if frame_index is None:
+            self.misses += 1
+            frame_index = self._frame_for(number, self.read_page(number))
+        else:
+            self.hits += 1
+        frame = self.frames[frame_index]
+        frame.pin_count += 1
+        self.policy.accessed(frame_index)
+        return frame.page
+
+    def new(self, number, page):
+        """
+        This function is to add a page that does not exist in the file yet; it is pinned and dirty
+        :param number: the block# of the new page
+        :param page: the page
+        :return: the page
+        """
+        frame = self.frames[self._frame_for(number, page)]
+        frame.pin_count = 1
+        frame.dirty = True
+        self.policy.accessed(self.table[number])
+        return page
+
+    def unpin(self, number, dirty=False):
+        """
+        This function is to release a page fetched before
+        :param number: the block#
+        :param dirty: True if the caller changed the page
+        :return: None
+        """
+        frame = self.frames[self.table[number]]
+        if frame.pin_count == 0:
+            raise RuntimeError("block# %d is not pinned" % number)
+        frame.pin_count -= 1
+        frame.dirty = frame.dirty or dirty
+
+    def flush_all(self):
+        """
+        This function is to write every dirty page back, in block order, keeping the pages in the pool
+        :return: None
+        """
+        for frame in sorted(self.frames, key=lambda f: f.number):
+            if frame.dirty:
+                self.write_page(frame.number, frame.page)
+                self.write_backs += 1
+                frame.dirty = False
+
+    def hit_ratio(self):
+        """
+        This function is to get the fraction of fetches answered from the pool
+        :return: the hit ratio in [0, 1]
+        """
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def report(self):
+        """
+        This function is to describe the counters
+        :return: the description in characters
+        """
+        return ("Buffer pool: %d frames, %d hits, %d misses (hit ratio %.1f%%), %d evictions, %d write-backs"
+                % (self.num_frames, self.hits, self.misses, self.hit_ratio() * 100, self.evictions, self.write_backs))
+
+
+class PooledBlocks:
+    def __init__(self, blocks, num_frames, policy='lru'):
+        """
+        Class PooledBlocks Instructor. Read-only access to the blocks of a BlockFile through a buffer pool, with the
+        same interface as the BlockFile. The frames hold copies of the blocks' bytes.
+        :param blocks: the BlockFile
+        :param num_frames: the number of frames of the pool
+        :param policy: the name of the replacement policy
+        """
+        self.blocks = blocks
+        self.pool = BufferPool(num_frames, lambda number: bytes(blocks.block(number)), self._read_only, policy)
+
+    @staticmethod
+    def _read_only(number, page):
+        raise RuntimeError("Pages read through PooledBlocks are never dirty.")
+
+    def __len__(self):
+        return len(self.blocks)
+
+    def __getattr__(self, name):
+        # view, stride, close ... come from the BlockFile
+        return getattr(self.blocks, name)
+
+    def block(self, number):
+        """
+        This function is to get a block through the buffer pool
+        :param number: the block#, negative values count from the end as for lists
+        :return: the bytes of the block
+        """
+        if number < 0:
+            number += len(self.blocks)
+        page = self.pool.fetch(number)
+        self.pool.unpin(number)  # the bytes are immutable, so the caller may keep using them after unpinning
+        return page
+
+    def __iter__(self):
+        for number in range(len(self.blocks)):
+            yield self.block(number)
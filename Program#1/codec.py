@@ -0,0 +1,171 @@
+"""
+Encoder and decoder of the variable-length record format, shared by Prog1A and Prog1B.
+
+The record structure is in the form of:
+    aabbccddeeeefffgggggggggghhhhhhiiiii
+        where:
+            aa: offset for name (2-digit characters); if name not available, replace by ".."
+            bb: length for name (2-digit characters); if name not available, replace by ".."
+            cc: offset for quantity of transistors (2-digit characters); if quantity not available, replace by ".."
+            dd: length for quantity of transistors (2-digit characters); if quantity not available, replace by ".."
+            eeee: bitmap respectively for type, date, name, quantity (4-byte characters)
+            fff: chip type (3-byte characters); if not available, replace by "..."
+            gggggggggg: date (10-byte characters); if not available, replace by ".........."
+            hhhhhh: name (variable-length); if not available, discard this part
+            iiiii: quantity (variable-length); if not available, discard this part
+
+The validation patterns are compiled once at import time. Besides the one-record functions, encode_rows() encodes a
+batch of rows into a single buffer and decode_block() decodes the whole slot directory of a block in one pass into
+column lists.
+
+Names and quantities are stored as their UTF-8 bytes, so that every offset and length in a record and in the slot
+directory counts bytes. Records are held in characters of the latin-1 encoding (one character per byte, see ENCODING);
+encode_text() and decode_text() convert a field value to and from these characters.
+"""
+
+import re
+
+DATE_PATTERN = re.compile(r'\d{4}-\d{2}-\d{2}', re.ASCII)  # valid value of date must match the date pattern
+QUANTITY_PATTERN = re.compile(r'[0-9]+')  # valid value of quantity must be an integer
+
+ENCODING = 'latin-1'  # encoding of records in characters: one character per byte of the DB file
+NAME_OFFSET = 8 + 4 + 3 + 10  # (offset, length) pairs + bitmap + "type" + "date" = 4 * 2 + 4 + 3 + 10
+
+
+def encode_text(value):
+    """
+    This function is for converting a field value into characters, one character per byte of its UTF-8 encoding
+    :param value: the field value
+    :return: the field value in characters
+    """
+    return value if value.isascii() else value.encode('utf-8').decode(ENCODING)
+
+
+def decode_text(value):
+    """
+    This function is for converting a field value read from a record back into text
+    :param value: the field value in characters, one character per byte of its UTF-8 encoding
+    :return: the field value
+    """
+    return value if value.isascii() else value.encode(ENCODING).decode('utf-8', 'replace')
+
+
+def encode_record(ls):
+    """
+    This function is for converting a list of field values into record structure in characters
+    :param ls: the list of field values [name, type, date, quantity]
+    :return: record structure in characters, one character per byte (see ENCODING)
+    """
+    name, chip_type, date, quantity = ls[0], ls[1], ls[2], ls[3]
+
+    # type, date
+    if chip_type == "CPU" or chip_type == "GPU":
+        bitmap = "0"
+    else:
+        chip_type = "..."
+        bitmap = "1"
+    if DATE_PATTERN.match(date):
+        bitmap += "0"
+    else:
+        date = ".........."
+        bitmap += "1"
+
+    # name
+    name = encode_text(name)
+    name_length = len(name)
+    if name_length == 0:
+        pairs = "...."
+        bitmap += "1"
+    else:
+        pairs = "%02d%02d" % (NAME_OFFSET, name_length)
+        bitmap += "0"
+
+    # quantity
+    if QUANTITY_PATTERN.match(quantity):
+        quantity = encode_text(quantity)
+        pairs += "%02d%02d" % (NAME_OFFSET + name_length, len(quantity))
+        bitmap += "0"
+    else:
+        quantity = ""
+        pairs += "...."
+        bitmap += "1"
+
+    return pairs + bitmap + chip_type + date + name + quantity
+
+
+def encode_rows(rows):
+    """
+    This function is for converting a batch of rows into record structures stored back to back in one buffer
+    :param rows: an iterable of lists of field values [name, type, date, quantity]
+    :return: a tuple (buffer of all records in bytes, list of record lengths)
+    """
+    records = [encode_record(row) for row in rows]
+    return ''.join(records).encode(ENCODING), [len(record) for record in records]
+
+
+def decode_record(record):
+    """
+    This function is for converting record structure into a tuple of field values
+    :param record: the record structure in characters
+    :return: the tuple of field values (name, type, date, quantity)
+    """
+    bitmap = record[8:12]
+    chip_type = record[12:15] if bitmap[0] == "0" else ""
+    date = record[15:25] if bitmap[1] == "0" else ""
+    if bitmap[2] == "0":
+        name_offset = int(record[:2])
+        name = decode_text(record[name_offset: (name_offset + int(record[2:4]))])
+    else:
+        name = ""
+    if bitmap[3] == "0":
+        quantity_offset = int(record[4:6])
+        quantity = decode_text(record[quantity_offset: (quantity_offset + int(record[6:8]))])
+    else:
+        quantity = ""
+    return name, chip_type, date, quantity
+
+
+def decode_slots(text):
+    """
+    This function is for reading the slot directory of a block
+    :param text: the block in characters
+    :return: a list of (offset, length) of the records, in insertion order; deleted records have length 0
+    """
+    directory = text[6: 6 + 6 * int(text[:3])]
+    return [(int(directory[k: k + 3]), int(directory[k + 3: k + 6])) for k in range(0, len(directory), 6)]
+
+
+def decode_block(block):
+    """
+    This function is for converting all records of a block into columns of field values. The slot directory and the
+    records are parsed in one loop: each slot entry and each (offset, length) pair is converted by a single int().
+    :param block: the block in bytes (e.g. a memoryview slice of the DB file) or in characters
+    :return: a tuple of lists (names, types, dates, quantities), one element per slot in insertion order; the fields
+             of a deleted record are all ""
+    """
+    text = block if isinstance(block, str) else str(block, ENCODING)
+    names, types, dates, quantities = [], [], [], []
+    for k in range(6, 6 + 6 * int(text[:3]), 6):
+        o, length = divmod(int(text[k: k + 6]), 1000)  # "ooolll"
+        if length == 0:
+            names.append("")
+            types.append("")
+            dates.append("")
+            quantities.append("")
+            continue
+        bitmap = text[o + 8: o + 12]
+        types.append(text[o + 12: o + 15] if bitmap[0] == "0" else "")
+        dates.append(text[o + 15: o + 25] if bitmap[1] == "0" else "")
+        if bitmap[2] == "0":
+            offset, size = divmod(int(text[o: o + 4]), 100)  # "aabb"
+            names.append(text[o + offset: o + offset + size])
+        else:
+            names.append("")
+        if bitmap[3] == "0":
+            offset, size = divmod(int(text[o + 4: o + 8]), 100)  # "ccdd"
+            quantities.append(text[o + offset: o + offset + size])
+        else:
+            quantities.append("")
+    if not text.isascii():
+        names, quantities = [decode_text(name) for name in names], [decode_text(value) for value in quantities]
+    return names, types, dates, quantities
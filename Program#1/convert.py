@@ -0,0 +1,67 @@
+"""
+Converter between the text page format (page.py / codec.py) and the binary page format (pageformat.py) of the DB file.
+
+The records that are not deleted are read in (block#, slot#) order and packed first-fit into a new DB file in the other
+format; the version, B+-tree index, free-space map and zone maps of the new file are written alongside it. Block and
+slot numbers are not kept, so the new file should have a base name of its own (its sidecar files are named after it).
+
+    python3 convert.py dbfile.txt chips.bin     text -> binary
+    python3 convert.py chips.bin dbfile.txt     binary -> text
+"""
+
+import argparse
+import os
+
+import codec
+import pageformat
+from Prog1A import load_rows, write_sidecars
+from blockfile import BlockFile
+
+
+def read_rows(blocks):
+    """
+    This function is to read the records of a DB file, in either format, as lists of field values
+    :param blocks: the BlockFile of the DB file
+    :return: a generator of lists [name, type, date, quantity], "" for null values
+    """
+    for block in blocks:
+        if blocks.binary:
+            slots, columns = pageformat.decode_slots(block), pageformat.decode_block(block)
+        else:
+            text = str(block, codec.ENCODING)
+            slots, columns = codec.decode_slots(text), codec.decode_block(text)
+        for (_, length), record in zip(slots, zip(*columns)):
+            if length:
+                yield list(record)
+
+
+def convert(src_path, dst_path):
+    """
+    This function is to convert a DB file into the other page format
+    :param src_path: the path to the DB file
+    :param dst_path: the path to the converted DB file
+    :return: a tuple (the format written, number of records, number of blocks)
+    """
+    with BlockFile(src_path) as blocks, open(dst_path, 'wb') as fp:
+        if blocks.binary:
+            page_format = 'text'
+            free_space_map, index_entries, zones, total_record = load_rows(read_rows(blocks), fp)
+        else:
+            page_format = 'binary'
+            free_space_map, index_entries, zones, total_record = pageformat.write_pages(read_rows(blocks), fp)
+    write_sidecars(dst_path, free_space_map, index_entries, zones)
+    return page_format, total_record, len(free_space_map)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Convert a DB file between the text and the binary page format.")
+    parser.add_argument('src', help="the DB file to convert")
+    parser.add_argument('dst', help="the converted DB file to write")
+    args = parser.parse_args()
+    if not os.path.exists(args.src):
+        print("File does not exist!")
+    elif os.path.abspath(args.src) == os.path.abspath(args.dst):
+        print("The converted file must not replace the original one.")
+    else:
+        fmt, count, num_blocks = convert(args.src, args.dst)
+        print("Converted %d records into %s (%s format, %d blocks)" % (count, args.dst, fmt, num_blocks))
@@ -0,0 +1,262 @@
+"""
+In-place inserts and deletes on an existing DB file, instead of rebuilding it with Prog1A.
+
+DBFile opens the DB file for update together with its persisted free-space map (dbfile.fsm, rebuilt from the block
+headers if it is missing or stale). Inserts are placed first-fit through the free-space map into the slot-directory
+layout Prog1A writes, appending a new block at the end of the file when no block has room. Deletes turn the slot into
+a tombstone (length 000); the bytes are reclaimed by the next insert into that block. Blocks are read through a buffer
+pool (see bufferpool.py) of a fixed number of frames; only the blocks that were changed are written back, each at its
+fixed offset, when they are evicted or when the file is flushed or closed.
+
+The other sidecars are kept current as well, so Prog1B keeps using them after an edit: the zone maps of the blocks are
+held in memory (read from dbfile.zone, or rebuilt from the blocks), widened on insert and recomputed from the block on
+delete; on flush they are rewritten, the B+-tree index on quantity is rebuilt from the written file, and the version
+of the file is recorded again, so the stamps of all sidecars match the flushed file.
+
+    python3 dbfile.py dbfile.txt --insert more_chips.csv --delete 3:5 7:0 --pool-frames 16 --pool-policy clock
+"""
+
+import argparse
+import os
+from csv import reader
+
+import bptree
+import codec
+import pageformat
+import querycache
+import zonemap
+from bufferpool import POLICIES, BufferPool
+from fsm import FreeSpaceMap, fraction_needed, read_free_space_map, write_free_space_map
+from page import PAGE_SIZE, Page
+
+
+def block_zone(page):
+    """
+    This function is to compute the zone map of a block from the records it holds
+    :param page: the Page of the block
+    :return: the zone map of the block (see zonemap.new_zone())
+    """
+    zone = zonemap.new_zone()
+    for (_, length), fields in zip(page.slots, zip(*codec.decode_block(page.to_bytes()))):
+        if length > 0:
+            zonemap.add_fields(zone, fields)
+    return zone
+
+
+class DBFile:
+    def __init__(self, filepath, frames=64, policy='lru', sidecars=True):
+        """
+        Class DBFile Instructor. Opens an existing DB file for in-place updates.
+        :param filepath: the path to the DB file
+        :param frames: the number of frames of the buffer pool
+        :param policy: the replacement policy of the buffer pool, "lru" or "clock"
+        :param sidecars: True to rewrite the index, the zone maps and the version on flush; False if the caller writes
+                         them itself (the free-space map is always written)
+        """
+        self.filepath = filepath
+        self.fp = open(filepath, 'r+b')
+        size = os.fstat(self.fp.fileno()).st_size
+        if pageformat.is_binary(self.fp.read(4)):
+            self.fp.close()
+            raise ValueError("%s is in the binary page format, convert it to the text format first" % filepath)
+        # the line terminator is "\n", or "\r\n" if the file was written on Windows
+        self.fp.seek(PAGE_SIZE)
+        self.terminator = b"\r\n" if self.fp.read(1) == b"\r" else b"\n"
+        self.stride = PAGE_SIZE + len(self.terminator)
+        self.num_blocks = size // self.stride
+        self.pool = BufferPool(frames, self._read_page, self._write_page, policy)
+        self.changed = False  # changed: True if a block was changed since the last flush
+        self.sidecars = sidecars
+
+        self.free_space_map = read_free_space_map(filepath)
+        if self.free_space_map is None or len(self.free_space_map) != self.num_blocks:
+            self.free_space_map = FreeSpaceMap([self.page(number).fraction() for number in range(self.num_blocks)])
+        self.zones = zonemap.read_zone_maps(filepath)  # zones: the zone map of every block
+        if self.zones is None or len(self.zones) != self.num_blocks:
+            self.zones = [block_zone(self.page(number)) for number in range(self.num_blocks)]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        # after an error the edit may be half done, so nothing more is flushed; blocks the pool already evicted stay
+        if exc[0] is None:
+            self.flush()
+        self.fp.close()
+
+    def _read_page(self, number):
+        # called by the buffer pool on a miss
+        self.fp.seek(number * self.stride)
+        return Page.from_bytes(self.fp.read(PAGE_SIZE))
+
+    def _write_page(self, number, page):
+        # called by the buffer pool to write a dirty block back
+        self.fp.seek(number * self.stride)
+        self.fp.write(page.to_bytes() + self.terminator)
+
+    def page(self, number):
+        """
+        This function is to read a block as a Page through the buffer pool, without keeping it pinned
+        :param number: the block#
+        :return: the Page
+        """
+        if not 0 <= number < self.num_blocks:
+            raise IndexError("block# %d out of range" % number)
+        page = self.pool.fetch(number)
+        self.pool.unpin(number)
+        return page
+
+    def insert(self, row):
+        """
+        This function is to insert a row into the first block with room for it
+        :param row: the list of field values [name, type, date, quantity]
+        :return: the (block#, slot#) of the new record
+        """
+        return self.insert_record(codec.encode_record(row).encode(codec.ENCODING))
+
+    def insert_record(self, record):
+        """
+        This function is to insert a record structure into the first block with room for it
+        :param record: the record structure in bytes
+        :return: the (block#, slot#) of the new record
+        """
+        needed = fraction_needed(len(record))
+        if needed >= 16:
+            raise ValueError("Record does not fit into a block: %s" % bytes(record))
+        number = self.free_space_map.first_fit(needed)
+        while number != -1:
+            page = self.pool.fetch(number)
+            # the fraction is rounded down, but the slot entry may still tip the record over
+            if page.has_room(len(record)):
+                break
+            self.pool.unpin(number)
+            number = self.free_space_map.first_fit(needed, number + 1)
+        if number == -1:
+            number = self.free_space_map.append(15)
+            page = self.pool.new(number, Page())
+            self.num_blocks += 1
+            self.zones.append(zonemap.new_zone())
+        slot = page.insert(record)
+        self.pool.unpin(number, dirty=True)
+        self.changed = True
+        self.free_space_map[number] = page.fraction()
+        zonemap.add_fields(self.zones[number], codec.decode_record(str(record, codec.ENCODING)))
+        return number, slot
+
+    def delete(self, number, slot):
+        """
+        This function is to delete the record stored in a slot of a block
+        :param number: the block#
+        :param slot: the slot#
+        :return: None
+        """
+        if not 0 <= number < self.num_blocks:
+            raise IndexError("block# %d out of range" % number)
+        page = self.pool.fetch(number)
+        try:
+            if not 0 <= slot < page.num_records:
+                raise KeyError("block# %d has no slot# %d" % (number, slot))
+            page.delete(slot)
+        except KeyError:
+            self.pool.unpin(number)
+            raise
+        self.pool.unpin(number, dirty=True)
+        self.changed = True
+        self.free_space_map[number] = page.fraction()
+        # a zone map cannot be narrowed by a record, so it is recomputed from what is left in the block
+        self.zones[number] = block_zone(page)
+
+    def rebuild_index(self):
+        """
+        This function is to rebuild the B+-tree index on quantity from the records of the written DB file, one block
+        at a time
+        :return: True if the index is built, False if some quantity does not fit into the index
+        """
+        index_entries = bptree.EntrySpill()
+        try:
+            self.fp.seek(0)
+            for number in range(self.num_blocks):
+                block = self.fp.read(self.stride)[:PAGE_SIZE]
+                quantities = codec.decode_block(block)[3]
+                for slot, quantity in enumerate(quantities):
+                    if codec.QUANTITY_PATTERN.fullmatch(quantity):
+                        index_entries.append((int(quantity), number, slot))
+            return bptree.build_index(index_entries, self.filepath)
+        finally:
+            index_entries.close()
+
+    def flush(self):
+        """
+        This function is to write the changed blocks back at their offsets and persist the free-space map and, unless
+        the caller writes them, the version, the B+-tree index and the zone maps
+        :return: None
+        """
+        if not self.changed:
+            return
+        self.pool.flush_all()
+        self.fp.flush()
+        self.changed = False
+        write_free_space_map(self.free_space_map, self.filepath)
+        if self.sidecars:
+            querycache.write_version(self.filepath)
+            if not self.rebuild_index():
+                print("Quantity too large for the index, %s is not built." % bptree.index_path_for(self.filepath))
+            if not zonemap.write_zone_maps(self.zones, self.filepath):
+                print("Quantity too large for the zone maps, %s is not built." % zonemap.zone_path_for(self.filepath))
+
+    def close(self):
+        """
+        This function is to flush and close the DB file
+        :return: None
+        """
+        self.flush()
+        self.fp.close()
+
+
+def location(value):
+    """
+    This function is to parse the location of a record given on the command line
+    :param value: the location as "BLOCK:SLOT", e.g. "3:5"
+    :return: the tuple (block#, slot#)
+    """
+    try:
+        block_num, slot_num = value.split(':')
+        return int(block_num), int(slot_num)
+    except ValueError:
+        raise argparse.ArgumentTypeError("%r is not a location BLOCK:SLOT" % value)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Insert rows into / delete records from an existing DB file.")
+    parser.add_argument('filepath', help="the DB file written by Prog1A")
+    parser.add_argument('--insert', metavar='CSV', help="a CSV file (with column name row) whose rows are inserted")
+    parser.add_argument('--delete', metavar='BLOCK:SLOT', type=location, nargs='+', default=[],
+                        help="records to delete")
+    parser.add_argument('--pool-frames', type=int, default=64,
+                        help="the number of blocks the buffer pool holds in memory (default: 64)")
+    parser.add_argument('--pool-policy', choices=sorted(POLICIES), default='lru',
+                        help="the replacement policy of the buffer pool (default: lru)")
+    args = parser.parse_args()
+    if args.pool_frames < 1:
+        parser.error("--pool-frames must be 1 or more")
+    if not os.path.exists(args.filepath):
+        print("File does not exist!")
+    else:
+        with DBFile(args.filepath, args.pool_frames, args.pool_policy) as db:
+            for block_num, slot_num in args.delete:
+                try:
+                    db.delete(block_num, slot_num)
+                except (IndexError, KeyError) as error:
+                    print("Cannot delete block# %d slot# %d: %s" % (block_num, slot_num, error.args[0]))
+                else:
+                    print("Deleted block# %d slot# %d" % (block_num, slot_num))
+            if args.insert:
+                count = 0
+                with open(args.insert, 'r') as read_obj:
+                    csv_reader = reader(read_obj)
+                    next(csv_reader)  # skip column name row
+                    for row in csv_reader:
+                        db.insert(row)
+                        count += 1
+                print("Inserted %d records, the file has %d blocks" % (count, db.num_blocks))
+        print(db.pool.report())
@@ -0,0 +1,227 @@
+"""
+Optional columnar query engine over the DB file, built on NumPy.
+
+ColumnStore decodes every block of a BlockFile into column arrays in a few vectorized passes over the mapped bytes:
+
+    block, slot     the location of every record (int64)
+    quantity        int64, with quantity_null set where the bitmap marks it null or it is not all digits
+    date            datetime64[D], NaT where the bitmap marks it null
+    type_code       int8 codes into type_categories, -1 where the bitmap marks it null
+
+Predicates are then evaluated as boolean masks over whole columns instead of one record at a time, and only the
+selected records are decoded back into field values. NumPy is not needed by the rest of the programs; if it is not
+installed, AVAILABLE is False and Prog1B keeps using its row-at-a-time scan.
+
+Decoding the columns costs several times more than a query over them, so given the path of the DB file, ColumnStore
+caches the columns in a sidecar file (dbfile.txt -> dbfile.col, in NumPy's .npz format) stamped with the size and
+mtime of the DB file. A later ColumnStore over the same file loads the columns from it instead of decoding the blocks;
+a missing, unreadable or stale cache is rebuilt.
+"""
+
+import os
+import zipfile
+
+import codec
+from bptree import db_stamp
+
+try:
+    import numpy as np
+    AVAILABLE = True
+except ImportError:
+    np = None
+    AVAILABLE = False
+
+MAX_QUANTITY_DIGITS = 18  # longer quantities do not fit into int64 and are treated as null
+COLUMNS = ('block', 'slot', 'start', 'length', 'type_code', 'date', 'quantity', 'quantity_null')
+
+
+def column_path_for(db_path):
+    """
+    This function is to get the path of the column cache that belongs to a DB file
+    :param db_path: the path to the DB file, e.g. "dbfile.txt"
+    :return: the path to the column cache, e.g. "dbfile.col"
+    """
+    return os.path.splitext(db_path)[0] + '.col'
+
+
+def _digits(buffer, positions, width):
+    """
+    This function is to parse fixed-width decimal numbers at many positions of a buffer at once
+    :param buffer: the uint8 array of the file
+    :param positions: the positions of the first digit
+    :param width: the number of digits
+    :return: an int64 array of the numbers
+    """
+    values = np.zeros(len(positions), dtype=np.int64)
+    for k in range(width):
+        values = values * 10 + (buffer[positions + k].astype(np.int64) - 48)
+    return values
+
+
+class ColumnStore:
+    def __init__(self, blocks, db_path=None):
+        """
+        Class ColumnStore Instructor. Decodes all records of the DB file into column arrays, or loads them from the
+        column cache of the DB file if it is up to date.
+        :param blocks: the BlockFile of the DB file
+        :param db_path: the path to the DB file to cache the columns for, or None to always decode the blocks
+        """
+        if not AVAILABLE:
+            raise RuntimeError("The columnar engine needs NumPy, which is not installed.")
+        self.blocks = blocks
+        self.buffer = np.frombuffer(blocks.view, dtype=np.uint8)
+        self.cached = db_path is not None and self._load(db_path)  # cached: True if the columns came from the cache
+        if not self.cached:
+            self._decode()
+            if db_path is not None:
+                self._save(db_path)
+
+    def _load(self, db_path):
+        """
+        This function is to load the columns from the column cache of the DB file
+        :param db_path: the path to the DB file
+        :return: True if the columns are loaded, False if the cache is missing, unreadable or stale
+        """
+        path = column_path_for(db_path)
+        if not os.path.exists(path):
+            return False
+        try:
+            with np.load(path) as arrays:
+                if tuple(arrays['stamp'].tolist()) != db_stamp(db_path):
+                    return False
+                for name in COLUMNS:
+                    setattr(self, name, arrays[name])
+                self.type_categories = arrays['type_categories'].tolist()
+        except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile):
+            return False
+        return True
+
+    def _save(self, db_path):
+        """
+        This function is to write the columns into the column cache of the DB file; a cache that cannot be written
+        (e.g. in a read-only directory) is skipped
+        :param db_path: the path to the DB file
+        :return: None
+        """
+        try:
+            with open(column_path_for(db_path), 'wb') as fp:
+                np.savez(fp, stamp=np.array(db_stamp(db_path), dtype=np.int64),
+                         type_categories=np.array(self.type_categories, dtype=str),
+                         **{name: getattr(self, name) for name in COLUMNS})
+        except OSError:
+            pass
+
+    def _decode(self):
+        """
+        This function is to decode all records of the DB file into the column arrays
+        :return: None
+        """
+        blocks, buffer = self.blocks, self.buffer
+        num_blocks = len(blocks)
+        block_starts = np.arange(num_blocks, dtype=np.int64) * blocks.stride
+
+        # slot directory: one row per record
+        counts = _digits(buffer, block_starts, 3)
+        self.block = np.repeat(np.arange(num_blocks, dtype=np.int64), counts)
+        first_record = np.cumsum(counts) - counts
+        self.slot = np.arange(len(self.block), dtype=np.int64) - np.repeat(first_record, counts)
+        slot_positions = self.block * blocks.stride + 6 + 6 * self.slot
+        self.start = self.block * blocks.stride + _digits(buffer, slot_positions, 3)
+        self.length = _digits(buffer, slot_positions + 3, 3)
+
+        # bitmap; every field of a deleted record (slot length 000) is null
+        deleted = self.length == 0
+        nulls = [(buffer[self.start + 8 + k] == 49) | deleted for k in range(4)]  # "1"
+
+        # type as a categorical column
+        type_key = ((buffer[self.start + 12].astype(np.int32) << 16) | (buffer[self.start + 13].astype(np.int32) << 8)
+                    | buffer[self.start + 14].astype(np.int32))
+        keys, codes = np.unique(np.where(nulls[0], -1, type_key), return_inverse=True)
+        self.type_categories = [bytes([key >> 16, (key >> 8) & 255, key & 255]).decode('ascii')
+                                for key in keys.tolist() if key != -1]
+        self.type_code = np.where(nulls[0], -1, codes - (1 if len(keys) and keys[0] == -1 else 0)).astype(np.int8)
+
+        # date as datetime64[D]
+        years = _digits(buffer, self.start + 15, 4)
+        months = _digits(buffer, self.start + 20, 2)
+        days = _digits(buffer, self.start + 23, 2)
+        valid = ~nulls[1]
+        dates = np.full(len(self.start), np.datetime64('NaT'), dtype='datetime64[D]')
+        dates[valid] = ((years[valid] - 1970).astype('datetime64[Y]').astype('datetime64[M]') + (months[valid] - 1)
+                        ).astype('datetime64[D]') + (days[valid] - 1)
+        self.date = dates
+
+        # quantity as int64 with a null mask; values that are not all digits never match, as in the row scan
+        quantity_null = nulls[3].copy()
+        quantity_start = self.start + np.where(quantity_null, 0, _digits(buffer, self.start + 4, 2))
+        quantity_length = np.where(quantity_null, 0, _digits(buffer, self.start + 6, 2))
+        quantity_null |= (quantity_length == 0) | (quantity_length > MAX_QUANTITY_DIGITS)
+        quantity_length = np.where(quantity_null, 0, quantity_length)
+        quantities = np.zeros(len(self.start), dtype=np.int64)
+        for k in range(int(quantity_length.max(initial=0))):
+            in_field = k < quantity_length
+            digit = buffer[np.where(in_field, quantity_start + k, 0)].astype(np.int64) - 48
+            quantity_null |= in_field & ((digit < 0) | (digit > 9))
+            quantities = np.where(in_field, quantities * 10 + digit, quantities)
+        self.quantity = np.where(quantity_null, 0, quantities)
+        self.quantity_null = quantity_null
+
+    def close(self):
+        """
+        This function is to drop the array over the mapped file, so that the BlockFile can be closed
+        :return: None
+        """
+        self.buffer = None
+
+    def __len__(self):
+        return len(self.start)
+
+    def quantity_between(self, m, n):
+        """
+        This function is to get the mask of records whose quantity is in [m, n]
+        :param m: the lower bound of quantity (inclusive)
+        :param n: the upper bound of quantity (inclusive)
+        :return: a boolean array
+        """
+        largest = np.iinfo(np.int64).max
+        return ~self.quantity_null & (self.quantity >= min(m, largest)) & (self.quantity <= min(n, largest))
+
+    def quantity_equals(self, value):
+        """
+        This function is to get the mask of records whose quantity equals a value
+        :param value: the quantity
+        :return: a boolean array
+        """
+        if value > np.iinfo(np.int64).max:
+            return np.zeros(len(self), dtype=bool)
+        return ~self.quantity_null & (self.quantity == value)
+
+    def type_is(self, chip_type):
+        """
+        This function is to get the mask of records of a chip type
+        :param chip_type: the chip type, e.g. "CPU"
+        :return: a boolean array
+        """
+        if chip_type not in self.type_categories:
+            return np.zeros(len(self), dtype=bool)
+        return self.type_code == self.type_categories.index(chip_type)
+
+    def date_between(self, first, last):
+        """
+        This function is to get the mask of records released between two dates
+        :param first: the first date (inclusive), as "YYYY-MM-DD"
+        :param last: the last date (inclusive), as "YYYY-MM-DD"
+        :return: a boolean array
+        """
+        return (self.date >= np.datetime64(first, 'D')) & (self.date <= np.datetime64(last, 'D'))
+
+    def select(self, mask):
+        """
+        This function is to decode the records selected by a mask
+        :param mask: a boolean array
+        :return: a list of (block#, slot#, record) in file order, same as the one of Prog1B.scan_range()
+        """
+        view = self.blocks.view
+        return [(block, slot, codec.decode_record(str(view[start: start + length], codec.ENCODING)))
+                for block, slot, start, length in zip(self.block[mask].tolist(), self.slot[mask].tolist(),
+                                                      self.start[mask].tolist(), self.length[mask].tolist())]
@@ -0,0 +1,154 @@
+"""
+The 16-level free-space map of the DB file, backed by a segment tree of maximum fractions.
+
+Each block has a free-space fraction in 0 - 15 (the number of sixteenths of the block that are free). Prog1A places a
+record into the first block whose fraction is large enough for it. Scanning the map from block 0 makes each insert
+cost O(#blocks); the segment tree answers "first block >= start with fraction >= k" in O(log #blocks) and gives the
+same block as the scan.
+
+The map is persisted next to the DB file (dbfile.txt -> dbfile.fsm) so that records can be inserted into an existing
+file without reading every block: a header line with the size and mtime (ns) of the DB file it belongs to, then one
+hexadecimal digit per block.
+"""
+
+import os
+
+from bptree import db_stamp
+
+PAGE_SIZE = 1000
+LEVELS = 16
+
+
+def fraction_needed(length):
+    """
+    This function is to get the smallest free-space fraction of a block that can take a record. It is the exact
+    integer form of the check "length <= fraction / 16 * 1000".
+    :param length: the length of the record structure
+    :return: the smallest fraction in 0 - 16 (16 means that no block can take the record)
+    """
+    return -(-length * LEVELS // PAGE_SIZE)
+
+
+class FreeSpaceMap:
+    def __init__(self, fractions=()):
+        """
+        Class FreeSpaceMap Instructor.
+        :param fractions: the initial fractions of blocks 0, 1, ...
+        """
+        self.fractions = list(fractions)
+        self._build(max(1, len(self.fractions)))
+
+    def _build(self, capacity):
+        # tree[1] is the root, the leaves are tree[size:], unused leaves are -1 so that they never match
+        self.size = 1
+        while self.size < capacity:
+            self.size *= 2
+        self.tree = [-1] * (2 * self.size)
+        self.tree[self.size: self.size + len(self.fractions)] = self.fractions
+        for i in range(self.size - 1, 0, -1):
+            self.tree[i] = max(self.tree[2 * i], self.tree[2 * i + 1])
+
+    def __len__(self):
+        return len(self.fractions)
+
+    def __getitem__(self, block):
+        return self.fractions[block]
+
+    def __setitem__(self, block, fraction):
+        self.fractions[block] = fraction
+        i = block + self.size
+        self.tree[i] = fraction
+        i >>= 1
+        while i:
+            best = max(self.tree[2 * i], self.tree[2 * i + 1])
+            if self.tree[i] == best:
+                break
+            self.tree[i] = best
+            i >>= 1
+
+    def __iter__(self):
+        return iter(self.fractions)
+
+    def append(self, fraction):
+        """
+        This function is to add the fraction of a new block at the end of the map
+        :param fraction: the free-space fraction of the new block
+        :return: the block# of the new block
+        """
+        self.fractions.append(fraction)
+        if len(self.fractions) > self.size:
+            self._build(2 * self.size)  # doubling keeps appends amortized O(1)
+        else:
+            self[len(self.fractions) - 1] = fraction
+        return len(self.fractions) - 1
+
+    def first_fit(self, k, start=0):
+        """
+        This function is to find the first block, at or after block# start, whose fraction is at least k
+        :param k: the smallest acceptable fraction
+        :param start: the first block# to consider
+        :return: the block#, or -1 if there is no such block
+        """
+        if start >= len(self.fractions):
+            return -1
+        tree = self.tree
+        i = start + self.size
+        # walk right (and up) until reaching a subtree that holds a large enough fraction
+        while tree[i] < k:
+            while i & 1:
+                i >>= 1
+            if i == 0:
+                return -1
+            i += 1
+        # walk down to the leftmost leaf of that subtree that holds a large enough fraction
+        while i < self.size:
+            i = 2 * i if tree[2 * i] >= k else 2 * i + 1
+        return i - self.size
+
+
+def fsm_path_for(db_path):
+    """
+    This function is to get the path of the free-space map file that belongs to a DB file
+    :param db_path: the path to the DB file, e.g. "dbfile.txt"
+    :return: the path to the free-space map file, e.g. "dbfile.fsm"
+    """
+    return os.path.splitext(db_path)[0] + '.fsm'
+
+
+def write_free_space_map(fractions, db_path, path=None):
+    """
+    This function is to persist the free-space map of a DB file
+    :param fractions: the fractions of blocks 0, 1, ...
+    :param db_path: the path to the DB file the map belongs to (must already be written)
+    :param path: the path to the free-space map file; by default it is derived from db_path
+    :return: None
+    """
+    if path is None:
+        path = fsm_path_for(db_path)
+    size, mtime = db_stamp(db_path)
+    with open(path, 'w') as fp:
+        fp.write("FSM%012d%020d\n" % (size, mtime))
+        fp.write("%s\n" % ''.join("%x" % fraction for fraction in fractions))
+
+
+def read_free_space_map(db_path, path=None):
+    """
+    This function is to read the persisted free-space map of a DB file if it exists and is up to date
+    :param db_path: the path to the DB file
+    :param path: the path to the free-space map file; by default it is derived from db_path
+    :return: a FreeSpaceMap, or None if the file is missing, unreadable or stale
+    """
+    if path is None:
+        path = fsm_path_for(db_path)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as fp:
+        lines = fp.read().splitlines()
+    try:
+        if len(lines) != 2 or not lines[0].startswith("FSM"):
+            raise ValueError
+        if (int(lines[0][3:15]), int(lines[0][15:35])) != db_stamp(db_path):
+            return None
+        return FreeSpaceMap([int(digit, 16) for digit in lines[1]])
+    except ValueError:
+        return None
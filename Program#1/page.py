@@ -0,0 +1,145 @@
+"""
+In-memory representation of a block of the DB file, used while loading and while editing the file in place.
+
+On disk a block is PAGE_SIZE characters:
+
+    nnnfff[oooooollllll]*.......[record]*
+        nnn: the number of records in the block (3-digit characters)
+        fff: the free space end, i.e. the position of the last free character (3-digit characters)
+        ooo/lll: offset and length of each record, in insertion order (3-digit characters each); a length of 000
+                 marks a deleted record (a tombstone), whose slot is reused by a later insert
+        ...: free space
+        records grow from the end of the block towards the slot directory
+
+A Page keeps the record bytes in a bytearray and the header and slot directory as plain ints, and only produces the
+on-disk characters when the block is flushed. The bytes of deleted records stay in place until an insert needs them,
+at which point the live records are compacted towards the end of the block.
+"""
+
+PAGE_SIZE = 1000
+SLOT_SIZE = 6  # 3-digit offset + 3-digit length
+HEADER_SIZE = 6  # 3-digit number of records + 3-digit free space end
+
+
+class Page:
+    __slots__ = ('num_records', 'free_space_end', 'slots', 'data', 'dead_bytes', 'num_dead')
+
+    def __init__(self):
+        """
+        Class Page Instructor. Creates an empty page.
+        """
+        self.num_records = 0
+        self.free_space_end = PAGE_SIZE - 1
+        self.slots = []  # slots: (offset, length) of each record
+        self.data = bytearray(b'.' * PAGE_SIZE)
+        self.dead_bytes = 0  # dead_bytes: bytes of deleted records not yet reclaimed
+        self.num_dead = 0  # num_dead: slots whose record is deleted
+
+    @classmethod
+    def from_bytes(cls, block):
+        """
+        This function is to read a page back from the on-disk block format
+        :param block: the block in bytes (PAGE_SIZE bytes, without line terminator)
+        :return: the Page
+        """
+        page = cls.__new__(cls)
+        page.data = bytearray(block[:PAGE_SIZE])
+        page.num_records = int(page.data[:3])
+        page.free_space_end = int(page.data[3:6])
+        directory = bytes(page.data[HEADER_SIZE: HEADER_SIZE + page.num_records * SLOT_SIZE])
+        page.slots = [(int(directory[k: k + 3]), int(directory[k + 3: k + 6]))
+                      for k in range(0, len(directory), SLOT_SIZE)]
+        page.dead_bytes = PAGE_SIZE - 1 - page.free_space_end - sum(length for _, length in page.slots)
+        page.num_dead = sum(1 for _, length in page.slots if length == 0)
+        return page
+
+    def free_space(self):
+        """
+        This function is to get the number of free bytes between the slot directory and the records
+        :return: the number of free bytes
+        """
+        return self.free_space_end - (self.num_records * SLOT_SIZE + HEADER_SIZE - 1)
+
+    def fraction(self):
+        """
+        This function is to get the value of the page in the 16-level free-space map, counting the bytes of deleted
+        records as free
+        :return: the free-space fraction in 0 - 15
+        """
+        return int((self.free_space() + self.dead_bytes) / PAGE_SIZE * 16)
+
+    def has_room(self, length):
+        """
+        This function is to check if a record fits into the page, possibly after compaction
+        :param length: the length of the record structure
+        :return: boolean value
+        """
+        return length + (0 if self.num_dead else SLOT_SIZE) <= self.free_space() + self.dead_bytes
+
+    def insert(self, record):
+        """
+        This function is to put a record at the end of the free space and add its slot, or reuse the slot of a deleted
+        record
+        :param record: the record structure in bytes
+        :return: the slot# of the record
+        """
+        length = len(record)
+        if not self.has_room(length):
+            raise ValueError("Record does not fit into the page: %s" % bytes(record))
+        if self.dead_bytes and self.free_space() < length + (0 if self.num_dead else SLOT_SIZE):
+            self.compact()
+        offset = self.free_space_end + 1 - length
+        self.data[offset: self.free_space_end + 1] = record  # insert record structure
+        self.free_space_end = offset - 1  # adjust free space end
+        if self.num_dead:
+            slot = next(i for i, (_, old_length) in enumerate(self.slots) if old_length == 0)
+            self.slots[slot] = (offset, length)
+            self.num_dead -= 1
+            return slot
+        self.slots.append((offset, length))  # add record offset and length
+        self.num_records += 1
+        return self.num_records - 1
+
+    def delete(self, slot):
+        """
+        This function is to delete a record by turning its slot into a tombstone. Its bytes are reclaimed by a later
+        insert into the page.
+        :param slot: the slot# of the record
+        :return: None
+        """
+        offset, length = self.slots[slot]
+        if length == 0:
+            raise KeyError("slot# %d is already deleted" % slot)
+        self.slots[slot] = (offset, 0)
+        self.dead_bytes += length
+        self.num_dead += 1
+
+    def compact(self):
+        """
+        This function is to move the live records next to each other at the end of the page, keeping their slot#s, so
+        that the bytes of deleted records become free space
+        :return: None
+        """
+        data = bytearray(b'.' * PAGE_SIZE)
+        end = PAGE_SIZE - 1
+        for slot, (offset, length) in enumerate(self.slots):
+            if length == 0:
+                self.slots[slot] = (0, 0)
+                continue
+            data[end + 1 - length: end + 1] = self.data[offset: offset + length]
+            self.slots[slot] = (end + 1 - length, length)
+            end -= length
+        self.data = data
+        self.free_space_end = end
+        self.dead_bytes = 0
+
+    def to_bytes(self):
+        """
+        This function is to serialize the page into the on-disk block format
+        :return: the block in bytes (PAGE_SIZE bytes, without line terminator)
+        """
+        block = bytearray(self.data)
+        directory = b"%03d%03d" % (self.num_records, self.free_space_end)
+        directory += b''.join([b"%03d%03d" % slot for slot in self.slots])
+        block[:len(directory)] = directory
+        return block
@@ -0,0 +1,242 @@
+"""
+Binary page format of the DB file, an alternative to the text format of page.py / codec.py.
+
+The text format spells every number as zero-padded digits and is capped at 1000-character blocks by its 3-digit offsets.
+The binary format stores the same records in PAGE_SIZE (4 KB) pages with no line terminator:
+
+    MMMMccffSSSS[SSSS]*.......[record]*
+        MMMM: the magic bytes b"DBPG", which tell the binary format from the text format
+        cc: the number of slots in the page (little-endian uint16)
+        ff: the free space end, i.e. the position of the last free byte (little-endian uint16)
+        SSSS: offset and length of each record, in insertion order (little-endian uint16 each); a length of 0 marks a
+              deleted record
+        ...: free space (zero bytes)
+        records grow from the end of the page towards the slot directory
+
+A record is a 3-byte header followed by the fields that are not null, in the order type, date, name, quantity:
+
+    bnq[ttt][dddddddddd][name][quantity]
+        b: null bitmap, bit k is set if field k (type, date, name, quantity) is null
+        n / q: length of name / quantity in bytes (uint8); both are stored as UTF-8
+
+The same values are null as in the text format, so a file converts to the other format and back without loss (see
+convert.py). The slot directory of a page is read with a single struct call.
+"""
+
+import struct
+
+import zonemap
+from bptree import EntrySpill
+from codec import DATE_PATTERN, ENCODING, QUANTITY_PATTERN, decode_text, encode_text
+from fsm import FreeSpaceMap, LEVELS
+
+MAGIC = b"DBPG"
+PAGE_SIZE = 4096
+HEADER = struct.Struct('<4sHH')  # magic, number of slots, free space end
+SLOT_SIZE = 4  # uint16 offset + uint16 length
+RECORD_HEADER = struct.Struct('<BBB')  # null bitmap, length of name, length of quantity
+
+NULL_TYPE, NULL_DATE, NULL_NAME, NULL_QUANTITY = 1, 2, 4, 8
+
+
+def is_binary(block):
+    """
+    This function is to check if a block (or the start of a DB file) is in the binary format
+    :param block: the block in bytes
+    :return: boolean value
+    """
+    return bytes(block[:4]) == MAGIC
+
+
+def fraction_needed(length):
+    """
+    This function is to get the smallest free-space fraction of a page that can take a record and its slot
+    :param length: the length of the record
+    :return: the smallest fraction in 0 - 16 (16 means that no page can take the record)
+    """
+    return -(-(length + SLOT_SIZE) * LEVELS // PAGE_SIZE)
+
+
+def encode_record(ls):
+    """
+    This function is for converting a list of field values into a binary record
+    :param ls: the list of field values [name, type, date, quantity]
+    :return: the record in bytes
+    """
+    name, chip_type, date, quantity = encode_text(ls[0]), ls[1], ls[2], ls[3]
+    bitmap = 0
+    fields = b""
+    if chip_type == "CPU" or chip_type == "GPU":
+        fields += chip_type.encode(ENCODING)
+    else:
+        bitmap |= NULL_TYPE
+    if DATE_PATTERN.match(date):
+        fields += date[:10].encode(ENCODING)
+    else:
+        bitmap |= NULL_DATE
+    if name:
+        fields += name.encode(ENCODING)
+    else:
+        bitmap |= NULL_NAME
+    if QUANTITY_PATTERN.match(quantity):
+        quantity = encode_text(quantity)
+        fields += quantity.encode(ENCODING)
+    else:
+        bitmap |= NULL_QUANTITY
+        quantity = ""
+    if len(name) > 255 or len(quantity) > 255:
+        raise ValueError("Name or quantity longer than 255 bytes: %s" % ls)
+    return RECORD_HEADER.pack(bitmap, len(name), len(quantity)) + fields
+
+
+def decode_record(record):
+    """
+    This function is for converting a binary record into a tuple of field values
+    :param record: the record in bytes
+    :return: the tuple of field values (name, type, date, quantity), "" for null values
+    """
+    bitmap, name_length, quantity_length = RECORD_HEADER.unpack_from(record)
+    text = str(record[3:], ENCODING)
+    position = 0
+    chip_type = date = ""
+    if not bitmap & NULL_TYPE:
+        chip_type = text[:3]
+        position = 3
+    if not bitmap & NULL_DATE:
+        date = text[position: position + 10]
+        position += 10
+    name = decode_text(text[position: position + name_length])
+    quantity = decode_text(text[position + name_length: position + name_length + quantity_length])
+    return name, chip_type, date, quantity
+
+
+def page_header(block):
+    """
+    This function is to read the header of a binary page
+    :param block: the page in bytes
+    :return: a tuple (number of slots, free space end)
+    """
+    _, count, free_space_end = HEADER.unpack_from(block)
+    return count, free_space_end
+
+
+def free_bytes(count, free_space_end):
+    """
+    This function is to get the free space of a binary page from its header
+    :param count: the number of slots
+    :param free_space_end: the free space end
+    :return: the number of free bytes between the slot directory and the records
+    """
+    return free_space_end + 1 - (HEADER.size + count * SLOT_SIZE)
+
+
+def decode_slots(block):
+    """
+    This function is for reading the slot directory of a binary page in one struct call
+    :param block: the page in bytes
+    :return: a list of (offset, length) of the records, in insertion order; deleted records have length 0
+    """
+    count = page_header(block)[0]
+    values = struct.unpack_from('<%dH' % (2 * count), block, HEADER.size)
+    return list(zip(values[0::2], values[1::2]))
+
+
+def decode_block(block):
+    """
+    This function is for converting all records of a binary page into columns of field values
+    :param block: the page in bytes
+    :return: a tuple of lists (names, types, dates, quantities), one element per slot in insertion order; the fields
+             of a deleted record are all ""
+    """
+    records = [decode_record(block[offset: offset + length]) if length else ("", "", "", "")
+               for offset, length in decode_slots(block)]
+    return tuple(list(column) for column in zip(*records)) if records else ([], [], [], [])
+
+
+class BinaryPage:
+    __slots__ = ('slots', 'free_space_end', 'data')
+
+    def __init__(self):
+        """
+        Class BinaryPage Instructor. Creates an empty page.
+        """
+        self.slots = []  # slots: (offset, length) of each record
+        self.free_space_end = PAGE_SIZE - 1
+        self.data = bytearray(PAGE_SIZE)
+
+    def free_space(self):
+        """
+        This function is to get the number of free bytes between the slot directory and the records
+        :return: the number of free bytes
+        """
+        return free_bytes(len(self.slots), self.free_space_end)
+
+    def fraction(self):
+        """
+        This function is to get the value of the page in the 16-level free-space map
+        :return: the free-space fraction in 0 - 15
+        """
+        return min(LEVELS - 1, self.free_space() * LEVELS // PAGE_SIZE)
+
+    def insert(self, record):
+        """
+        This function is to put a record at the end of the free space and add its slot
+        :param record: the record in bytes
+        :return: the slot# of the record
+        """
+        if len(record) + SLOT_SIZE > self.free_space():
+            raise ValueError("Record does not fit into the page: %s" % bytes(record))
+        offset = self.free_space_end + 1 - len(record)
+        self.data[offset: self.free_space_end + 1] = record
+        self.free_space_end = offset - 1
+        self.slots.append((offset, len(record)))
+        return len(self.slots) - 1
+
+    def to_bytes(self):
+        """
+        This function is to serialize the page into the on-disk format
+        :return: the page in bytes (PAGE_SIZE bytes)
+        """
+        block = bytearray(self.data)
+        directory = HEADER.pack(MAGIC, len(self.slots), self.free_space_end)
+        directory += struct.pack('<%dH' % (2 * len(self.slots)), *[value for slot in self.slots for value in slot])
+        block[:len(directory)] = directory
+        return block
+
+
+def write_pages(rows, fp):
+    """
+    This function is to pack rows into binary pages, placing every record into the first page with room for it, and
+    write the pages to an opened DB file
+    :param rows: an iterable of lists of field values [name, type, date, quantity]
+    :param fp: the DB file opened for binary writing
+    :return: a tuple (free-space map, EntrySpill of the index entries (quantity, block#, slot#), zone maps, number of
+             records)
+    """
+    pages = [BinaryPage()]
+    free_space_map = FreeSpaceMap([pages[0].fraction()])
+    index_entries = EntrySpill()  # index_entries: (quantity, block#, slot#) for the B+-tree index on quantity
+    zones = [zonemap.new_zone()]  # zones: the zone map of every page
+
+    total_record = 0
+    for row in rows:
+        total_record += 1
+        record = encode_record(row)
+        needed = fraction_needed(len(record))
+        if needed >= LEVELS:
+            raise ValueError("Record of row %d does not fit into a page: %s" % (total_record, record))
+        i = free_space_map.first_fit(needed)
+        if i == -1:
+            pages += [BinaryPage()]
+            i = free_space_map.append(pages[-1].fraction())
+            zones += [zonemap.new_zone()]
+        slot = pages[i].insert(record)
+        fields = decode_record(record)
+        if QUANTITY_PATTERN.fullmatch(fields[3]):
+            index_entries.append((int(fields[3]), i, slot))
+        zonemap.add_fields(zones[i], fields)
+        free_space_map[i] = pages[i].fraction()
+
+    for page in pages:
+        fp.write(page.to_bytes())
+    return free_space_map, index_entries, zones, total_record
@@ -0,0 +1,148 @@
+"""
+LRU cache of range query results for Prog1B, keyed on the version of the DB file.
+
+Prog1A writes the version of the DB file it produced into a sidecar file (dbfile.txt -> dbfile.ver): its size, mtime
+and CRC-32. The cache remembers, for each queried range [M, N], the (block#, slot#, quantity) of every matching record.
+A query for a range inside a cached range is answered by filtering the cached result. Before every lookup the cache
+checks the version of the DB file (see refresh()) and drops everything if it changed.
+"""
+
+import os
+import zlib
+from collections import OrderedDict
+
+from bptree import db_stamp
+
+
+def version_path_for(db_path):
+    """
+    This function is to get the path of the version file that belongs to a DB file
+    :param db_path: the path to the DB file, e.g. "dbfile.txt"
+    :return: the path to the version file, e.g. "dbfile.ver"
+    """
+    return os.path.splitext(db_path)[0] + '.ver'
+
+
+def content_hash(db_path):
+    """
+    This function is to compute the CRC-32 of a DB file
+    :param db_path: the path to the DB file
+    :return: the CRC-32 as an int
+    """
+    crc = 0
+    with open(db_path, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(1 << 20), b''):
+            crc = zlib.crc32(chunk, crc)
+    return crc
+
+
+def write_version(db_path):
+    """
+    This function is to record the version of a DB file that was just written
+    :param db_path: the path to the DB file
+    :return: None
+    """
+    size, mtime = db_stamp(db_path)
+    with open(version_path_for(db_path), 'w') as fp:
+        fp.write("%d %d %d\n" % (size, mtime, content_hash(db_path)))
+
+
+def db_version(db_path):
+    """
+    This function is to get the version of a DB file. The CRC-32 recorded by Prog1A is used while the file still has
+    the recorded size and mtime; otherwise the file is hashed again, so a file that was only touched keeps its version.
+    :param db_path: the path to the DB file
+    :return: a tuple (size, CRC-32)
+    """
+    size, mtime = db_stamp(db_path)
+    try:
+        with open(version_path_for(db_path), 'r') as fp:
+            recorded_size, recorded_mtime, crc = [int(value) for value in fp.read().split()]
+        if (recorded_size, recorded_mtime) == (size, mtime):
+            return size, crc
+    except (OSError, ValueError):
+        pass
+    return size, content_hash(db_path)
+
+
+class QueryCache:
+    def __init__(self, db_path, capacity=32):
+        """
+        Class QueryCache Instructor.
+        :param db_path: the path to the DB file whose query results are cached
+        :param capacity: the maximum number of cached ranges (0 disables the cache)
+        """
+        if capacity < 0:
+            raise ValueError("capacity must be 0 or more, got %d" % capacity)
+        self.db_path = db_path
+        self.capacity = capacity
+        self.entries = OrderedDict()  # entries: (M, N) -> list of (block#, slot#, quantity) in file order
+        self.version = db_version(db_path)
+        self._stamp = db_stamp(db_path)
+        self.hits = 0
+        self.subrange_hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def refresh(self):
+        """
+        This function is to drop every cached result if the DB file changed since the last call. Only a stat is done
+        while size and mtime stay the same.
+        :return: True if the DB file changed
+        """
+        stamp = db_stamp(self.db_path)
+        if stamp == self._stamp:
+            return False
+        self._stamp = stamp
+        version = db_version(self.db_path)
+        if version == self.version:
+            return False
+        self.version = version
+        if self.entries:
+            self.entries.clear()
+            self.invalidations += 1
+        return True
+
+    def get(self, m, n):
+        """
+        This function is to look up the records with quantity in [m, n]
+        :param m: the lower bound of quantity (inclusive)
+        :param n: the upper bound of quantity (inclusive)
+        :return: a list of (block#, slot#, quantity) in file order, or None on a miss
+        """
+        if (m, n) in self.entries:
+            self.entries.move_to_end((m, n))
+            self.hits += 1
+            return self.entries[(m, n)]
+        # the smallest cached range that covers [m, n] needs the least filtering
+        covering = [key for key in self.entries if key[0] <= m and n <= key[1]]
+        if covering:
+            key = min(covering, key=lambda k: len(self.entries[k]))
+            self.entries.move_to_end(key)
+            self.subrange_hits += 1
+            return [entry for entry in self.entries[key] if m <= entry[2] <= n]
+        self.misses += 1
+        return None
+
+    def put(self, m, n, locations):
+        """
+        This function is to remember the result of a range query
+        :param m: the lower bound of quantity (inclusive)
+        :param n: the upper bound of quantity (inclusive)
+        :param locations: a list of (block#, slot#, quantity) in file order
+        :return: None
+        """
+        if self.capacity == 0:
+            return
+        self.entries[(m, n)] = locations
+        self.entries.move_to_end((m, n))
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+    def report(self):
+        """
+        This function is to describe the hit / miss counts
+        :return: the description in characters
+        """
+        return ("Query cache: %d hits (%d exact, %d sub-range), %d misses, %d invalidations"
+                % (self.hits + self.subrange_hits, self.hits, self.subrange_hits, self.misses, self.invalidations))
@@ -0,0 +1,211 @@
+"""
+Per-block zone maps of the DB file, kept in a sidecar file next to it (dbfile.txt -> dbfile.zone).
+
+For every block the zone map holds the minimum and maximum quantity, the minimum and maximum release date, and the
+number of null values of each field (counted from the record bitmaps). A range query on quantity can then skip every
+block whose [min, max] does not overlap the queried range without decoding any of its slots.
+
+    Header line:    ZONE ssssssssssss mmmmmmmmmmmmmmmmmmmm
+                        size and mtime (ns) of the DB file the zone maps were built from
+    Block lines:    qqqqqqqqqqqq QQQQQQQQQQQQ dddddddddd DDDDDDDDDD tttttt aaaaaa nnnnnn uuuuuu
+                        min / max quantity, "." if the block holds no quantity
+                        min / max release date, "." if the block holds no date
+                        null counts of type, date, name, quantity
+
+A loader that streams its blocks to the DB file hands the zone map of every block it writes out to a ZoneSpill, a
+temporary file that is read back in block order when the zone map file is written.
+"""
+
+import marshal
+import os
+import tempfile
+
+from bptree import db_stamp
+from codec import QUANTITY_PATTERN
+
+QUANTITY_WIDTH = 12
+DATE_WIDTH = 10
+LINE_WIDTH = 2 * QUANTITY_WIDTH + 2 * DATE_WIDTH + 4 * 6
+
+
+def zone_path_for(db_path):
+    """
+    This function is to get the path of the zone map file that belongs to a DB file
+    :param db_path: the path to the DB file, e.g. "dbfile.txt"
+    :return: the path to the zone map file, e.g. "dbfile.zone"
+    """
+    return os.path.splitext(db_path)[0] + '.zone'
+
+
+def new_zone():
+    """
+    This function is to get the zone map of an empty block
+    :return: a list [min quantity, max quantity, min date, max date, #null type, #null date, #null name,
+             #null quantity], where the min / max are None while the block holds no such value
+    """
+    return [None, None, None, None, 0, 0, 0, 0]
+
+
+def add_record(zone, record, quantity):
+    """
+    This function is to widen the zone map of a block by a record inserted into it
+    :param zone: the zone map of the block
+    :param record: the record structure in bytes
+    :param quantity: the quantity field of the row the record was built from
+    :return: None
+    """
+    bitmap = bytes(record[8:12])
+    for k in range(4):
+        if bitmap[k] == 49:  # "1"
+            zone[4 + k] += 1
+    if bitmap[1] == 48:  # "0"
+        date = str(record[15:25], 'ascii')
+        if zone[2] is None or date < zone[2]:
+            zone[2] = date
+        if zone[3] is None or date > zone[3]:
+            zone[3] = date
+    if QUANTITY_PATTERN.fullmatch(quantity):
+        value = int(quantity)
+        if zone[0] is None or value < zone[0]:
+            zone[0] = value
+        if zone[1] is None or value > zone[1]:
+            zone[1] = value
+
+
+def add_fields(zone, fields):
+    """
+    This function is to widen the zone map of a block by a record given as decoded field values, for page formats
+    other than the text record structure
+    :param zone: the zone map of the block
+    :param fields: the tuple of field values (name, type, date, quantity), "" for null values
+    :return: None
+    """
+    name, chip_type, date, quantity = fields
+    for k, value in enumerate((chip_type, date, name, quantity)):
+        if value == "":
+            zone[4 + k] += 1
+    if date != "":
+        if zone[2] is None or date < zone[2]:
+            zone[2] = date
+        if zone[3] is None or date > zone[3]:
+            zone[3] = date
+    if QUANTITY_PATTERN.fullmatch(quantity):
+        value = int(quantity)
+        if zone[0] is None or value < zone[0]:
+            zone[0] = value
+        if zone[1] is None or value > zone[1]:
+            zone[1] = value
+
+
+def may_contain(zone, m, n):
+    """
+    This function is to check if a block may hold a record with quantity in [m, n]
+    :param zone: the zone map of the block
+    :param m: the lower bound of quantity (inclusive)
+    :param n: the upper bound of quantity (inclusive)
+    :return: boolean value
+    """
+    return zone[0] is not None and zone[0] <= n and zone[1] >= m
+
+
+class ZoneSpill:
+    def __init__(self):
+        """
+        Class ZoneSpill Instructor. Creates an empty temporary file of zone maps.
+        """
+        fd, self.path = tempfile.mkstemp(suffix='.zone')
+        self.fp = os.fdopen(fd, 'wb')  # fp: the file opened for appending, None once it is closed
+
+    def append(self, zone):
+        """
+        This function is to add the zone map of the next block
+        :param zone: the zone map
+        :return: None
+        """
+        marshal.dump(zone, self.fp)
+
+    def close(self):
+        """
+        This function is to finish writing, e.g. before the spill is handed to another process
+        :return: None
+        """
+        if self.fp is not None:
+            self.fp.close()
+            self.fp = None
+
+    def __iter__(self):
+        self.close()
+        with open(self.path, 'rb') as fp:
+            while True:
+                try:
+                    yield marshal.load(fp)
+                except EOFError:
+                    return
+
+    def remove(self):
+        """
+        This function is to delete the temporary file
+        :return: None
+        """
+        self.close()
+        os.remove(self.path)
+
+
+def write_zone_maps(zones, db_path, path=None):
+    """
+    This function is to write the zone maps of all blocks of a DB file, one block at a time
+    :param zones: an iterable of the zone maps (e.g. a list or a ZoneSpill), one per block in block order
+    :param db_path: the path to the DB file the zone maps belong to (must already be written)
+    :param path: the path to the zone map file; by default it is derived from db_path
+    :return: True if the zone maps are written, False if some quantity does not fit into the file
+    """
+    if path is None:
+        path = zone_path_for(db_path)
+    size, mtime = db_stamp(db_path)
+    with open(path, 'w') as fp:
+        fp.write("ZONE%012d%020d\n" % (size, mtime))
+        for zone in zones:
+            if zone[0] is not None and zone[1] >= 10 ** QUANTITY_WIDTH:
+                fp.close()
+                os.remove(path)
+                return False
+            quantities = ("." * QUANTITY_WIDTH * 2 if zone[0] is None else "%012d%012d" % (zone[0], zone[1]))
+            dates = "." * DATE_WIDTH * 2 if zone[2] is None else zone[2] + zone[3]
+            fp.write(quantities + dates + "%06d%06d%06d%06d\n" % tuple(zone[4:]))
+    return True
+
+
+def read_zone_maps(db_path, path=None):
+    """
+    This function is to read the zone maps of a DB file if they exist and are up to date
+    :param db_path: the path to the DB file
+    :param path: the path to the zone map file; by default it is derived from db_path
+    :return: a list of zone maps, one per block, or None if the file is missing, unreadable or stale
+    """
+    if path is None:
+        path = zone_path_for(db_path)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as fp:
+        lines = fp.read().splitlines()
+    try:
+        if not lines or not lines[0].startswith("ZONE"):
+            raise ValueError
+        if (int(lines[0][4:16]), int(lines[0][16:36])) != db_stamp(db_path):
+            return None
+        zones = []
+        for line in lines[1:]:
+            if len(line) != LINE_WIDTH:
+                raise ValueError
+            zone = new_zone()
+            if line[0] != ".":
+                zone[0] = int(line[:12])
+                zone[1] = int(line[12:24])
+            if line[24] != ".":
+                zone[2] = line[24:34]
+                zone[3] = line[34:44]
+            zone[4:] = [int(line[k: k + 6]) for k in range(44, LINE_WIDTH, 6)]
+            zones += [zone]
+    except ValueError:
+        return None
+    return zones
@@ -12,178 +12,444 @@ Description:
 by the user, and to write out the sorted file. The user needs to provide the following arguments:
 
     1. the complete pathname of the CSV file whose lines are being sorted
-    2. The # of the field on which the file is to be sorted (where the first field is field 1)
+    2. The # of the field on which the file is to be sorted (where the first field is field 1), or a key specification
+       with several fields, types, directions and null placement such as "2,4:int:desc" (see sortkey.py)
     3. R, the Pass 0 run-length (# of records to be sorted per group)
     4. W, the "way" for Passes 1 - n (maximum initial # of runs being merged at a time)
+    5. (optional) --replacement-selection, to generate the Pass 0 runs by replacement selection
+    6. (optional) --jobs N, to sort the Pass 0 groups and merge the W-run groups of every pass in N processes, and
+       --max-open-files, the bound on the run files open at a time across these processes
 
     The algorithm runs as follows:
         For Pass 0:
-            The script reads R lines from the provided CSV file at a time. Sorting these R lines using the provided
-        field, and write out the sorted lines to file "run0-[r].csv". Until the records in the CSV file are exhausted.
+            The script reads R records from the provided CSV file at a time. Sorting these R records using the provided
+        field, and write out the sorted records to file "run0-[r].run". Until the records in the CSV file are
+        exhausted.
+            With replacement selection, the script keeps R records in a min-heap instead. It writes out the smallest
+        record that can still extend the current run and replaces it by the next record read; a record smaller than
+        the last one written waits in the heap for the next run. With the same R records of memory, runs average about
+        2R records on random input, and nearly sorted input becomes a single run.
 
         For Pass 1 - n:
-            The script merge-sorts every W run files from the last pass, and write out the sorted lines to file
-        "run[p]-[r].csv"。Until all run files from the last pass are exhausted.
+            The script merge-sorts every W run files from the last pass, and write out the sorted records to file
+        "run[p]-[r].run"。Until all run files from the last pass are exhausted.
             Eventually, there is only one run file. Adding headers to this file, the script writes out the sorted
         CSV file.
 
+        Quoted fields (with commas, quotes or line breaks inside) are read as in RFC 4180: a record goes on to the
+    next line as long as a quoted field is open, and only records with quotes are parsed with the csv module, the
+    others are split on commas. A record is parsed once, in Pass 0, where its sort key is also encoded; the run files
+    store blocks of R (key, text of the record) pairs in the marshal format, so Passes 1 - n neither split lines nor
+    encode keys again, and the sorted CSV file is written from the text of the records as it was read. The files are
+    buffered in blocks sized from R. The run files are only read back by the same Python, which the marshal format
+    requires.
+
+        The groups of R records of Pass 0 are independent of each other, and so are the groups of W run files of a
+    pass, so with --jobs they are handed to a process pool, a few at a time; every pass still waits for the previous
+    one.
+
 Operational requirements: Python 3.8.10
 External libraries: None
 
 """
 
-import sys
+import argparse
+import csv
+import heapq
+import io
 import os
 import math
+import marshal
+import statistics
+import struct
+from collections import deque
 from contextlib import ExitStack
+from itertools import islice
+from multiprocessing import Pool
+from operator import itemgetter
+
+import sortkey
+
+RECORD_BYTES = 128  # a generous estimate of the size of a record, for sizing the I/O buffers from R
+BLOCK_HEADER = struct.Struct('<I')  # the length in bytes of a block of a run file
+
+
+def buffer_size(r):
+    """
+    This function is to get the size of the I/O buffers of the CSV and run files, so that a block of R records is read
+    or written in one go
+    :param r: the # of records in a block
+    :return: the buffer size in bytes
+    """
+    return max(io.DEFAULT_BUFFER_SIZE, r * RECORD_BYTES)
+
+
+def run_reader(file):
+    """
+    This function is to read a run file one block of R records at a time
+    :param file: the run file, opened for binary reading
+    :return: a generator of (key, text of the record) in the order of the run file
+    """
+    while True:
+        header = file.read(BLOCK_HEADER.size)
+        if not header:
+            return
+        yield from marshal.loads(file.read(BLOCK_HEADER.unpack(header)[0]))
+
+
+def write_block(fp, block):
+    """
+    This function is to write a block of (key, text) entries into a run file, as its length followed by the
+    marshal encoding of the entries
+    :param fp: the run file, opened for binary writing
+    :param block: a list of (key, text of the record)
+    :return: None
+    """
+    data = marshal.dumps(block)
+    fp.write(BLOCK_HEADER.pack(len(data)))
+    fp.write(data)
 
 
-def merge_sort(files, field, r):
+def merge_sort(files):
     """
     This function is to mimic the merge-sort process in Passes 1 - n. We feed the function with W run files from last
-    pass, and get sorted records composed of records from these W run files.
-    :param files: a list of run files (quantity = W)
-    :param field: the field used for sorting
-    :param r: the maximum number of records can be loaded in a block
-    :return: a list of records from run files but in sorted order
+    pass, and get sorted records composed of records from these W run files. The current record of every run file is
+    kept in a min-heap on (key, run#), so each record costs O(log W) comparisons of keys that were encoded in Pass 0;
+    records with equal keys are taken from the run file that comes first, as in Pass 0. Records are produced one at a
+    time, so at most one block of R records per run file is in memory.
+    :param files: a list of run files (quantity = W), opened for binary reading
+    :return: a generator of the (key, text of the record) from run files but in sorted order
+    """
+    # heap: (key, run#, text, reader) of the current record of each run file that is not exhausted
+    heap = []
+    for i, file in enumerate(files):
+        reader = run_reader(file)
+        first = next(reader, None)
+        if first is not None:
+            heap += [(first[0], i, first[1], reader)]
+    heapq.heapify(heap)
+
+    while heap:
+        # Hand out the record with the smallest value
+        key, i, text, reader = heap[0]
+        yield key, text
+        # Replace it by the next record of the same run file, or drop the run file if it is exhausted
+        following = next(reader, None)
+        if following is None:
+            heapq.heappop(heap)
+        else:
+            heapq.heapreplace(heap, (following[0], i, following[1], reader))
+
+
+def read_records(file):
     """
-    sorted_run = []  # sorted_run: the list of records to be returned
-    run = [[] for _ in range(len(files))]  # run: the blocks for all run files
+    This function is to read the records of a CSV file, with quoted fields as in RFC 4180. Only the records whose first
+    line has a quote are parsed by the csv module, which reads on to the next lines while a quoted field is open; a
+    quote inside an unquoted field is a literal character, as for the csv module.
+    :param file: the CSV file opened with newline=''
+    :return: a generator of (list of field values, text of the record ending with a line feed)
+    """
+    lines = iter(file)
+    first = []  # first: the first line of the record handed to the csv reader
+    taken = []  # taken: the lines of that record read by the csv reader so far
+
+    def feed():
+        while True:
+            line = first.pop() if first else next(lines, None)
+            if line is None:
+                return
+            taken.append(line)
+            yield line
 
-    # For each run file, we read "r" records.
-    for i in range(len(files)):
-        for _ in range(r):
-            try:
-                run[i] += [next(files[i])]
-            except StopIteration:
+    reader = csv.reader(feed())  # reader: the csv reader, which is kept for the whole file
+    for line in lines:
+        if '"' in line:
+            first.append(line)
+            taken.clear()
+            fields = next(reader)
+            yield fields, ''.join(taken).rstrip('\r\n') + '\n'
+        else:
+            line = line.rstrip('\r\n')
+            yield line.split(','), line + '\n'
+
+
+def write_run(entries, filename, r):
+    """
+    This function is to write (key, text) entries into a run file one block of R entries at a time. A block is
+    stored as one marshal object, so the records and their keys are read back without parsing any text.
+    :param entries: an iterable of (key, text of the record) in sorted order
+    :param filename: the path to the run file
+    :param r: the number of entries written at a time
+    :return: the # of entries written
+    """
+    entries = iter(entries)
+    count = 0
+    with open(filename, 'wb', buffering=buffer_size(r)) as fp:
+        while True:
+            block = list(islice(entries, r))
+            if not block:
                 break
+            write_block(fp, block)
+            count += len(block)
+    return count
+
+
+def sort_group(run, key):
+    """
+    This function is to sort a group of records on their keys, encoding the key of every record once
+    :param run: the group of records, each (list of field values, text)
+    :param key: the function giving the sort key of a record (see sortkey.py)
+    :return: a list of (key, text) in sorted order; records with equal keys stay in input order
+    """
+    entries = [(key(fields), text) for fields, text in run]
+    entries.sort(key=itemgetter(0))
+    return entries
+
+
+def sorted_runs(records, key, r, path):
+    """
+    This function is to generate the Pass 0 runs by sorting R records at a time
+    :param records: an iterable of the records of the CSV file (see read_records()), without the header
+    :param key: the function giving the sort key of a record (see sortkey.py)
+    :param r: the Pass 0 run-length (# of records to be sorted per group)
+    :param path: the folder to store the run files
+    :return: a list of the # of records of every run
+    """
+    records = iter(records)
+    lengths = []  # lengths: the # of records of each run
+    while True:
+        # For each run in Pass 0, read r records
+        run = list(islice(records, r))
+        if not run:
+            break
+        # Sort these r records using internal sorting algorithm, and write them out to run0-[r].run files
+        lengths += [write_run(sort_group(run, key), path + r'run%d-%d.run' % (0, len(lengths)), r)]
+    return lengths
+
+
+def replacement_selection(records, key, r, path):
+    """
+    This function is to generate the Pass 0 runs by replacement selection, holding at most R records in memory
+    :param records: an iterable of the records of the CSV file (see read_records()), without the header
+    :param key: the function giving the sort key of a record (see sortkey.py)
+    :param r: the maximum # of records held in the heap, and the # of records written at a time
+    :param path: the folder to store the run files
+    :return: a list of the # of records of every run
+    """
+    records = iter(records)
+    # heap: (run#, key, input#, text); the input# keeps records with equal keys in input order
+    heap = []
+    for seq, (fields, text) in enumerate(records):
+        heap += [(0, key(fields), seq, text)]
+        if len(heap) == r:
+            break
+    heapq.heapify(heap)
+    seq = len(heap)
+
+    lengths = []  # lengths: the # of records of each run
+    block = []  # block: the entries not yet written to the current run file
+    fp = None
+    while heap:
+        run_num, smallest, _, text = heap[0]
+        if run_num == len(lengths):
+            # the smallest record belongs to the next run: start a new run file
+            if fp is not None:
+                if block:
+                    write_block(fp, block)
+                fp.close()
+            block = []
+            fp = open(path + r'run%d-%d.run' % (0, run_num), 'wb', buffering=buffer_size(r))
+            lengths += [0]
+        block += [(smallest, text)]
+        if len(block) == r:
+            write_block(fp, block)
+            block = []
+        lengths[-1] += 1
+        # replace the record written by the next one; it can only join the current run if it is not smaller
+        following = next(records, None)
+        if following is None:
+            heapq.heappop(heap)
+        else:
+            following_key = key(following[0])
+            heapq.heapreplace(heap, (run_num if following_key >= smallest else run_num + 1, following_key, seq,
+                                     following[1]))
+            seq += 1
+    if fp is not None:
+        if block:
+            write_block(fp, block)
+        fp.close()
+    return lengths
+
+
+def sort_run(field, run, filename, r):
+    """
+    This function is to sort one group of R records and write it out as a run file. It is run by the workers of a
+    parallel Pass 0.
+    :param field: the field used for sorting, or a key specification (see sortkey.py)
+    :param run: the group of records, each (list of field values, text)
+    :param filename: the path to the run file
+    :param r: the # of records written at a time
+    :return: the # of records of the run
+    """
+    return write_run(sort_group(run, sortkey.key_function(field)), filename, r)
 
-    indices = [0 for _ in range(len(run))]  # indices: the current pointer at each block
-
-    # When all indices equal to -1, all records in run files are exhausted.
-    # But before that, we need to compare the values pointed by pointers.
-    while indices.count(-1) != len(run):
-        # Find the record with the smallest value by comparing the values pointed by pointers
-        smallest_group = -1
-        smallest_value = 'null'
-        for i in range(len(run)):
-            if indices[i] == -1:
-                continue
-            value = run[i][indices[i]].strip().split(',')[field - 1]
-            if value < smallest_value or smallest_value == 'null':
-                smallest_group = i
-                smallest_value = value
-        # Load the record with the smallest value into the list to be returned
-        sorted_run += [run[smallest_group][indices[smallest_group]]]
-        # Move the pointer to the next record
-        indices[smallest_group] += 1
-        # If the pointer points to the last element in the block
-        if indices[smallest_group] == len(run[smallest_group]):
-            # Trying loading another block
-            run[smallest_group] = []
-            for _ in range(r):
-                try:
-                    run[smallest_group] += [next(files[smallest_group])]
-                except StopIteration:
-                    break
-            # If there is no records left in this run file, then let the pointer point to null
-            if len(run[smallest_group]) == 0:
-                indices[smallest_group] = -1
-            # If there are still records, then let the pointer point to the first record
-            else:
-                indices[smallest_group] = 0
 
-    return sorted_run
+def merge_runs(filenames, filename, r):
+    """
+    This function is to merge-sort W run files from the last pass into one run file, with W + 1 files open. It is run
+    by the workers of a parallel pass.
+    :param filenames: the paths to the run files from the last pass
+    :param filename: the path to the run file to write
+    :param r: the maximum number of records can be loaded in a block
+    :return: the # of records of the run
+    """
+    with ExitStack() as stack:
+        files = [stack.enter_context(open(fname, 'rb', buffering=buffer_size(r))) for fname in filenames]
+        # Call function merge_sort() to do merge-sort on w run files, writing the sorted run as it goes
+        return write_run(merge_sort(files), filename, r)
 
 
-def main(filepath, field, r, w):
+def bounded_map(pool, function, arguments, limit):
+    """
+    This function is to call a function in a process pool with at most "limit" calls in progress, so that the arguments
+    are produced only as they are needed and at most "limit" calls hold files open
+    :param pool: the process pool
+    :param function: the function to call
+    :param arguments: an iterable of tuples of arguments
+    :param limit: the maximum # of calls in progress
+    :return: a generator of the results, in the order of the arguments
+    """
+    pending = deque()
+    for args in arguments:
+        pending.append(pool.apply_async(function, args))
+        if len(pending) >= limit:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+def main(filepath, field, r, w, replacement=False, jobs=1, max_open_files=256):
     """
     The main function implements the external multi-way merge sort according to the following arguments, and writes out
-    the records to CSV file named with suf-fix "-sorted".
+    the records to CSV file named with suf-fix "-sorted". Every pass streams its records from the input files to the
+    output file, so at most (W + 1) * R records are in memory, whatever the size of the CSV file.
     :param filepath: the complete pathname of the CSV file whose lines are being sorted
-    :param field: the field used for sorting
+    :param field: the field used for sorting, or a key specification (see sortkey.py)
     :param r: the Pass 0 run-length (# of records to be sorted per group)
     :param w: the "way" for Passes 1 - n (maximum initial # of runs being merged at a time)
+    :param replacement: generate the Pass 0 runs by replacement selection instead of sorting R records at a time
+    :param jobs: the # of worker processes
+    :param max_open_files: the maximum # of run files open at a time in the worker processes
     :return: null
     """
 
-    # Read original csv files
-    file = open(filepath, 'r')
-    lines = file.readlines()  # lines: all lines in the original csv files
-    header = lines[0]  # header: the header of CSV file
+    key = sortkey.key_function(field)  # key: the encoded sort key of a record, computed once per record in Pass 0
+    pool = Pool(jobs) if jobs > 1 else None  # pool: the worker processes, None to run everything in this process
+    try:
+        # Create folder to store intermediate run files
+        path = './runs/'  # path: the folder to store intermediate run files
+        if not os.path.exists(path):
+            # Create a new directory because it does not exist
+            os.makedirs(path)
+            print("The directory for runs is created!")
 
-    # Create folder to store intermediate run files
-    path = './runs/'  # path: the folder to store intermediate run files
-    if not os.path.exists(path):
-        # Create a new directory because it does not exist
-        os.makedirs(path)
-        print("The directory for runs is created!")
+        # Pass 0
+        with open(filepath, 'r', newline='', buffering=buffer_size(r)) as file:
+            records = read_records(file)  # records: (list of field values, text) of every record of the CSV file
+            header = next(records, ([], ""))[1]  # header: the header of CSV file
+            if replacement:
+                lengths = replacement_selection(records, key, r, path)
+            elif pool is not None:
+                # the groups of R records are read one after another, and sorted and written by the workers
+                groups = iter(lambda: list(islice(records, r)), [])
+                arguments = ((field, run, path + r'run%d-%d.run' % (0, i), r) for i, run in enumerate(groups))
+                lengths = list(bounded_map(pool, sort_run, arguments, min(2 * jobs, max_open_files)))
+            else:
+                lengths = sorted_runs(records, key, r, path)
+        num_runs = len(lengths)  # num_runs: # runs in Pass 0
+        print("Pass %d created %d runs." % (0, num_runs))
+        if lengths:
+            print("Run lengths: min %d, median %g, mean %.1f, max %d (R = %d)"
+                  % (min(lengths), statistics.median(lengths), statistics.mean(lengths), max(lengths), r))
 
-    # Pass 0
-    # Determine the number of runs in Pass 0
-    num_runs = math.ceil((len(lines) - 1) / r)  # num_runs: # runs in Pass 0
-    for i in range(num_runs):
-        # For each run in Pass 0, read r records
-        run = lines[(1 + r * i): min((1 + r * (i + 1)), len(lines))]
-        run = [item.strip().split(',') for item in run]
-        # Sort these r records using internal sorting algorithm
-        run.sort(key=lambda x: x[field - 1])
-        # Write out the sorted records to run0-[r].csv files
-        with open(path + r'run%d-%d.csv' % (0, i), 'w') as fp:
-            for sublist in run:
-                fp.write("%s\n" % ','.join(sublist))
-    print("Pass %d created %d runs." % (0, num_runs))
-
-    # Pass 1 - n
-    cur_pass = 1  # cur_pass: the current pass number
-    while num_runs > 1:  # Stop until the number of runs is 1
-        num_runs_cur = math.ceil(num_runs / w)  # num_runs_cur: the number of runs for the current pass
-        for i in range(num_runs_cur):
+        # Pass 1 - n
+        cur_pass = 1  # cur_pass: the current pass number
+        while num_runs > 1:  # Stop until the number of runs is 1
+            num_runs_cur = math.ceil(num_runs / w)  # num_runs_cur: the number of runs for the current pass
             # For each run, read w run files from last run
-            filenames = [path + r'run%d-%d.csv' % (cur_pass - 1, j) for j in range(i * w, min((i + 1) * w, num_runs))]
-            with ExitStack() as stack:
-                files = [stack.enter_context(open(fname, 'r')) for fname in filenames]
-                # Call function merge_sort() to do merge-sort on w run files
-                sorted_run = merge_sort(files, field, r)
-            # Write the sorted run files into csv files
-            with open(path + r'run%d-%d.csv' % (cur_pass, i), 'w') as fp:
-                for sublist in sorted_run:
-                    fp.write("%s" % sublist)
-        # Update the number of runs
-        num_runs = num_runs_cur
-        print("Pass %d created %d runs." % (cur_pass, num_runs))
-        # Update the current pass
-        cur_pass += 1
+            groups = []  # groups: the arguments of merge_runs() for every run of the current pass
+            for i in range(num_runs_cur):
+                filenames = [path + r'run%d-%d.run' % (cur_pass - 1, j)
+                             for j in range(i * w, min((i + 1) * w, num_runs))]
+                groups += [(filenames, path + r'run%d-%d.run' % (cur_pass, i), r)]
+            if pool is None:
+                for group in groups:
+                    merge_runs(*group)
+            else:
+                # every merge holds W + 1 files open
+                list(bounded_map(pool, merge_runs, groups, max(1, min(jobs, max_open_files // (w + 1)))))
+            # Update the number of runs
+            num_runs = num_runs_cur
+            print("Pass %d created %d runs." % (cur_pass, num_runs))
+            # Update the current pass
+            cur_pass += 1
+    finally:
+        # the workers are stopped on errors too, instead of being left behind
+        if pool is not None:
+            pool.terminate()
+            pool.join()
 
     # Verification
-    # Read the last run file
-    file = open(path + r'run%d-%d.csv' % (cur_pass - 1, 0), 'r')
-    lines = file.readlines()
-
-    # Check if the value of the latter record is greater than or equal to the one of the former record
-    for i in range(1, len(lines)):
-        assert lines[i - 1].strip().split(',')[field - 1] <= lines[i].strip().split(',')[field - 1]
-
-    # Add header to the last run file to construct new csv file
-    lines = [header] + lines
+    # Copy the records of the last run file behind the header to construct new csv file, one block at a time, checking
+    # that the value of the latter record is greater than or equal to the one of the former record
     filename_old = os.path.basename(filepath)
     filename_new = '.'.join(filename_old.split('.')[:-1]) + '-sorted.' + filename_old.split('.')[-1]
-    with open(filename_new, 'w') as fp:
-        for sublist in lines:
-            fp.write("%s" % sublist)
+    num_lines = 0
+    previous = None
+    with open(path + r'run%d-%d.run' % (cur_pass - 1, 0), 'rb', buffering=buffer_size(r)) as file, \
+            open(filename_new, 'w', newline='', buffering=buffer_size(r)) as fp:
+        fp.write(header)
+        entries = run_reader(file)
+        while True:
+            block = list(islice(entries, r))
+            if not block:
+                break
+            for value, _ in block:
+                assert previous is None or previous <= value
+                previous = value
+            fp.writelines(map(itemgetter(1), block))
+            num_lines += len(block)
 
     print("The completed file's name is \"%s\"." % filename_new)
-    print("It contains %d lines" % (len(lines) - 1))
-    print("VERIFIED: The completed file is in sorted order by field %d." % field)
+    print("It contains %d lines" % num_lines)
+    print("VERIFIED: The completed file is in sorted order by %s %s."
+          % ('field' if str(field).isdigit() else 'key', field))
 
 
 if __name__ == '__main__':
-    fn = sys.argv[1]
-    Field = int(sys.argv[2])
-    R = int(sys.argv[3])
-    W = int(sys.argv[4])
+    parser = argparse.ArgumentParser(description="Sort a CSV file on one or more fields by external multi-way merge "
+                                                 "sort.")
+    parser.add_argument('filepath', help="the complete pathname of the CSV file whose lines are being sorted")
+    parser.add_argument('field', help="the # of the field on which the file is to be sorted (from 1), or a key "
+                                      "specification such as \"2,4:int:desc\"")
+    parser.add_argument('r', metavar='R', type=int, help="the Pass 0 run-length (# of records sorted per group)")
+    parser.add_argument('w', metavar='W', type=int, help="the \"way\" for Passes 1 - n (# of runs merged at a time)")
+    parser.add_argument('--replacement-selection', dest='replacement', action='store_true',
+                        help="generate the Pass 0 runs by replacement selection (runs of about 2R records)")
+    parser.add_argument('--jobs', type=int, default=1,
+                        help="the # of processes sorting the Pass 0 groups and merging the groups of a pass "
+                             "(default: 1)")
+    parser.add_argument('--max-open-files', type=int, default=256,
+                        help="the maximum # of run files open at a time across the processes (default: 256)")
+    args = parser.parse_args()
+    try:
+        sortkey.parse_key_spec(args.field)
+    except ValueError as error:
+        parser.error(str(error))
+    fn = args.filepath
     if os.path.exists(fn):
         print("Processing file: " + fn)
-        main(fn, Field, R, W)
+        main(fn, args.field, args.r, args.w, replacement=args.replacement, jobs=args.jobs,
+             max_open_files=args.max_open_files)
     else:
         print("File does not exist!")
\ No newline at end of file
@@ -0,0 +1,139 @@
+"""
+Benchmarks for the external multi-way merge sort.
+
+    python3 benchmark.py merge [--records 200000] [--ways 2 16 128] [--r 1000] [--repeat 3]
+        Merges W sorted runs of synthetic CSV records with the linear scan of the run heads Prog2 used to do, over
+        lines of text, and with the min-heap merge in Prog2.merge_sort(), over run files of encoded keys and records,
+        and checks that both give the same records in the same order.
+"""
+
+import argparse
+import io
+import random
+import time
+
+import Prog2
+import sortkey
+
+
+def synthetic_runs(records, ways, seed=0):
+    """
+    This function is to generate W sorted runs of CSV records, with many equal keys so that ties are exercised
+    :param records: the total number of records
+    :param ways: the number of runs
+    :param seed: the seed of the random generator
+    :return: a list of runs, each a list of lines sorted on field 1
+    """
+    rng = random.Random(seed)
+    runs = [[] for _ in range(ways)]
+    for k in range(records):
+        runs[k % ways] += ["%06d,Chip %d,%d\n" % (rng.randint(0, records // 4), k, rng.randint(0, 60000))]
+    for run in runs:
+        run.sort(key=lambda line: line.split(',')[0])
+    return runs
+
+
+def merge_linear(files, field, r):
+    """
+    This function is to merge run files by scanning the current record of every run for the smallest key, splitting
+    the candidate records again at every comparison, as Prog2 used to
+    :param files: a list of run files
+    :param field: the field used for sorting
+    :param r: the maximum number of records loaded in a block
+    :return: a list of records in sorted order
+    """
+    sorted_run = []
+    run = [[] for _ in range(len(files))]
+    for i in range(len(files)):
+        for _ in range(r):
+            try:
+                run[i] += [next(files[i])]
+            except StopIteration:
+                break
+    indices = [0 for _ in range(len(run))]
+    while indices.count(-1) != len(run):
+        smallest_group = -1
+        smallest_value = 'null'
+        for i in range(len(run)):
+            if indices[i] == -1:
+                continue
+            value = run[i][indices[i]].strip().split(',')[field - 1]
+            if value < smallest_value or smallest_value == 'null':
+                smallest_group = i
+                smallest_value = value
+        sorted_run += [run[smallest_group][indices[smallest_group]]]
+        indices[smallest_group] += 1
+        if indices[smallest_group] == len(run[smallest_group]):
+            run[smallest_group] = []
+            for _ in range(r):
+                try:
+                    run[smallest_group] += [next(files[smallest_group])]
+                except StopIteration:
+                    break
+            indices[smallest_group] = -1 if len(run[smallest_group]) == 0 else 0
+    return sorted_run
+
+
+def run_file(run, key, r):
+    """
+    This function is to build an in-memory run file in the format Prog2 writes, blocks of R (key, text) entries
+    :param run: the run, a list of lines
+    :param key: the function giving the sort key of a record (see sortkey.py)
+    :param r: the number of records in a block
+    :return: the run file, positioned at its start
+    """
+    file = io.BytesIO()
+    entries = [(key(line.rstrip('\n').split(',')), line) for line in run]
+    for i in range(0, len(entries), r):
+        Prog2.write_block(file, entries[i: i + r])
+    file.seek(0)
+    return file
+
+
+def time_merge(merge, open_runs, runs, r, repeat):
+    """
+    This function is to time a merge function over in-memory run files
+    :param merge: the merge function (files, r) -> records
+    :param open_runs: the function giving the in-memory run file of a run
+    :param runs: the runs, each a list of lines
+    :param r: the number of records loaded in a block
+    :param repeat: the number of runs of the merge
+    :return: a tuple (fastest time in seconds, merged records)
+    """
+    best = None
+    for _ in range(repeat):
+        files = [open_runs(run) for run in runs]
+        start = time.perf_counter()
+        merged = list(merge(files, r))
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return best, merged
+
+
+def bench_merge(args):
+    print("{:<6} {:<10} {:<12} {:<12} {:<8}".format('W', 'Records', 'Linear (s)', 'Heap (s)', 'Speedup'))
+    for ways in args.ways:
+        runs = synthetic_runs(args.records, ways)
+        key = sortkey.key_function('1')
+        linear_time, linear = time_merge(lambda files, r: merge_linear(files, 1, r),
+                                         lambda run: io.StringIO(''.join(run)), runs, args.r, args.repeat)
+        heap_time, merged = time_merge(lambda files, r: (text for _, text in Prog2.merge_sort(files)),
+                                       lambda run: run_file(run, key, args.r), runs, args.r, args.repeat)
+        assert merged == linear, "the heap merge gave a different order"
+        print("{:<6} {:<10} {:<12.3f} {:<12.3f} {:<8.1f}".format(
+            ways, args.records, linear_time, heap_time, linear_time / heap_time))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmarks for Prog2.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    merge_parser = commands.add_parser('merge', help="linear scan vs min-heap merge of W runs")
+    merge_parser.add_argument('--records', type=int, default=200000)
+    merge_parser.add_argument('--ways', type=int, nargs='+', default=[2, 16, 128])
+    merge_parser.add_argument('--r', type=int, default=1000, help="the number of records loaded in a block")
+    merge_parser.add_argument('--repeat', type=int, default=3)
+    merge_parser.set_defaults(func=bench_merge)
+
+    arguments = parser.parse_args()
+    arguments.func(arguments)
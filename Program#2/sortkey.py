@@ -0,0 +1,124 @@
+"""
+Sort key specifications for the external merge sort, and their encoding into byte strings.
+
+A key specification lists the key fields in order of significance, separated by commas; each field may be followed by
+options separated by colons:
+
+    field[:type][:asc|desc][:nullsfirst|nullslast]
+        field: the # of the field (the first field is field 1)
+        type: str (default), int, float or date (ISO yyyy-mm-dd)
+        asc / desc: the direction (default: asc)
+        nullsfirst / nullslast: where the null values go (default: nullsfirst); a value is null if it is empty or
+                                cannot be read as the type
+
+    e.g. "2,4:int:desc" sorts on field 2 as a string, then on field 4 as an integer in descending order
+
+Every record is encoded once into a byte string whose byte order is the order of the specification, so comparisons
+during the sort are plain bytes comparisons. A field is encoded as a null flag byte followed by the value:
+
+    str: UTF-8, with 0x00 escaped as 0x00 0xFF and terminated by 0x00 0x00, so no encoding is a prefix of another
+    int: a sign byte (0x00 negative, 0x01 zero, 0x02 positive), then for a non-zero value the byte length of its
+         magnitude (2 bytes big-endian) and the magnitude big-endian, both inverted for a negative value; so ints of
+         any size sort by value, and no encoding is a prefix of another
+    float: the 8 bytes of the IEEE 754 double, with the sign bit flipped (or every bit, for negative values)
+    date: the 3-byte big-endian ordinal of the day
+
+A descending field has every byte of its value inverted. A key specification made of a single field number needs no
+encoding: the key is the raw field string, so it sorts exactly as before key specifications existed.
+"""
+
+import struct
+from datetime import date
+
+TYPES = ('str', 'int', 'float', 'date')
+NULL_FIRST = b'\x00'
+NOT_NULL = b'\x01'
+NULL_LAST = b'\x02'
+INVERT = bytes(range(255, -1, -1))  # INVERT: the translation table of byte b -> 255 - b
+
+
+def parse_key_spec(spec):
+    """
+    This function is to parse a key specification
+    :param spec: the key specification in characters, e.g. "2,4:int:desc"
+    :return: a list of (field index from 0, type, descending, nulls last), most significant first
+    """
+    keys = []
+    for item in str(spec).split(','):
+        parts = item.strip().split(':')
+        if not parts[0].isdigit() or int(parts[0]) < 1:
+            raise ValueError("Key field must be a field # from 1: %r" % item)
+        field_type, descending, nulls_last = 'str', False, False
+        for option in parts[1:]:
+            option = option.strip().lower()
+            if option in TYPES:
+                field_type = option
+            elif option in ('asc', 'desc'):
+                descending = option == 'desc'
+            elif option in ('nullsfirst', 'nullslast'):
+                nulls_last = option == 'nullslast'
+            else:
+                raise ValueError("Unknown key option %r in %r" % (option, item))
+        keys += [(int(parts[0]) - 1, field_type, descending, nulls_last)]
+    return keys
+
+
+def encode_value(value, field_type):
+    """
+    This function is to encode a field value into bytes whose byte order is the order of the values
+    :param value: the field value in characters
+    :param field_type: str, int, float or date
+    :return: the encoded value, or None if the value is null
+    """
+    if value == "":
+        return None
+    if field_type == 'int':
+        try:
+            number = int(value)
+        except ValueError:
+            return None
+        if number == 0:
+            return b'\x01'
+        magnitude = abs(number).to_bytes((abs(number).bit_length() + 7) // 8, 'big')
+        encoded = len(magnitude).to_bytes(2, 'big') + magnitude
+        return b'\x02' + encoded if number > 0 else b'\x00' + encoded.translate(INVERT)
+    if field_type == 'float':
+        try:
+            number = float(value)
+        except ValueError:
+            return None
+        if number != number:  # NaN
+            return None
+        bits = int.from_bytes(struct.pack('>d', number), 'big')
+        return (bits ^ (2 ** 64 - 1) if bits >> 63 else bits | 2 ** 63).to_bytes(8, 'big')
+    if field_type == 'date':
+        try:
+            return date.fromisoformat(value).toordinal().to_bytes(3, 'big')
+        except ValueError:
+            return None
+    return value.encode('utf-8').replace(b'\x00', b'\x00\xff') + b'\x00\x00'
+
+
+def key_function(spec):
+    """
+    This function is to build the function that encodes the sort key of a record
+    :param spec: the key specification in characters
+    :return: a function record (list of field values) -> encoded key in bytes (or the raw field string for a single
+             ascending string field, whose order is already the one wanted)
+    """
+    keys = parse_key_spec(spec)
+    if len(keys) == 1 and keys[0][1:] == ('str', False, False):
+        index = keys[0][0]
+        # a missing field is "", as in the encoded keys
+        return lambda record: record[index] if index < len(record) else ""
+
+    def encode(record):
+        encoded = b""
+        for index, field_type, descending, nulls_last in keys:
+            value = encode_value(record[index] if index < len(record) else "", field_type)
+            if value is None:
+                encoded += NULL_LAST if nulls_last else NULL_FIRST
+            else:
+                encoded += NOT_NULL + (value.translate(INVERT) if descending else value)
+        return encoded
+    return encode
@@ -25,6 +25,13 @@ negative integer, and a positive integer range a − b, where a ≤ b. For examp
 
     python3 prog3.py collection9.set 10000 1-1
 
+    Task 2 also accepts --jobs N, to run the tries in N worker processes; --seed S, to make the random schedules
+reproducible (the same seed gives the same result for any N); --ci-width W, to stop once the confidence interval of
+the serializable rate is narrower than W percentage points; and --confidence C, the confidence level (default 95).
+For example:
+
+    python3 prog3.py collection9.set 1000000 1-3 --jobs 8 --seed 1 --ci-width 0.5
+
 Output:
     For Task 1, output the following, using an output format of your design:
     (a) A list of the IDs of the transactions in the schedule file, in ascending order by ID; and
@@ -34,19 +41,30 @@ Output:
     For Task 2, output, again using an output format of your design,
     (a) the command–line arguments,
     (b) the quantity of schedules that were conflict serializable, and
-    (c) the percentage of schedules that were conflict serializable.
+    (c) the percentage of schedules that were conflict serializable, with its confidence interval, and the number of
+    tries per second.
 
 
 Operational requirements: Python 3.8.10
 External libraries: None
 
 """
+import argparse
 import sys
 import os
+import math
+import time
+from array import array
 from collections import defaultdict
+from multiprocessing import Pool
+from statistics import NormalDist
 import random
 import re
 
+OPERATION = re.compile("^([rwcRWC])([0-9]+)[ ]*([a-zA-Z]*)$")  # <op><id><space(s)><item>, see read_operations()
+LARGE_GRAPH = 1 << 16  # the # of vertices from which a Graph keeps its per-vertex integers in arrays
+TRIALS_PER_BATCH = 1000  # the # of random schedules tried by a worker process at a time in task 2
+
 """
 Class "Graph" is used to represent a precedence graph described by a schedule S.
 This graph consists of a pair G = (V, E), where V is a set of vertices and E is a set of edges. 
@@ -58,116 +76,268 @@ The set of edges consists of all edges T_i → T_j for which one of three condit
 
 reference: https://www.geeksforgeeks.org/detect-cycle-in-a-graph/
            https://www.geeksforgeeks.org/python-program-for-topological-sorting/
+           D. J. Pearce and P. H. J. Kelly, "A Dynamic Topological Sort Algorithm for Directed Acyclic Graphs",
+           ACM Journal of Experimental Algorithmics, 11, 2007 (the online cycle check in Graph.addEdge())
 """
 
 
 class Graph:
-    def __init__(self, vertices):
+    def __init__(self, vertices, compact=None):
         """
-        Class Graph Instructor.
+        Class Graph Instructor. The out-edges and the in-edges of every vertex are kept in dicts used as ordered sets,
+        so adding, finding and deleting an edge costs O(1), the edges of a vertex are visited in the order they were
+        added, and deleting the edges of a vertex only touches those edges. Vertices without edges take no space.
         :param vertices: the maximum number of vertices in the graph
+        :param compact: keep the per-vertex integers (the topological order) in an array of C ints instead of a list
+                        of Python ints; by default, for graphs with LARGE_GRAPH vertices or more
         """
-        self.graph = defaultdict(list)
+        self.graph = defaultdict(dict)  # graph: vertex -> its children, in the order the edges were added
+        self.parents = defaultdict(dict)  # parents: vertex -> the vertices with an edge to it (reverse index)
         self.V = vertices
+        self.compact = vertices >= LARGE_GRAPH if compact is None else compact
+        # order: the position of every vertex in a topological order of the graph, kept up to date as edges are added
+        # (Pearce-Kelly), as long as the graph has no cycle
+        self.order = array('i', range(vertices + 1)) if self.compact else list(range(vertices + 1))
 
     def addEdge(self, u, v):
         """
-        This function is to add edge from vertex u to vertex v
+        This function is to add edge from vertex u to vertex v, and to check if the edge closes a cycle. If u already
+        comes before v in the topological order, nothing else is done; otherwise only the vertices between v and u in
+        the order are searched: those reachable from v, looking for u, and those reaching u, which are then moved
+        ahead of the former.
         :param u: the end vertex that the new added edge is connected from
         :param v: the end vertex that the new added edge is connected to
-        :return: None
+        :return: the vertices of the cycle closed by the edge, [u, v, ..., u's parent on the cycle], or None
         """
-        if v not in self.graph[u]:
-            self.graph[u].append(v)
+        if v in self.graph.get(u, ()):
+            return None
+        self.graph[u][v] = None
+        self.parents[v][u] = None
+        lower, upper = self.order[v], self.order[u]
+        if lower > upper:
+            return None
+
+        # Search forward from v among the vertices placed no later than u
+        forward = []
+        tree = {v: None}  # tree: vertex -> the vertex it was reached from
+        stack = [v]
+        while stack:
+            node = stack.pop()
+            forward += [node]
+            for neighbour in self.graph.get(node, ()):
+                if neighbour == u:
+                    # u is reachable from v: follow the search tree back to v
+                    cycle = []
+                    while node is not None:
+                        cycle += [node]
+                        node = tree[node]
+                    return [u] + cycle[::-1]
+                if neighbour not in tree and self.order[neighbour] <= upper:
+                    tree[neighbour] = node
+                    stack += [neighbour]
+
+        # Search backward from u among the vertices placed no earlier than v
+        backward = []
+        seen = {u}
+        stack = [u]
+        while stack:
+            node = stack.pop()
+            backward += [node]
+            for parent in self.parents.get(node, ()):
+                if parent not in seen and self.order[parent] >= lower:
+                    seen.add(parent)
+                    stack += [parent]
+
+        # Give the positions of both sets to the backward set first, keeping the order inside each set
+        order = self.order.__getitem__
+        positions = sorted(map(order, forward + backward))
+        for position, node in zip(positions, sorted(backward, key=order) + sorted(forward, key=order)):
+            self.order[node] = position
+        return None
 
     def deleteEdgesConnectedTo(self, v):
         """
-        This function is to delete all edges connected with vertex v
+        This function is to delete all edges connected with vertex v, in O(degree of v). The topological order stays
+        valid.
         :param v: the related vertex
         :return: None
         """
-        self.graph[v] = []
-        for key, value in self.graph.items():
-            self.graph[key] = [item for item in value if item != v]
+        for child in self.graph.pop(v, ()):
+            del self.parents[child][v]
+        for parent in self.parents.pop(v, ()):
+            del self.graph[parent][v]
 
     def isCyclicUtil(self, v, visited, recStack):
         """
-        This function is to check if cycle(s) exists from vertex v
+        This function is to check if cycle(s) exists from vertex v, by a depth-first search with an explicit stack
         :param v: vertex
         :param visited: flags if nodes are visited
-        :param recStack: recursion stack
+        :param recStack: flags if nodes are on the current path of the search
         :return: boolean value
         """
 
-        # Mark current node as visited and adds to recursion stack
+        # Mark current node as visited and adds to the path; the stack holds the neighbours left to visit of every
+        # node on the path
         visited[v] = True
         recStack[v] = True
-
-        # Recur for all neighbours if any neighbour is visited and in recStack then graph is cyclic
-        for neighbour in self.graph[v]:
-            if visited[neighbour] == False:
-                if self.isCyclicUtil(neighbour, visited, recStack) == True:
+        stack = [(v, iter(self.graph.get(v, ())))]
+        while stack:
+            node, neighbours = stack[-1]
+            for neighbour in neighbours:
+                # if any neighbour is visited and on the path then graph is cyclic
+                if recStack[neighbour]:
                     return True
-            elif recStack[neighbour] == True:
-                return True
-
-        # The node needs to be popped from recursion stack before function ends
-        recStack[v] = False
+                if not visited[neighbour]:
+                    visited[neighbour] = True
+                    recStack[neighbour] = True
+                    stack += [(neighbour, iter(self.graph.get(neighbour, ())))]
+                    break
+            else:
+                # All neighbours are done: the node is popped from the path
+                recStack[node] = False
+                stack.pop()
         return False
 
     # Returns true if graph is cyclic else false
     def isCyclic(self):
         """
-        This function is to check if a graph has cycle(s)
-        :return: boolean value
+        This function is to check if a graph has cycle(s), in O(V + E)
+        :return: a tuple (boolean value, the vertex the search started from, the visited flags, the flags of the
+                 vertices on the path that closed the cycle)
         """
-        visited = [False] * (self.V + 1)
-        recStack = [False] * (self.V + 1)
+        visited = bytearray(self.V + 1)
+        recStack = bytearray(self.V + 1)
         for node in range(self.V):
-            if visited[node] == False:
-                if self.isCyclicUtil(node, visited, recStack) == True:
+            if not visited[node]:
+                if self.isCyclicUtil(node, visited, recStack):
                     return True, node, visited, recStack
         return False, None, None, None
 
-    # A recursive function used by topologicalSort
-    def topologicalSortUtil(self, v, visited, stack):
+    # A depth-first search used by topologicalSort
+    def topologicalSortUtil(self, v, visited, order):
         """
-        This function is to get topological sorting from vertex v
+        This function is to get topological sorting from vertex v, by a depth-first search with an explicit stack
         :param v: vertex
         :param visited: flags indicating if vertices are visited
-        :param stack: recursion stack
-        :return: boolean value
+        :param order: the vertices in the order their search finished, which the vertices reached from v are appended
+                      to
+        :return: None
         """
 
-        # Mark the current node as visited.
+        # Mark the current node as visited; the stack holds the vertices adjacent to every vertex on the path that are
+        # left to visit
         visited[v] = True
+        stack = [(v, iter(self.graph.get(v, ())))]
+        while stack:
+            node, neighbours = stack[-1]
+            for i in neighbours:
+                if not visited[i]:
+                    visited[i] = True
+                    stack += [(i, iter(self.graph.get(i, ())))]
+                    break
+            else:
+                # Push current vertex to the finished vertices
+                order += [node]
+                stack.pop()
 
-        # Recur for all the vertices adjacent to this vertex
-        for i in self.graph[v]:
-            if visited[i] == False:
-                self.topologicalSortUtil(i, visited, stack)
-
-        # Push current vertex to stack which stores result
-        stack.insert(0, v)
-
-    # The function to do Topological Sort. It uses recursive topologicalSortUtil()
+    # The function to do Topological Sort. It uses topologicalSortUtil()
     def topologicalSort(self):
         """
-        This function is to get the topological sorting of the graph
+        This function is to get the topological sorting of the graph, in O(V + E)
         :return: a list of vertices in topological sorting order
         """
         # Mark all the vertices as not visited
-        visited = [False] * (self.V + 1)
-        stack = []
+        visited = bytearray(self.V + 1)
+        order = []
 
-        # Call the recursive helper function to store Topological
+        # Call the helper function to store Topological
         # Sort starting from all vertices one by one
         for i in range(1, self.V + 1):
-            if visited[i] == False:
-                self.topologicalSortUtil(i, visited, stack)
+            if not visited[i]:
+                self.topologicalSortUtil(i, visited, order)
 
-        # Print contents of stack
-        return stack
+        # A vertex finishes after all the vertices it has an edge to, so the reversed order is topological
+        order.reverse()
+        return order
+
+
+def read_operations(filename):
+    """
+    This function is to read the operations of a schedule (.sch) or transaction set (.set) file, parsing each of them
+    once. An operation must match the pattern <op><id><space(s)><item>
+        where, <op> is one of r, w, or c
+               <id> is an integer that identifies the transaction executing <op>
+               <item> is a single upper-case letter representing the DB item being read or written
+                      (and is absent if <op> is c)
+               <space(s)> are one or more spaces (also absent when <op> is c)
+    Lines that are not operations are skipped.
+    :param filename: the path to the file
+    :return: a tuple (lines, operations): the lines of the operations, and (op, transaction ID, item) of each of them
+    """
+    lines = []
+    operations = []
+    with open(filename, 'r') as file:
+        for line in file:
+            line = line.strip()
+            match = OPERATION.match(line)
+            if match:
+                lines += [line]
+                operations += [(match.group(1).lower(), int(match.group(2)), match.group(3))]
+    return lines, operations
+
+
+class ConflictTracker:
+    def __init__(self, transactions):
+        """
+        Class ConflictTracker Instructor. Builds the precedence graph of a schedule one operation at a time. For every
+        DB item, it keeps the transactions that read or wrote the item, and those that wrote it, since their last
+        commit, so an operation only looks at the transactions it conflicts with instead of rescanning the schedule.
+        :param transactions: the IDs of the transactions in the schedule
+        """
+        self.graph = Graph(max(transactions))  # initialize the graph with the number of vertices
+        # accessors / writers: item -> the transactions that read or wrote / wrote the item since their last commit,
+        # in the order of their first such operation (a dict used as an ordered set)
+        self.accessors = defaultdict(dict)
+        self.writers = defaultdict(dict)
+        self.items = defaultdict(set)  # items: transaction -> the items it operated on since its last commit
+        self.not_commit = set(transactions)  # a set to record the transaction not committed yet
+
+    def add(self, op, transaction, item):
+        """
+        This function is to apply the next operation of the schedule to the precedence graph
+        :param op: "r", "w" or "c"
+        :param transaction: the ID of the transaction executing the operation
+        :param item: the DB item being read or written ("" for "c")
+        :return: the transactions of the first conflict cycle closed by the operation (see Graph.addEdge()), or None;
+                 the edges of the operation after that cycle are not added
+        """
+        # If the operation is "commit"
+        if op == 'c':
+            # remove all the edges connected to this transaction from graph
+            self.graph.deleteEdgesConnectedTo(transaction)
+            # its earlier operations no longer conflict with later ones
+            for committed_item in self.items.pop(transaction, ()):
+                self.accessors[committed_item].pop(transaction, None)
+                self.writers[committed_item].pop(transaction, None)
+            # remove this transaction from the not-committed transaction set
+            self.not_commit.discard(transaction)
+            return None
+        # put this transaction back to the non-committed transaction set
+        self.not_commit.add(transaction)
+        # A "write" conflicts with every earlier read or write of the item, a "read" only with the earlier writes, of
+        # other transactions that have not committed since
+        cycle = None
+        for transaction_prev in (self.accessors[item] if op == 'w' else self.writers[item]):
+            if transaction_prev != transaction:
+                cycle = self.graph.addEdge(transaction_prev, transaction)
+                if cycle:
+                    # the topological order is not kept up to date past a cycle, so no further edges are added
+                    break
+        self.accessors[item].setdefault(transaction)
+        if op == 'w':
+            self.writers[item].setdefault(transaction)
+        self.items[transaction].add(item)
+        return cycle
 
 
 def task_one(filename):
@@ -186,75 +356,26 @@ def task_one(filename):
     :return: None
     """
     # 1. Read the schedule from the schedule file
-    lines = open(filename, 'r').readlines()
-    lines = [line.strip() for line in lines]
-    # The operation must match the pattern <op><id><space(s)><item>
-    #   where, <op> is one of r, w, or c
-    #          <id> is an integer that identifies the transaction executing <op>
-    #          <item> is a single upper-case letter representing the DB item being read or written
-    #                 (and is absent if <op> is c)
-    #          <space(s)> are one or more spaces (also absent when <op> is c)
-    pattern = re.compile("^[rwcRWC][0-9]+[ ]*[a-zA-Z]*$")
-    lines = [line for line in lines if pattern.match(line)]
-    transactions = set([int(line.split()[0][1:]) for line in lines])  # Extract all the transactions in schedule file
+    lines, operations = read_operations(filename)
+    # Extract all the transactions in schedule file
+    transactions = set([transaction for _, transaction, _ in operations])
     print("Schedule involves the following transactions: [%s]" % (','.join(str(item) for item in transactions)))
 
     # 2. Construct the precedence graph described by the schedule
-    g = Graph(max(transactions))  # initialize the graph with the number of vertices
-    last_commit = defaultdict(int, {k: -1 for k in transactions})  # a dict to record the operation where each transaction commits last time, initialized as -1
-    not_commit = transactions.copy()  # a set to record the transaction not committed yet
+    tracker = ConflictTracker(transactions)
+    g = tracker.graph
     # Iterate through the operations
-    for i in range(len(lines)):
+    for i, (op, transaction, item) in enumerate(operations):
         line = lines[i]
-        op = line[0]
-        transaction = int(line.split()[0][1:])
-        # If the operation is "commit"
-        if op == 'c':
-            # remove all the edges connected to this transaction from graph
-            g.deleteEdgesConnectedTo(transaction)
-            # record this operation as the place where last commit happens
-            last_commit[transaction] = i
-            # remove this transaction from the not-committed transaction set
-            if transaction in not_commit:
-                not_commit.remove(transaction)
-        # If the operation is either "read" or "write"
-        else:
-            # put this transaction back to the non-committed transaction set
-            if transaction not in not_commit:
-                not_commit.add(transaction)
-            # extract the DB item being operated on
-            variable = line.split()[1]
-            # search the previous operations that operations on the same DB item
-            for j in range(i):
-                line_prev = lines[j]
-                op_prev = line_prev[0]
-                transaction_prev = int(line_prev.split()[0][1:])
-                # If this previous operation has committed, continue
-                if j <= last_commit[transaction_prev]:
-                    continue
-                # If this previous operation is "commit", continue
-                if op_prev == 'c':
-                    continue
-                variable_prev = line_prev.split()[1]
-                # If this previous operation operates on the same DB item but belongs to different transaction
-                if variable_prev == variable and transaction_prev != transaction:
-                    # If the current operation is "write", then any previous eligible operation could crate an edge
-                    if op == 'w':
-                        g.addEdge(transaction_prev, transaction)
-                    # If the current operation is "read", then only previous eligible "write" operation could create an edge
-                    elif op == 'r':
-                        if op_prev == 'w':
-                            g.addEdge(transaction_prev, transaction)
-        # Check if the current graph has cycle(s), and if yes, what nodes are in the cycle(s) (stored in recStack)
-        iscyclic, _, _, recStack = g.isCyclic()
-        # If the current graph has cycle(s), print out the IDs of the transactions participating in the detected cycle
-        if iscyclic:
+        # Add the edges of the operation, checking if one of them closes a cycle (only the part of the graph between
+        # its end vertices in the topological order is searched)
+        cycle = tracker.add(op, transaction, item)
+        # If the current graph has a cycle, print out the IDs of the transactions on the detected cycle, in its order
+        if cycle:
             print("Instruction %d (%s) crated a conflict cycle." % (i+1, line))
-            transactions_cycles = []
-            for index, item in enumerate(recStack):
-                if item:
-                    transactions_cycles += [str(index)]
-            print("These are the transactions participating in cycles: [%s]" % ','.join(transactions_cycles))
+            transactions_cycles = [str(item) for item in cycle]
+            print("These are the transactions participating in the cycle: [%s]" % ','.join(transactions_cycles))
+            print("The cycle: %s" % ' -> '.join(transactions_cycles + transactions_cycles[:1]))
             return
     # If the graph doesn't has cycle(s) until the end, which means the schedule is conflict serializable, and print out
     # a topological ordering of the conflict serializable schedule
@@ -263,12 +384,96 @@ def task_one(filename):
     stack = [str(item) for item in stack]
     ordering = []
     for item in stack:
-        if int(item) in not_commit and int(item) in transactions:
+        if int(item) in tracker.not_commit and int(item) in transactions:
             ordering += [item]
     print("The uncommitted transactions can be serializable to this order: [%s]" % ','.join(ordering))
 
 
-def task_two(filename, number, lowerbound, upperbound):
+def random_schedule(lines_by_transaction, transactions, lowerbound, upperbound, rng):
+    """
+    This function is to create a legal schedule of the transactions by creating a random interleaving of the operations
+    of the transactions: a transaction is picked at random, and its next lowerbound - upperbound operations are added
+    :param lines_by_transaction: the operations of every transaction, in order, indexed by the transaction ID
+    :param transactions: the IDs of the transactions
+    :param lowerbound: the lower bound of the number of operations to be included
+    :param upperbound: the upper bound of the number of operations to be included
+    :param rng: the random.Random generator to draw from
+    :return: a list of operations (op, transaction ID, item)
+    """
+    new_lines = []
+    lines_by_transaction_start = [0 for _ in range(max(transactions) + 1)]
+    transactions_available = transactions.copy()
+    while True:
+        if len(transactions_available) == 0:
+            break
+        ts = rng.choice(sorted(transactions_available))
+        num = rng.randint(lowerbound, upperbound)
+        line_start = lines_by_transaction_start[ts]
+        line_end = min(lines_by_transaction_start[ts] + num - 1, len(lines_by_transaction[ts]) - 1)
+        new_lines += [lines_by_transaction[ts][line_start: (line_end + 1)]]
+        if line_end == len(lines_by_transaction[ts]) - 1:
+            transactions_available.remove(ts)
+        else:
+            lines_by_transaction_start[ts] = line_end + 1
+    return [item for sublist in new_lines for item in sublist]
+
+
+def run_trials(lines_by_transaction, transactions, lowerbound, upperbound, seed, number):
+    """
+    This function is to create random schedules of the transactions and count the conflict serializable ones. It is
+    run by the workers of the process pool; the schedules only depend on the seed.
+    :param lines_by_transaction: the operations of every transaction, in order, indexed by the transaction ID
+    :param transactions: the IDs of the transactions
+    :param lowerbound: the lower bound of the number of operations to be included
+    :param upperbound: the upper bound of the number of operations to be included
+    :param seed: the seed of the random generator, in characters
+    :param number: the number of tries
+    :return: the number of conflict serializable schedules
+    """
+    rng = random.Random(seed)
+    res = 0
+    for _ in range(number):
+        new_lines = random_schedule(lines_by_transaction, transactions, lowerbound, upperbound, rng)
+        conflict_serializable = True
+        tracker = ConflictTracker(transactions)
+        # Iterate through the operations
+        for op, transaction, item in new_lines:
+            # If the operation closes a cycle, record this try as not conflict serializable
+            if tracker.add(op, transaction, item):
+                conflict_serializable = False
+                break
+        # If the graph doesn't has cycle(s) until the end, which means the schedule is conflict serializable, then
+        # increase the variable "res" by 1
+        if conflict_serializable:
+            res += 1
+    return res
+
+
+def run_batch(arguments):
+    """
+    This function is to run a batch of tries (see run_trials())
+    :param arguments: the arguments of run_trials()
+    :return: the number of conflict serializable schedules
+    """
+    return run_trials(*arguments)
+
+
+def confidence_interval(successes, trials, confidence):
+    """
+    This function is to get the Wilson score interval of a rate
+    :param successes: the number of successes
+    :param trials: the number of trials (positive)
+    :param confidence: the confidence level, e.g. 0.95
+    :return: a tuple (lower bound, upper bound) of the rate, in [0, 1]
+    """
+    z = NormalDist().inv_cdf((1 + confidence) / 2)
+    rate = successes / trials
+    center = (rate + z * z / (2 * trials)) / (1 + z * z / trials)
+    half = z / (1 + z * z / trials) * math.sqrt(rate * (1 - rate) / trials + z * z / (4 * trials * trials))
+    return max(0.0, center - half), min(1.0, center + half)
+
+
+def task_two(filename, number, lowerbound, upperbound, jobs=1, seed=None, ci_width=None, confidence=0.95):
     """
     This function conducts the task 2 and does the following:
     1. Read the collection of transactions from the schedule file
@@ -278,10 +483,18 @@ def task_two(filename, number, lowerbound, upperbound):
         (b) Determine whether or not the schedule is conflict serializable
     3. Report the command–line arguments, the quantity of schedules that were conflict serializable, and the
        percentage of schedules that were conflict serializable.
+    The tries are run in batches of TRIALS_PER_BATCH, each with its own random generator seeded from the seed and the
+    batch#, so the result of a seed does not depend on the number of worker processes. The batches are counted in
+    order, and with ci_width the tries stop after the first batch where the confidence interval of the rate is
+    narrower than ci_width.
     :param filename: the path to the .set file
     :param number: the number of tries
     :param lowerbound: the lower bound of the number of operations to be included
     :param upperbound: the upper bound of the number of operations to be included
+    :param jobs: the number of worker processes
+    :param seed: the seed of the tries, None for a random one
+    :param ci_width: stop early once the confidence interval of the rate is narrower than this (a rate in [0, 1])
+    :param confidence: the confidence level of the interval
     :return: None
     """
     # Print out the command–line arguments
@@ -292,108 +505,70 @@ def task_two(filename, number, lowerbound, upperbound):
         return
 
     # 1. Read the schedule from the schedule file
-    lines = open(filename, 'r').readlines()
-    lines = [line.strip() for line in lines]
-    # The operation must match the pattern <op><id><space(s)><item>
-    #   where, <op> is one of r, w, or c
-    #          <id> is an integer that identifies the transaction executing <op>
-    #          <item> is a single upper-case letter representing the DB item being read or written
-    #                 (and is absent if <op> is c)
-    #          <space(s)> are one or more spaces (also absent when <op> is c)
-    pattern = re.compile("^[rwcRWC][0-9]+[ ]*[a-zA-Z]*$")
-    lines = [line for line in lines if pattern.match(line)]
-    transactions = set([int(line.split()[0][1:]) for line in lines])
+    _, operations = read_operations(filename)
+    transactions = set([transaction for _, transaction, _ in operations])
     print("Schedule involves the following transactions: [%s]" % (','.join(str(item) for item in transactions)))
 
     lines_by_transaction = [[] for _ in range(max(transactions) + 1)]
-    for line in lines:
-        lines_by_transaction[int(line.split(' ')[0][1:])] += [line]
-
-    res = 0
-    for _ in range(number):
-        new_lines = []
-        lines_by_transaction_start = [0 for _ in range(max(transactions) + 1)]
-        transactions_available = transactions.copy()
-        while True:
-            if len(transactions_available) == 0:
-                break
-            ts = random.sample(transactions_available, 1)[0]
-            num = random.randint(lowerbound, upperbound)
-            line_start = lines_by_transaction_start[ts]
-            line_end = min(lines_by_transaction_start[ts] + num - 1, len(lines_by_transaction[ts]) - 1)
-            new_lines += [lines_by_transaction[ts][line_start: (line_end + 1)]]
-            if line_end == len(lines_by_transaction[ts]) - 1:
-                transactions_available.remove(ts)
-            else:
-                lines_by_transaction_start[ts] = line_end + 1
-        new_lines = [item for sublist in new_lines for item in sublist]
-
-        conflict_serializable = True
-        g = Graph(max(transactions))  # initialize the graph with the number of vertices
-        last_commit = defaultdict(int, {k: -1 for k in transactions})  # a dict to record the operation where each transaction commits last time, initialized as -1
-        not_commit = transactions.copy()  # a set to record the transaction not committed yet
-        # Iterate through the operations
-        for i in range(len(new_lines)):
-            line = new_lines[i]
-            op = line[0]
-            transaction = int(line.split()[0][1:])
-            # If the operation is "commit"
-            if op == 'c':
-                # remove all the edges connected to this transaction from graph
-                g.deleteEdgesConnectedTo(transaction)
-                # record this operation as the place where last commit happens
-                last_commit[transaction] = i
-                # remove this transaction from the not-committed transaction set
-                if transaction in not_commit:
-                    not_commit.remove(transaction)
-            # If the operation is either "read" or "write"
-            else:
-                # put this transaction back to the non-committed transaction set
-                if transaction not in not_commit:
-                    not_commit.add(transaction)
-                # extract the DB item being operated on
-                variable = line.split()[1]
-                # search the previous operations that operations on the same DB item
-                for j in range(i):
-                    line_prev = new_lines[j]
-                    op_prev = line_prev[0]
-                    transaction_prev = int(line_prev.split()[0][1:])
-                    # If this previous operation has committed, continue
-                    if j <= last_commit[transaction_prev]:
-                        continue
-                    # If this previous operation is "commit", continue
-                    if op_prev == 'c':
-                        continue
-                    variable_prev = line_prev.split()[1]
-                    # If this previous operation operates on the same DB item but belongs to different transaction
-                    if variable_prev == variable and transaction_prev != transaction:
-                        # If the current operation is "write", then any previous eligible operation could crate an edge
-                        if op == 'w':
-                            g.addEdge(transaction_prev, transaction)
-                        # If the current operation is "read", then only previous eligible "write" operation could create an edge
-                        elif op == 'r':
-                            if op_prev == 'w':
-                                g.addEdge(transaction_prev, transaction)
-            # Check if the current graph has cycle(s), and if yes, what nodes are in the cycle(s) (stored in recStack)
-            iscyclic, _, _, recStack = g.isCyclic()
-            # If the current graph has cycle(s), record this try as not conflict serializable
-            if iscyclic:
-                conflict_serializable = False
-                break
-        # If the graph doesn't has cycle(s) until the end, which means the schedule is conflict serializable, then
-        # increase the variable "res" by 1
-        if conflict_serializable:
-            res += 1
+    for operation in operations:
+        lines_by_transaction[operation[1]] += [operation]
+
+    # 2. Run the tries in batches, in this process or in a pool of worker processes
+    if seed is None:
+        seed = random.randrange(2 ** 32)
+    batches = [(lines_by_transaction, transactions, lowerbound, upperbound, "%d-%d" % (seed, i),
+                min(TRIALS_PER_BATCH, number - i * TRIALS_PER_BATCH))
+               for i in range(math.ceil(number / TRIALS_PER_BATCH))]
+    pool = Pool(jobs) if jobs > 1 else None
+    try:
+        start = time.perf_counter()
+        res = 0
+        tries = 0
+        stopped_early = False
+        results = pool.imap(run_batch, batches) if pool is not None else map(run_batch, batches)
+        for batch, batch_res in zip(batches, results):
+            res += batch_res
+            tries += batch[-1]
+            if ci_width is not None and tries < number:
+                lower, upper = confidence_interval(res, tries, confidence)
+                if upper - lower < ci_width:
+                    stopped_early = True
+                    break
+        seconds = time.perf_counter() - start
+    finally:
+        # the batches still running after an early stop or an error are dropped
+        if pool is not None:
+            pool.terminate()
+            pool.join()
 
     # Print out the quantity of schedules that were conflict serializable, and the percentage of schedules that were
     # conflict serializable.
-    print("%d out of %d schedules for the transactions were conflict serializable" % (res, number))
-    print("%.1f%% conflict serializable rate" % (res * 100 / number))
+    print("%d out of %d schedules for the transactions were conflict serializable" % (res, tries))
+    print("%.1f%% conflict serializable rate" % (res * 100 / tries))
+    lower, upper = confidence_interval(res, tries, confidence)
+    print("%g%% confidence interval: [%.2f%%, %.2f%%]" % (confidence * 100, lower * 100, upper * 100))
+    if stopped_early:
+        print("Stopped after %d of %d tries: the confidence interval is narrower than %.2f%%"
+              % (tries, number, ci_width * 100))
+    print("%d tries in %.2f s (%.0f tries/s, %d jobs, seed %d)" % (tries, seconds, tries / seconds, jobs, seed))
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Conflict serializability of a schedule (.sch), or the rate of "
+                                                 "conflict serializable random schedules of a set of transactions "
+                                                 "(.set).")
+    parser.add_argument('filename', help="the .sch or .set file")
+    parser.add_argument('number', nargs='?', help="(.set) the number of random schedules to try")
+    parser.add_argument('range', nargs='?', help="(.set) a - b, the range of the number of operations of a "
+                                                 "transaction added at a time")
+    parser.add_argument('--jobs', type=int, default=1, help="(.set) the number of worker processes")
+    parser.add_argument('--seed', type=int, default=None, help="(.set) the seed of the random schedules")
+    parser.add_argument('--ci-width', type=float, default=None,
+                        help="(.set) stop once the confidence interval of the rate is narrower than this, in percent")
+    parser.add_argument('--confidence', type=float, default=95, help="(.set) the confidence level in percent")
+    args = parser.parse_args()
     try:
-        fn = sys.argv[1]
+        fn = args.filename
         # Check if the path/filename exists
         if os.path.exists(fn):
             # task 1
@@ -401,26 +576,34 @@ if __name__ == '__main__':
                 task_one(fn)
             # task 2
             elif fn.endswith('.set'):
-                num = int(sys.argv[2])
+                if args.number is None or args.range is None:
+                    raise IndexError
+                num = int(args.number)
                 if num < 0:
                     print("The second argument should be a non-negative integer!")
                     sys.exit()
-                lb = int(sys.argv[3].split('-')[0])
+                lb = int(args.range.split('-')[0])
                 if lb <= 0:
                     print("The lower bound should be a positive integer!")
                     sys.exit()
-                ub = int(sys.argv[3].split('-')[1])
+                ub = int(args.range.split('-')[1])
                 if ub <= 0:
                     print("The lower bound should be a positive integer!")
                     sys.exit()
                 if lb > ub:
                     print("The lower bound should be smaller than or equal to the upper bound!")
                     sys.exit()
-                task_two(fn, num, lb, ub)
+                if args.jobs < 1:
+                    print("The number of jobs should be a positive integer!")
+                    sys.exit()
+                if not 0 < args.confidence < 100:
+                    print("The confidence level should be between 0 and 100!")
+                    sys.exit()
+                task_two(fn, num, lb, ub, args.jobs, args.seed,
+                         None if args.ci_width is None else args.ci_width / 100, args.confidence / 100)
             else:
                 print("Only .sch or .set file is accepted.")
         else:
             print("File does not exist!")
     except IndexError:
         print("The arguments entered are incorrect!")
-